@@ -4,6 +4,10 @@ import string
 
 
 def get_port(text, port=None):
+    # a device path, like the ports of a modbus_tk.virtual_serial.VirtualSerialLink, is used as is
+    if isinstance(port, str):
+        return port
+
     ports = serial.tools.list_ports.comports()
 
     if port is None:
@@ -13,16 +17,19 @@ def get_port(text, port=None):
         for i in range(len(ports)):
             print("\t{:2d} - {:s}".format(i, ports[i].device))
 
-        port = int(input("Select port:  "))
+        port = input("Select port (number or path):  ")
+        if not port.isdigit():
+            return port
+        port = int(port)
 
     return ports[port].device
 
 
-def test_connection():
+def test_connection(send_port=None, receive_port=None):
     baudrate = 57600
 
-    ser_send = get_port("Sending")
-    ser_rec = get_port("Receiving")
+    ser_send = get_port("Sending", send_port)
+    ser_rec = get_port("Receiving", receive_port)
 
     with serial.Serial(ser_send, baudrate, timeout=1) as send:
         with serial.Serial(ser_rec, baudrate, timeout=1) as receive:
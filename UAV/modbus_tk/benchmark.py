@@ -0,0 +1,1137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Micro-benchmarks of the modbus_tk hot paths. Run them with:
+   python -m modbus_tk.benchmark [name ...]
+ Every benchmark is run if no name is given
+"""
+from __future__ import print_function
+
+import collections
+import gc
+import io
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from modbus_tk import LOGGER
+from modbus_tk import capture
+from modbus_tk import defines
+from modbus_tk import hooks
+from modbus_tk import modbus
+from modbus_tk import modbus_rtu
+from modbus_tk import modbus_rtu_over_tcp
+from modbus_tk import modbus_tcp
+from modbus_tk import modbus_tcp_pipelined
+from modbus_tk import utils
+from modbus_tk.loadgen import find_free_port, start_tcp_server
+from modbus_tk.virtual_serial import VirtualSerialLink
+
+
+class LoopbackSerial(object):
+    """
+    In-memory replacement of a pyserial object: every written request is answered
+    by the given responder function and the answer is made available for reading
+    """
+
+    def __init__(self, responder, baudrate=19200, timeout=0.5, simulate_line=False, simulate_timeout=False):
+        """
+        Constructor: if simulate_line is true, every write waits for the time needed
+        for sending the request and its answer at the given baudrate. If simulate_timeout
+        is true, a read of more bytes than buffered waits for the timeout like a real port
+        """
+        self.name = "loopback"
+        self.is_open = True
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.inter_byte_timeout = None
+        self._responder = responder
+        self._simulate_line = simulate_line
+        self._simulate_timeout = simulate_timeout
+        self._in_buffer = bytearray()
+
+    def open(self):
+        """open the fake port"""
+        self.is_open = True
+
+    def close(self):
+        """close the fake port"""
+        self.is_open = False
+
+    def reset_input_buffer(self):
+        """discard the pending answer"""
+        del self._in_buffer[:]
+
+    def reset_output_buffer(self):
+        """nothing is buffered on output"""
+        pass
+
+    def flush(self):
+        """nothing is buffered on output"""
+        pass
+
+    def write(self, data):
+        """give the request to the responder and buffer its answer"""
+        answer = self._responder(bytes(data))
+        if self._simulate_line:
+            # 10 bits per byte (start + 8 data + stop) and 3.5 chars of silence after each frame
+            time.sleep((len(data) + len(answer) + 7) * 10.0 / self.baudrate)
+        self._in_buffer += answer
+        return len(data)
+
+    def read(self, size=1):
+        """read at most size bytes of the buffered answer"""
+        if self._simulate_timeout and size > len(self._in_buffer):
+            time.sleep(self.timeout)
+        data = bytes(self._in_buffer[:size])
+        del self._in_buffer[:size]
+        return data
+
+    @property
+    def in_waiting(self):
+        """number of buffered bytes"""
+        return len(self._in_buffer)
+
+
+class CannedResponder(object):
+    """Answer requests from a databank and remember the answer of every different request"""
+
+    def __init__(self, databank, query_class=modbus_rtu.RtuQuery):
+        """Constructor"""
+        self._databank = databank
+        self._query_class = query_class
+        self._answers = {}
+
+    def __call__(self, request):
+        """returns the answer to the request"""
+        try:
+            return self._answers[request]
+        except KeyError:
+            answer = bytes(self._databank.handle_request(self._query_class(), request))
+            self._answers[request] = answer
+            return answer
+
+
+def make_uav_databank():
+    """returns a databank with the 10 input registers read by the UAV at address 1006"""
+    databank = modbus.Databank()
+    slave = databank.add_slave(1)
+    slave.add_block("uav", defines.ANALOG_INPUTS, 1000, 32)
+    slave.set_values("uav", 1006, list(range(10)))
+    return databank
+
+
+def start_rtu_over_tcp_server(databank):
+    """start a thread answering the RTU frames received on a tcp connection and returns its port"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    def serve():
+        """answer the requests of the connection"""
+        sock = listener.accept()[0]
+        responder = CannedResponder(databank)
+        while True:
+            request = sock.recv(256)
+            if not request:
+                break
+            sock.sendall(responder(request))
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return listener.getsockname()[1]
+
+
+def start_pty_slave(databank, baudrate=19200):
+    """
+    start a thread answering the RTU frames written on a new pseudo-terminal after the time
+    needed for sending them at the given baudrate. Returns the pyserial object of the terminal
+    """
+    import serial
+    import tty
+
+    (master_fd, slave_fd) = os.openpty()
+    tty.setraw(slave_fd)
+    responder = CannedResponder(databank)
+
+    def serve():
+        while True:
+            try:
+                request = os.read(master_fd, 256)
+            except OSError:
+                break
+            answer = responder(request)
+            # 10 bits per byte (start + 8 data + stop) and 3.5 chars of silence after each frame
+            time.sleep((len(request) + len(answer) + 7) * 10.0 / baudrate)
+            os.write(master_fd, answer)
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return serial.Serial(os.ttyname(slave_fd), baudrate=baudrate, timeout=0.5)
+
+
+class CountingSocket(object):
+    """Wrap a socket and count the calls to its receiving functions"""
+
+    def __init__(self, sock):
+        """Constructor"""
+        self._sock = sock
+        self.recv_calls = 0
+
+    def __getattr__(self, name):
+        """other attributes are the ones of the socket"""
+        return getattr(self._sock, name)
+
+    def recv(self, *args):
+        """count and receive"""
+        self.recv_calls += 1
+        return self._sock.recv(*args)
+
+    def recv_into(self, *args):
+        """count and receive"""
+        self.recv_calls += 1
+        return self._sock.recv_into(*args)
+
+
+class DelayProxy(object):
+    """
+    TCP relay adding a one-way latency to the data exchanged with a server,
+    without limiting the number of requests on the line
+    """
+
+    def __init__(self, port, latency):
+        """Constructor: relay the connections accepted on self.port to the given port"""
+        self._target = ("127.0.0.1", port)
+        self._latency = latency
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        self._start(self._accept)
+
+    def _start(self, target, *args):
+        """run the function in a daemon thread"""
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        """relay every new connection"""
+        while True:
+            client = self._listener.accept()[0]
+            server = socket.create_connection(self._target)
+            for (src, dst) in ((client, server), (server, client)):
+                line = collections.deque()
+                event = threading.Event()
+                self._start(self._receive, src, line, event)
+                self._start(self._forward, dst, line, event)
+
+    def _receive(self, sock, line, event):
+        """put the received data on the delay line"""
+        while True:
+            try:
+                data = sock.recv(4096)
+            except socket.error:
+                data = b""
+            line.append((time.perf_counter() + self._latency, data))
+            event.set()
+            if not data:
+                break
+
+    def _forward(self, sock, line, event):
+        """send the data of the delay line when their latency has expired"""
+        while True:
+            event.wait()
+            event.clear()
+            while line:
+                (due_time, data) = line.popleft()
+                delay = due_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if not data:
+                    try:
+                        # wake up the thread receiving from this socket
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+                    sock.close()
+                    return
+                sock.sendall(data)
+
+
+def measure(fct, duration=1.0):
+    """call fct for about duration seconds and returns the mean time of a call in seconds"""
+    count, batch = 0, 1
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < duration:
+        for _ in range(batch):
+            fct()
+        count += batch
+        batch *= 2
+        elapsed = time.perf_counter() - start
+    return elapsed / count
+
+
+def report(name, seconds, reference=None):
+    """print the result of a measure"""
+    line = "  {0:<40s} {1:10.2f} us".format(name, seconds * 1e6)
+    if reference:
+        line += "   x{0:.2f}".format(reference / seconds)
+    print(line)
+
+
+def bench_prepare():
+    """execute vs execute_prepared for the 10 registers read of the UAV"""
+    master = modbus_rtu.RtuMaster(LoopbackSerial(CannedResponder(make_uav_databank())))
+    args = (1, defines.READ_INPUT_REGISTERS, 1006, 10)
+    kwargs = {"data_format": ">" + "f" * 5, "word_order": defines.WORD_ORDER_CDAB}
+
+    prepared = master.prepare(*args, **kwargs)
+    if master.execute(*args, **kwargs) != master.execute_prepared(prepared):
+        raise Exception("execute and execute_prepared returns different values")
+
+    reference = measure(lambda: master.execute(*args, **kwargs))
+    report("execute", reference)
+    report("execute_prepared", measure(lambda: master.execute_prepared(prepared)), reference)
+
+
+def old_get_log_buffer(prefix, buff):
+    """get_log_buffer building the string by concatenation"""
+    log = prefix
+    for i in buff:
+        log += str(i) + "-"
+    return log[:-1]
+
+
+def bench_capture():
+    """the UAV poll with set_verbose logging every frame vs a WireCapture in memory and in a file"""
+    import tempfile
+
+    master = modbus_rtu.RtuMaster(LoopbackSerial(CannedResponder(make_uav_databank())))
+    prepared = master.prepare(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+    reference = measure(lambda: master.execute_prepared(prepared))
+    report("no log", reference)
+
+    handler = logging.StreamHandler(io.StringIO())
+    (level, propagate) = (LOGGER.level, LOGGER.propagate)
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.DEBUG)
+    LOGGER.propagate = False
+    master.set_verbose(True)
+    try:
+        modbus.get_log_buffer = old_get_log_buffer
+        report("verbose, concatenation", measure(lambda: master.execute_prepared(prepared)), reference)
+        modbus.get_log_buffer = utils.get_log_buffer
+        report("verbose, join", measure(lambda: master.execute_prepared(prepared)), reference)
+    finally:
+        modbus.get_log_buffer = utils.get_log_buffer
+        master.set_verbose(False)
+        LOGGER.removeHandler(handler)
+        LOGGER.setLevel(level)
+        LOGGER.propagate = propagate
+
+    master.set_capture(capture.WireCapture())
+    report("capture in memory", measure(lambda: master.execute_prepared(prepared)), reference)
+    path = os.path.join(tempfile.mkdtemp(), "bench.cap")
+    wire_capture = capture.WireCapture(path)
+    master.set_capture(wire_capture)
+    report("capture in a file", measure(lambda: master.execute_prepared(prepared)), reference)
+    wire_capture.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def bench_word_order():
+    """decoding of 2 and 124 registers read as floats in every word order"""
+    for quantity in (2, 124):
+        response_pdu = bytearray([defines.READ_HOLDING_REGISTERS, 2 * quantity]) + bytearray(range(2 * quantity))
+        for word_order in sorted(utils.WORD_ORDER_PERMUTATIONS):
+            prepared = modbus.PreparedRequest(
+                None, None, 1, -1, True, ">" + "f" * (quantity // 2), 0, word_order
+            )
+            report(
+                "{0} registers {1}".format(quantity, word_order),
+                measure(lambda: prepared.decode(response_pdu), 0.3)
+            )
+
+
+def bench_hooks():
+    """cost of call_hooks and of a request handled by a Server and a RtuMaster with and without hooks"""
+    report("call_hooks, nothing installed", measure(lambda: hooks.call_hooks("benchmark.none", (None, )), 0.5))
+
+    server = modbus_tcp.TcpServer(databank=make_uav_databank())
+    request = modbus_tcp.TcpQuery().build_request(struct.pack(">BHH", defines.READ_INPUT_REGISTERS, 1006, 10), 1)
+    master = modbus_rtu.RtuMaster(LoopbackSerial(CannedResponder(make_uav_databank())))
+    prepared = master.prepare(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+    other_server = modbus_tcp.TcpServer(databank=make_uav_databank())
+    other_master = modbus_rtu.RtuMaster(LoopbackSerial(CannedResponder(make_uav_databank())))
+
+    def run(name):
+        args = (server, request)
+        report("call_hooks, {0}".format(name), measure(lambda: hooks.call_hooks(server_hooks[0], args), 0.5))
+        report("Server._handle, {0}".format(name), measure(lambda: server._handle(request), 0.5))
+        report("RtuMaster, {0}".format(name), measure(lambda: master.execute_prepared(prepared), 0.5))
+
+    def nothing(args):
+        """a hook doing nothing"""
+        return None
+
+    master_hooks = ("modbus.Master.before_send", "modbus.Master.after_send", "modbus.Master.after_recv")
+    server_hooks = ("modbus.Server.before_handle_request", "modbus.Server.after_handle_request")
+    run("no hook")
+    for name in master_hooks:
+        hooks.install_hook(name, nothing, other_master)
+    for name in server_hooks:
+        hooks.install_hook(name, nothing, other_server)
+    run("hooks of others")
+    for name in master_hooks:
+        hooks.uninstall_hook(name, instance=other_master)
+        hooks.install_hook(name, nothing)
+    for name in server_hooks:
+        hooks.uninstall_hook(name, instance=other_server)
+        hooks.install_hook(name, nothing)
+    run("global hooks")
+    for name in master_hooks + server_hooks:
+        hooks.uninstall_hook(name)
+
+
+def bench_read_many():
+    """read of 20 ranges of 2 registers every 6 registers over a simulated 19200 bauds line"""
+    databank = modbus.Databank()
+    databank.add_slave(1).add_block("map", defines.HOLDING_REGISTERS, 0, 1000)
+    master = modbus_rtu.RtuMaster(LoopbackSerial(CannedResponder(databank), simulate_line=True))
+    ranges = [(address, 2) for address in range(0, 120, 6)]
+
+    reference = None
+    for max_gap in (None, 2, 4):
+        plan = modbus.ReadPlan(ranges, max_gap)
+        duration = measure(lambda: master.read_many(1, plan))
+        reference = reference or duration
+        report(
+            "max_gap={0}: {1} round trips, {2} saved".format(max_gap, plan.round_trips, plan.saved_round_trips),
+            duration, reference
+        )
+
+
+def bench_pipelined():
+    """requests per second of TcpMaster vs PipelinedTcpMaster with a 1 ms one-way latency"""
+    server, port = start_tcp_server(make_uav_databank())
+    port = DelayProxy(port, 0.001).port
+    args = (1, defines.READ_INPUT_REGISTERS, 1006, 10)
+    count = 1000
+    try:
+        master = modbus_tcp.TcpMaster(port=port)
+        start = time.perf_counter()
+        for _ in range(count):
+            master.execute(*args)
+        reference = count / (time.perf_counter() - start)
+        print("  {0:<40s} {1:10.0f} req/s".format("TcpMaster (stop-and-wait)", reference))
+        master.close()
+
+        for max_in_flight in (1, 4, 16, 64):
+            master = modbus_tcp_pipelined.PipelinedTcpMaster(port=port, max_in_flight=max_in_flight)
+            start = time.perf_counter()
+            pending = [master.submit(*args) for _ in range(count)]
+            for future in pending:
+                future.result()
+            throughput = count / (time.perf_counter() - start)
+            print("  {0:<40s} {1:10.0f} req/s   x{2:.2f}".format(
+                "PipelinedTcpMaster max_in_flight={0}".format(max_in_flight), throughput, throughput / reference
+            ))
+            master.close()
+    finally:
+        server.stop()
+
+
+def bench_async():
+    """200 AsyncTcpMaster polling an AsyncTcpServer from one event loop"""
+    # imported here: asyncio is not available with every python version
+    import asyncio
+    from modbus_tk import modbus_async
+
+    loop = asyncio.get_event_loop()
+    port = find_free_port()
+    server = modbus_async.AsyncTcpServer(port=port, address="127.0.0.1", databank=make_uav_databank())
+    loop.run_until_complete(server.start())
+    masters = [modbus_async.AsyncTcpMaster(port=port) for _ in range(200)]
+    count = 20
+
+    async def poll(master):
+        """read the registers of the UAV count times"""
+        for _ in range(count):
+            await master.execute(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+        await master.close()
+
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*[poll(master) for master in masters]))
+    duration = time.perf_counter() - start
+    loop.run_until_complete(server.stop())
+    print("  {0:<40s} {1:10.0f} req/s".format("{0} masters".format(len(masters)), len(masters) * count / duration))
+
+
+def bench_recv():
+    """receive calls and latency of the TcpMaster and RtuOverTcpMaster responses"""
+    databank = make_uav_databank()
+    databank.get_slave(1).add_block("map", defines.HOLDING_REGISTERS, 0, 125)
+    server, tcp_port = start_tcp_server(databank)
+    try:
+        for (master_class, port) in (
+            (modbus_tcp.TcpMaster, tcp_port),
+            (modbus_rtu_over_tcp.RtuOverTcpMaster, start_rtu_over_tcp_server(databank)),
+        ):
+            master = master_class(port=port)
+            master.open()
+            master._sock = CountingSocket(master._sock)
+            for quantity in (10, 125):
+                prepared = master.prepare(1, defines.READ_HOLDING_REGISTERS, 0, quantity)
+                master.execute_prepared(prepared)
+                master._sock.recv_calls = 0
+                master.execute_prepared(prepared)
+                calls = master._sock.recv_calls
+                report(
+                    "{0} {1} registers: {2} recv calls".format(master_class.__name__, quantity, calls),
+                    measure(lambda: master.execute_prepared(prepared), 0.5)
+                )
+            master.close()
+    finally:
+        server.stop()
+
+
+def bench_response_cache():
+    """Server._handle of repeated read requests without and with the response cache"""
+    databank = make_uav_databank()
+    databank.get_slave(1).add_block("holding", defines.HOLDING_REGISTERS, 0, 125)
+    servers = (
+        (modbus_tcp.TcpServer(databank=databank), modbus_tcp.TcpQuery),
+        (modbus_rtu.RtuServer(LoopbackSerial(None), databank=databank), modbus_rtu.RtuQuery),
+    )
+    for (server, query_class) in servers:
+        for (name, pdu) in (
+            ("10 registers", struct.pack(">BHH", defines.READ_INPUT_REGISTERS, 1006, 10)),
+            ("125 registers", struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, 0, 125)),
+        ):
+            query = query_class()
+            request = query.build_request(pdu, 1)
+            server.set_response_cache(0)
+            reference = measure(lambda: server._handle(request), 0.5)
+            report("{0}, {1}".format(server.__class__.__name__, name), reference)
+            server.set_response_cache()
+            cached = measure(lambda: server._handle(request), 0.5)
+            report("{0}, {1}, cached".format(server.__class__.__name__, name), cached, reference)
+
+
+def bench_rtu_recv():
+    """RtuMaster answer and exception latencies on a serial port with a 100 ms timeout"""
+    serial = LoopbackSerial(CannedResponder(make_uav_databank()), timeout=0.1, simulate_timeout=True)
+    master = modbus_rtu.RtuMaster(serial)
+    master.set_timeout(0.1)
+    prepared = master.prepare(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+    if master.execute_prepared(prepared) != tuple(range(10)):
+        raise Exception("RtuMaster returns wrong values")
+    report("10 registers", measure(lambda: master.execute_prepared(prepared), 0.5))
+
+    # the slave answers an exception frame: no block at this address
+    prepared = master.prepare(1, defines.READ_INPUT_REGISTERS, 0, 10)
+
+    def read_exception():
+        try:
+            master.execute_prepared(prepared)
+        except modbus.ModbusError as excpt:
+            if excpt.get_exception_code() != defines.ILLEGAL_DATA_ADDRESS:
+                raise
+        else:
+            raise Exception("RtuMaster doesn't raise the exception of the slave")
+    report("exception", measure(read_exception, 0.5))
+
+
+def bench_rtu_server():
+    """requests per second of a RtuServer on a pseudo-terminal, the master writing and reading the other end"""
+    import serial
+    import tty
+
+    databank = make_uav_databank()
+    databank.get_slave(1).add_block("holding", defines.HOLDING_REGISTERS, 0, 100)
+    queries = (
+        ("read 10 registers", modbus_rtu.RtuQuery().build_request(
+            struct.pack(">BHH", defines.READ_INPUT_REGISTERS, 1006, 10), 1)),
+        ("write 10 registers", modbus_rtu.RtuQuery().build_request(
+            struct.pack(">BHHB", defines.WRITE_MULTIPLE_REGISTERS, 0, 10, 20) + b"\x00\x01" * 10, 1)),
+    )
+    duration = 1.0
+
+    for baudrate in (19200, 115200):
+        (master_fd, slave_fd) = os.openpty()
+        tty.setraw(slave_fd)
+        tty.setraw(master_fd)
+        server = modbus_rtu.RtuServer(serial.Serial(os.ttyname(slave_fd), baudrate=baudrate), databank=databank)
+        server.start()
+        for (name, request) in queries:
+            count = 0
+            end_time = time.perf_counter() + duration
+            while time.perf_counter() < end_time:
+                os.write(master_fd, request)
+                response = os.read(master_fd, 256)
+                while len(response) < modbus_rtu.get_response_length(response):
+                    response += os.read(master_fd, 256)
+                count += 1
+            print("  {0:<40s} {1:10.1f} req/s".format("{0} bauds, {1}".format(baudrate, name), count / duration))
+        server.stop()
+        os.close(master_fd)
+        os.close(slave_fd)
+
+
+def bench_parallel_rtu():
+    """requests per second of 2 RtuMaster polling from 2 threads on 2 pseudo-terminals at 19200 bauds"""
+    masters = [modbus_rtu.RtuMaster(start_pty_slave(make_uav_databank())) for _ in range(2)]
+    for master in masters:
+        master.set_timeout(0.5)
+    duration = 2.0
+
+    def poll(master, counts, shared_lock=None):
+        prepared = master.prepare(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+        end_time = time.perf_counter() + duration
+        while time.perf_counter() < end_time:
+            if shared_lock:
+                with shared_lock:
+                    master.execute_prepared(prepared)
+            else:
+                master.execute_prepared(prepared)
+            counts.append(1)
+
+    def run(nb_masters, shared_lock=None):
+        counts = []
+        threads = [
+            threading.Thread(target=poll, args=(master, counts, shared_lock)) for master in masters[:nb_masters]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(counts) / duration
+
+    reference = run(1)
+    print("  {0:<40s} {1:10.1f} req/s".format("1 master", reference))
+    # the lock shared by every master before the lock of each master
+    rate = run(2, threading.RLock())
+    print("  {0:<40s} {1:10.1f} req/s   x{2:.2f}".format("2 masters, process-wide lock", rate, rate / reference))
+    rate = run(2)
+    print("  {0:<40s} {1:10.1f} req/s   x{2:.2f}".format("2 masters, lock of each master", rate, rate / reference))
+    for master in masters:
+        master.close()
+
+
+def bench_pool():
+    """polls of a slave with a 1 ms one-way latency: new TcpMaster on every poll vs TcpMasterPool"""
+    server, port = start_tcp_server(make_uav_databank())
+    proxy = DelayProxy(port, 0.001)
+
+    class DelayedTcpMaster(modbus_tcp.TcpMaster):
+        """the proxy doesn't delay the connection: wait for the round trip of the tcp handshake"""
+        def _do_open(self):
+            time.sleep(0.002)
+            super(DelayedTcpMaster, self)._do_open()
+
+    pool = modbus_tcp.TcpMasterPool(max_connections_per_host=4, master_class=DelayedTcpMaster)
+    duration = 2.0
+
+    def poll_new_master():
+        master = DelayedTcpMaster(port=proxy.port)
+        master.execute(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+        master.close()
+
+    def poll_pool():
+        with pool.borrow(port=proxy.port) as master:
+            master.execute(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+
+    def run(poll):
+        counts = []
+
+        def worker():
+            end_time = time.perf_counter() + duration
+            while time.perf_counter() < end_time:
+                poll()
+                counts.append(1)
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(counts) / duration
+
+    try:
+        reference = measure(poll_new_master)
+        report("new TcpMaster on every poll", reference)
+        report("TcpMasterPool", measure(poll_pool), reference)
+        reference = run(poll_new_master)
+        print("  {0:<40s} {1:10.1f} req/s".format("8 threads, new TcpMaster on every poll", reference))
+        rate = run(poll_pool)
+        print("  {0:<40s} {1:10.1f} req/s   x{2:.2f}".format("8 threads, TcpMasterPool of 4", rate, rate / reference))
+    finally:
+        pool.close()
+        server.stop()
+
+
+def bench_crc():
+    """utils.calculate_crc and utils.Crc16 vs a byte by byte crc16 on frames from 8 to 256 bytes"""
+    table = utils._CRC16_TABLE
+
+    def byte_by_byte_crc(data):
+        crc = 0xFFFF
+        for c in bytearray(data):
+            crc = (crc >> 8) ^ table[(c ^ crc) & 0xFF]
+        return utils.swap_bytes(crc)
+
+    for size in (8, 16, 32, 64, 128, 256):
+        frame = bytes(bytearray(range(size)))
+        if utils.calculate_crc(frame) != byte_by_byte_crc(frame):
+            raise Exception("calculate_crc returns a wrong crc")
+        reference = measure(lambda: byte_by_byte_crc(frame), 0.3)
+        report("{0} bytes byte by byte".format(size), reference)
+        report("{0} bytes calculate_crc".format(size), measure(lambda: utils.calculate_crc(frame), 0.3), reference)
+        view = memoryview(frame)
+        report(
+            "{0} bytes Crc16 in 2 parts".format(size),
+            measure(lambda: utils.Crc16(view[:size // 2]).update(view[size // 2:]).value(), 0.3), reference
+        )
+
+
+def bench_registers():
+    """Slave read and write of 125 and 123 holding registers, memory of a block of 10000 registers"""
+    databank = modbus.Databank()
+    slave = databank.add_slave(1)
+    slave.add_block("map", defines.HOLDING_REGISTERS, 0, 10000)
+    slave.set_values("map", 0, list(range(10000)))
+    read_pdu = struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, 100, 125)
+    write_pdu = struct.pack(">BHHB", defines.WRITE_MULTIPLE_REGISTERS, 100, 123, 246) + read_pdu * 49 + b"\x00"
+    if slave.handle_request(read_pdu)[2:] != struct.pack(">125H", *range(100, 225)):
+        raise Exception("Slave returns wrong values")
+    report("read 125 registers", measure(lambda: slave.handle_request(read_pdu), 0.5))
+    report("write 123 registers", measure(lambda: slave.handle_request(write_pdu), 0.5))
+    data = slave._get_block("map")._data
+    size = sys.getsizeof(data)
+    if isinstance(data, list):
+        # the list refers to int objects: the small ones are shared
+        size += sum(sys.getsizeof(value) for value in data if not -5 <= value <= 256)
+    print("  {0:<40s} {1:10d} bytes".format("block of 10000 registers", size))
+
+
+def bench_blocks():
+    """Slave with 10000 blocks of 6 registers: creation and read in the first and last blocks"""
+    slave = modbus.Slave(1)
+    start = time.perf_counter()
+    for i in range(10000):
+        slave.add_block(str(i), defines.HOLDING_REGISTERS, 6 * i, 6)
+    report("add 10000 blocks (total)", time.perf_counter() - start)
+    for address in (0, 59994):
+        request_pdu = struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, address, 6)
+        if len(slave.handle_request(request_pdu)) != 14:
+            raise Exception("Slave doesn't find the block at {0}".format(address))
+        report("read at {0}".format(address), measure(lambda: slave.handle_request(request_pdu), 0.5))
+
+
+def bench_coils():
+    """RtuMaster read of 2000 coils and write of 1968 coils vs read of 10 registers on a loopback serial line"""
+    databank = make_uav_databank()
+    databank.get_slave(1).add_block("coils", defines.COILS, 0, 2000)
+    master = modbus_rtu.RtuMaster(LoopbackSerial(CannedResponder(databank)))
+    values = [i % 3 == 0 for i in range(1968)]
+    master.execute(1, defines.WRITE_MULTIPLE_COILS, 0, output_value=values)
+    if master.execute(1, defines.READ_COILS, 0, 1968) != tuple(int(value) for value in values):
+        raise Exception("RtuMaster doesn't read the written coils")
+
+    reference = measure(lambda: master.execute(1, defines.READ_INPUT_REGISTERS, 1006, 10), 0.5)
+    report("read 10 registers", reference)
+    report("read 2000 coils", measure(lambda: master.execute(1, defines.READ_COILS, 0, 2000), 0.5), reference)
+    # the answer of a write is the same whatever the values: the slave must not be cached
+    master = modbus_rtu.RtuMaster(
+        LoopbackSerial(lambda request: bytes(databank.handle_request(modbus_rtu.RtuQuery(), request)))
+    )
+    report(
+        "write 1968 coils",
+        measure(lambda: master.execute(1, defines.WRITE_MULTIPLE_COILS, 0, output_value=values), 0.5), reference
+    )
+
+
+def bench_concurrent_reads():
+    """reads of a slave by 1 thread and 8 threads while 1 thread writes: exclusive lock vs concurrent_reads"""
+
+    class SlowSlave(modbus.Slave):
+        """the registers are refreshed from a slow source on every read"""
+        def _read_registers(self, block_type, request_pdu):
+            time.sleep(0.001)
+            return super(SlowSlave, self)._read_registers(block_type, request_pdu)
+
+    read_pdu = struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, 0, 10)
+    write_pdu = struct.pack(">BHH", defines.WRITE_SINGLE_REGISTER, 0, 1)
+    duration = 2.0
+
+    def run(slave):
+        counts, write_times = [], []
+        end_time = time.perf_counter() + duration
+
+        def read():
+            while time.perf_counter() < end_time:
+                slave.handle_request(read_pdu)
+                counts.append(1)
+
+        def write():
+            while time.perf_counter() < end_time:
+                start = time.perf_counter()
+                slave.handle_request(write_pdu)
+                write_times.append(time.perf_counter() - start)
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=read) for _ in range(8)] + [threading.Thread(target=write)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(counts) / duration, max(write_times)
+
+    names = {False: "exclusive lock", True: "concurrent_reads"}
+    # the cost of the lock without contention: the requests handled by a TcpServer or a RtuServer
+    reference = None
+    for concurrent_reads in (False, True):
+        slave = modbus.Slave(1, concurrent_reads=concurrent_reads)
+        slave.add_block("map", defines.HOLDING_REGISTERS, 0, 10)
+        seconds = measure(lambda: slave.handle_request(read_pdu))
+        report("1 thread, {0}".format(names[concurrent_reads]), seconds, reference)
+        reference = reference or seconds
+
+    for slave_class in (modbus.Slave, SlowSlave):
+        for concurrent_reads in (False, True):
+            slave = slave_class(1, concurrent_reads=concurrent_reads)
+            slave.add_block("map", defines.HOLDING_REGISTERS, 0, 10)
+            (rate, max_write_time) = run(slave)
+            name = "8 threads, {0}".format(names[concurrent_reads])
+            if slave_class is SlowSlave:
+                name += ", 1 ms source"
+            print("  {0:<40s} {1:10.1f} req/s   longest write {2:.1f} ms".format(name, rate, max_write_time * 1000))
+
+
+def generate_signal(write, stop):
+    """write a signal computed from 2000 samples in a loop until stop is set"""
+    import math
+    tick = 0
+    while not stop.is_set():
+        tick += 1
+        samples = [math.sin(0.001 * (tick + i)) for i in range(2000)]
+        write((int(1000 * max(samples)) + 2000, int(1000 * min(samples)) + 2000))
+
+
+def produce_shared_signal(path, stop):
+    """main function of the producer process writing the registers of a shared bank"""
+    from modbus_tk.shared_bank import SharedRegisterBank
+    bank = SharedRegisterBank(path)
+    generate_signal(lambda values: bank.write(0, values), stop)
+    bank.close()
+
+
+def bench_shared_bank():
+    """Server._handle while a signal is generated by a thread of the server vs by a process writing a shared bank"""
+    import multiprocessing
+    import tempfile
+    from modbus_tk.shared_bank import SharedRegisterBank
+
+    path = os.path.join(tempfile.mkdtemp(), "bank")
+    bank = SharedRegisterBank(path, 2)
+    server = modbus_tcp.TcpServer()
+    slave = server.add_slave(1)
+    slave.add_block("local", defines.HOLDING_REGISTERS, 0, 2)
+    slave.add_block("shared", defines.HOLDING_REGISTERS, 100, 2, buffer=bank.registers(0, 2))
+    query = modbus_tcp.TcpQuery()
+    local_request = query.build_request(struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, 0, 2), 1)
+    shared_request = query.build_request(struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, 100, 2), 1)
+
+    reference = measure(lambda: server._handle(local_request), 0.5)
+    report("block", reference)
+    report("shared block", measure(lambda: server._handle(shared_request), 0.5), reference)
+
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=generate_signal, args=(lambda values: slave.set_values("local", 0, values), stop)
+    )
+    producer.start()
+    reference = measure(lambda: server._handle(local_request))
+    stop.set()
+    producer.join()
+    report("block, signal from a thread", reference)
+
+    stop = multiprocessing.Event()
+    producer = multiprocessing.Process(target=produce_shared_signal, args=(path, stop))
+    producer.start()
+    # wait for the first values
+    while slave.get_values("shared", 100, 2) == (0, 0):
+        time.sleep(0.01)
+    report("shared block, signal from a process", measure(lambda: server._handle(shared_request)), reference)
+    stop.set()
+    producer.join()
+
+    slave.remove_block("shared")
+    bank.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def bench_simulator_rpc():
+    """set_values commands per second sent to the simulator: one connection per command vs persistent and batches"""
+    from modbus_tk import simulator
+    from modbus_tk import simulator_rpc_client
+
+    port = find_free_port()
+    batch_port = find_free_port()
+    simu = simulator.Simulator(modbus_tcp.TcpServer(port=port, address="127.0.0.1"), batch_port)
+    simu.server.add_slave(1).add_block("b", defines.HOLDING_REGISTERS, 0, 100)
+    simu.rpc.start()
+    simu.batch_rpc.start()
+    handler = threading.Thread(target=simu._handle)
+    handler.start()
+
+    clients = (
+        ("connection per command", simulator_rpc_client.SimulatorRpcClient(timeout=5.0)),
+        ("persistent connection", simulator_rpc_client.PersistentSimulatorRpcClient(port=batch_port, timeout=5.0)),
+    )
+    for (name, client) in clients:
+        count = 0
+        end_time = time.perf_counter() + 1.0
+        while time.perf_counter() < end_time:
+            client.set_values(1, "b", 0, [count & 0xffff, 1, 2, 3])
+            count += 1
+        print("  {0:<40s} {1:10.0f} cmd/s".format(name, count))
+
+    client = clients[1][1]
+    updates = [(1, "b", 4 * i, [i, 1, 2, 3]) for i in range(25)] * 4
+    count = 0
+    end_time = time.perf_counter() + 1.0
+    while time.perf_counter() < end_time:
+        client.set_many_values(updates)
+        count += len(updates)
+    print("  {0:<40s} {1:10.0f} cmd/s".format("batches of {0}".format(len(updates)), count))
+    client.close()
+
+    simulator.INPUT_QUEUE.put("quit")
+    handler.join()
+    simulator.OUTPUT_QUEUE.get()
+    simu.rpc.close()
+    simu.batch_rpc.close()
+
+
+def bench_tcp_server():
+    """TcpServer with 200 concurrent TcpMaster, with a client sending a byte every 100 ms, and pipelined requests"""
+    server, port = start_tcp_server(make_uav_databank())
+    duration = 2.0
+
+    def run(nb_clients, slow_client):
+        latencies = []
+        end_time = time.perf_counter() + duration
+
+        def poll():
+            master = modbus_tcp.TcpMaster(port=port, timeout_in_sec=10.0)
+            while time.perf_counter() < end_time:
+                start = time.perf_counter()
+                master.execute(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+                latencies.append(time.perf_counter() - start)
+            master.close()
+
+        def trickle():
+            # a request sent one byte at a time
+            sock = socket.create_connection(("127.0.0.1", port))
+            request = struct.pack(">HHHBBHH", 1, 0, 6, 1, defines.READ_INPUT_REGISTERS, 1006, 10)
+            while time.perf_counter() < end_time:
+                for i in range(len(request)):
+                    sock.send(request[i:i + 1])
+                    time.sleep(0.1)
+                sock.recv(256)
+            sock.close()
+
+        threads = [threading.Thread(target=poll) for _ in range(nb_clients)]
+        if slow_client:
+            threads.append(threading.Thread(target=trickle))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        print("  {0:<40s} {1:10.0f} req/s   p99 {2:.1f} ms".format(
+            "{0} clients{1}".format(nb_clients, " + 1 slow client" if slow_client else ""),
+            len(latencies) / duration, latencies[int(len(latencies) * 0.99)] * 1000
+        ))
+
+    run(200, False)
+    run(200, True)
+
+    # a client sending 100 requests before reading the answers
+    sock = socket.create_connection(("127.0.0.1", port))
+    requests = b"".join(
+        struct.pack(">HHHBBHH", i, 0, 6, 1, defines.READ_INPUT_REGISTERS, 1006, 10) for i in range(100)
+    )
+    response_length = 7 + 2 + 20
+
+    def pipelined():
+        sock.sendall(requests)
+        received = 0
+        while received < 100 * response_length:
+            received += len(sock.recv(65536))
+
+    report("100 pipelined requests", measure(pipelined))
+    sock.close()
+    server.stop()
+
+
+def poll_in_process(port, duration, connection):
+    """main function of a client process: send the number of requests answered in duration seconds"""
+    master = modbus_tcp.TcpMaster(port=port, timeout_in_sec=10.0)
+    count = 0
+    end_time = time.perf_counter() + duration
+    while time.perf_counter() < end_time:
+        master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 10)
+        count += 1
+    master.close()
+    connection.send(count)
+
+
+def bench_workers():
+    """requests per second of MultiProcessTcpServer with 1, 2 and 4 workers polled by 8 client processes"""
+    import multiprocessing
+    import tempfile
+    from modbus_tk.modbus_tcp_multiprocess import MultiProcessTcpServer
+    from modbus_tk.shared_bank import SharedRegisterBank
+
+    if threading.active_count() > 1:
+        print("  skipped: the workers can't be forked after the threads of other benchmarks, run it alone")
+        return
+    path = os.path.join(tempfile.mkdtemp(), "bank")
+    bank = SharedRegisterBank(path, 100)
+    context = multiprocessing.get_context("fork")
+    duration = 2.0
+    print("  {0} cpu".format(multiprocessing.cpu_count()))
+
+    for nb_workers in (1, 2, 4):
+        port = find_free_port()
+        server = MultiProcessTcpServer(nb_workers, port=port, address="127.0.0.1")
+        server.add_slave(1).add_block("shared", defines.HOLDING_REGISTERS, 0, 100, buffer=bank.registers(0, 100))
+        server.start()
+        # wait for the workers
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+            except socket.error:
+                time.sleep(0.01)
+
+        pipes = [context.Pipe(False) for _ in range(8)]
+        clients = [context.Process(target=poll_in_process, args=(port, duration, sender)) for (_, sender) in pipes]
+        for client in clients:
+            client.start()
+        count = sum(receiver.recv() for (receiver, _) in pipes)
+        for client in clients:
+            client.join()
+        server.stop()
+        # release the registers of the bank: the slaves are in reference cycles
+        server.get_db().remove_all_slaves()
+        gc.collect()
+        print("  {0:<40s} {1:10.0f} req/s".format("{0} workers".format(nb_workers), count / duration))
+
+    bank.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def bench_updates():
+    """a tick of a fleet of 200 slaves with 3 blocks: Slave.set_values for every block vs Databank.apply_updates"""
+    databank = modbus.Databank()
+    batch = []
+    for slave_id in range(1, 201):
+        slave = databank.add_slave(slave_id)
+        slave.add_block("c", defines.COILS, 0, 16)
+        slave.add_block("b", defines.HOLDING_REGISTERS, 0, 2)
+        slave.add_block("a", defines.ANALOG_INPUTS, 0, 10)
+        batch += [(slave_id, "c", 0, [1, 0] * 8), (slave_id, "b", 0, (1000, 2000)), (slave_id, "a", 0, list(range(10)))]
+
+    def set_values():
+        for (slave_id, block_name, address, values) in batch:
+            databank.get_slave(slave_id).set_values(block_name, address, values)
+
+    reference = measure(set_values)
+    report("set_values", reference)
+    report("apply_updates", measure(lambda: databank.apply_updates(batch)), reference)
+
+
+def bench_uav_chain():
+    """the UAV polling the wellhead RtuServer on a virtual serial link at 19200 and 57600 bauds, with bit errors"""
+    from modbus_tk.exceptions import ModbusInvalidResponseError
+
+    duration = 2.0
+    for (baudrate, error_rate) in ((19200, 0.0), (57600, 0.0), (57600, 1e-4)):
+        link = VirtualSerialLink(baudrate, error_rate=error_rate, seed=0)
+        server = modbus_rtu.RtuServer(link.open(0), databank=make_uav_databank())
+        server.start()
+        master = modbus_rtu.RtuMaster(link.open(1))
+        master.set_timeout(0.1)
+        prepared = master.prepare(1, defines.READ_INPUT_REGISTERS, 1006, 10)
+        (count, errors) = (0, 0)
+        end_time = time.perf_counter() + duration
+        while time.perf_counter() < end_time:
+            try:
+                master.execute_prepared(prepared)
+                count += 1
+            except ModbusInvalidResponseError:
+                errors += 1
+        master.close()
+        server.stop()
+        link.close()
+        print("  {0:<40s} {1:10.1f} req/s   {2} errors".format(
+            "{0} bauds, bit error rate {1}".format(baudrate, error_rate), count / duration, errors))
+
+
+BENCHMARKS = {
+    "async": bench_async,
+    "blocks": bench_blocks,
+    "capture": bench_capture,
+    "coils": bench_coils,
+    "concurrent_reads": bench_concurrent_reads,
+    "crc": bench_crc,
+    "hooks": bench_hooks,
+    "parallel_rtu": bench_parallel_rtu,
+    "pipelined": bench_pipelined,
+    "pool": bench_pool,
+    "prepare": bench_prepare,
+    "read_many": bench_read_many,
+    "recv": bench_recv,
+    "registers": bench_registers,
+    "response_cache": bench_response_cache,
+    "rtu_recv": bench_rtu_recv,
+    "rtu_server": bench_rtu_server,
+    "shared_bank": bench_shared_bank,
+    "simulator_rpc": bench_simulator_rpc,
+    "tcp_server": bench_tcp_server,
+    "uav_chain": bench_uav_chain,
+    "updates": bench_updates,
+    "workers": bench_workers,
+    "word_order": bench_word_order,
+}
+
+
+def main(names):
+    """run the benchmarks with the given names"""
+    for name in (names or sorted(BENCHMARKS)):
+        print("{0}: {1}".format(name, BENCHMARKS[name].__doc__))
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
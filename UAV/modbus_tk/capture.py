@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Binary capture of the frames sent and received by masters and servers. The frames are recorded
+ raw, without formatting, and decoded offline:
+   capture = WireCapture("uav.cap")
+   master.set_capture(capture)
+   ...
+   capture.close()
+ then: python -m modbus_tk.capture uav.cap [--csv]
+ Without a path, the last max_records frames are kept in memory and can be saved later
+
+ Layout of a capture file:
+   offset   size   content
+   0        8      b"MBTKCAP1": the layout and its version
+   8        8      wall-clock time of the monotonic time 0 as a big-endian double
+   16              the records: a 15-byte header then the frame
+ Header of a record:
+   0        8      monotonic time of the record as a big-endian double
+   8        1      direction: 0 received, 1 sent
+   9        4      connection id as a big-endian unsigned integer
+   13       2      length of the frame as a big-endian unsigned integer
+"""
+
+from __future__ import print_function
+
+import binascii
+import collections
+import itertools
+import struct
+import threading
+import time
+
+from modbus_tk.exceptions import InvalidArgumentError
+from modbus_tk.utils import PY2
+
+RECEIVED = 0
+SENT = 1
+
+_MAGIC = b"MBTKCAP1"
+_FILE_HEADER = struct.Struct(">8sd")
+_RECORD_HEADER = struct.Struct(">dBIH")
+
+_clock = getattr(time, "monotonic", time.time)
+
+_CONNECTION_IDS = itertools.count(1)
+
+
+def new_connection_id():
+    """returns an id which has not been given to another connection of the process"""
+    return next(_CONNECTION_IDS) & 0xFFFFFFFF
+
+
+class WireCapture(object):
+    """
+    Record the frames into the file at path. The records are buffered and written by flush_every.
+    If path is None, the last max_records records are kept in memory
+    """
+
+    def __init__(self, path=None, max_records=100000, flush_every=1024):
+        """Constructor: create the capture file"""
+        self._lock = threading.Lock()
+        self._flush_every = flush_every
+        self._wall_offset = time.time() - _clock()
+        self._in_memory = path is None
+        if self._in_memory:
+            self._file = None
+            self._records = collections.deque(maxlen=max_records)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(self._file_header())
+            self._records = []
+
+    def _file_header(self):
+        """returns the header of a capture file"""
+        return _FILE_HEADER.pack(_MAGIC, self._wall_offset)
+
+    def record(self, direction, connection_id, frame):
+        """record a frame: this is called on every sent or received frame and must be fast"""
+        if PY2 and isinstance(frame, memoryview):
+            # bytes is str on python 2: it would record the repr of the memoryview
+            frame = frame.tobytes()
+        data = _RECORD_HEADER.pack(_clock(), direction, connection_id, len(frame)) + bytes(frame)
+        with self._lock:
+            self._records.append(data)
+            if not self._in_memory and len(self._records) >= self._flush_every:
+                self._write()
+
+    def _write(self):
+        """write the buffered records in the file: the lock must be held"""
+        self._file.write(b"".join(self._records))
+        self._records = []
+
+    def flush(self):
+        """write the buffered records in the file"""
+        with self._lock:
+            if self._file is not None:
+                self._write()
+                self._file.flush()
+
+    def save(self, path):
+        """write the records kept in memory in a capture file. A capture recorded in a file can't be saved"""
+        with self._lock:
+            if not self._in_memory:
+                raise InvalidArgumentError("The capture is recorded in a file: it has no records in memory")
+            records = list(self._records)
+        with open(path, "wb") as the_file:
+            the_file.write(self._file_header())
+            the_file.write(b"".join(records))
+
+    def close(self):
+        """write the buffered records and close the file"""
+        with self._lock:
+            if self._file is not None:
+                self._write()
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """generates the records of a capture file as (wall-clock time, direction, connection id, frame)"""
+    with open(path, "rb") as the_file:
+        data = the_file.read()
+    (magic, wall_offset) = _FILE_HEADER.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise InvalidArgumentError("{0} is not a capture file".format(path))
+    offset = _FILE_HEADER.size
+    while offset + _RECORD_HEADER.size <= len(data):
+        (timestamp, direction, connection_id, length) = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        yield (wall_offset + timestamp, direction, connection_id, data[offset:offset + length])
+        offset += length
+
+
+def format_record(record, csv=False):
+    """returns a record as a line of text or csv"""
+    (timestamp, direction, connection_id, frame) = record
+    hex_frame = binascii.hexlify(frame).decode()
+    if csv:
+        return "{0:.6f},{1},{2},{3},{4}".format(
+            timestamp, "sent" if direction == SENT else "received", connection_id, len(frame), hex_frame
+        )
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+    return "{0}.{1:06d} {2:>5d} {3} {4}".format(
+        date, int((timestamp % 1) * 1000000), connection_id, "->" if direction == SENT else "<-",
+        " ".join(hex_frame[i:i + 2] for i in range(0, len(hex_frame), 2))
+    )
+
+
+def main(args=None):
+    """print a capture file as text or csv"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print a modbus_tk capture file")
+    parser.add_argument("path")
+    parser.add_argument("--csv", action="store_true", help="time,direction,connection,length,frame")
+    options = parser.parse_args(args)
+
+    if options.csv:
+        print("time,direction,connection,length,frame")
+    for record in read_capture(options.path):
+        print(format_record(record, options.csv))
+
+
+if __name__ == "__main__":
+    main()
@@ -38,3 +38,9 @@ COILS = 1
 DISCRETE_INPUTS = 2
 HOLDING_REGISTERS = 3
 ANALOG_INPUTS = 4
+
+#word orders of the values spread over several registers
+WORD_ORDER_ABCD = "ABCD"
+WORD_ORDER_BADC = "BADC"
+WORD_ORDER_CDAB = "CDAB"
+WORD_ORDER_DCBA = "DCBA"
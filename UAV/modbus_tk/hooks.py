@@ -11,12 +11,84 @@
 
 from __future__ import with_statement
 import threading
+import weakref
 
 _LOCK = threading.RLock()
+# the functions called for each hook name. call_hooks reads it without lock:
+# the dict and its tuples are replaced on every change, never modified
 _HOOKS = {}
-
-
-def install_hook(name, fct):
+# the functions installed for every instance by hook name
+_GLOBAL_HOOKS = {}
+# the weak references to the instances having functions for the hook name, by hook name and instance id
+_SCOPED_REFS = {}
+# the functions calling the scoped hooks by hook name
+_SCOPED_CALLERS = {}
+
+
+def _make_scoped_caller(name):
+    """returns a function calling the hooks installed for the instance which is the first of the args"""
+    def call_scoped_hooks(args):
+        """call the functions of the instance and returns the first value which is not None"""
+        # the scoped hooks of an instance are stored in the instance: a dict replaced on every change
+        scoped_hooks = getattr(args[0], "_scoped_hooks", None)
+        if scoped_hooks is None:
+            return None
+        for fct in scoped_hooks.get(name, ()):
+            retval = fct(args)
+            if retval is not None:
+                return retval
+        return None
+    return call_scoped_hooks
+
+
+def _publish(name):
+    """replace the functions called for the hook name. The lock must be acquired"""
+    global _HOOKS
+    fcts = _GLOBAL_HOOKS.get(name, ())
+    if _SCOPED_REFS.get(name):
+        # the hooks of the instance are called first
+        if name not in _SCOPED_CALLERS:
+            _SCOPED_CALLERS[name] = _make_scoped_caller(name)
+        fcts = (_SCOPED_CALLERS[name], ) + fcts
+    hooks = dict(_HOOKS)
+    if fcts:
+        hooks[name] = fcts
+    else:
+        hooks.pop(name, None)
+    _HOOKS = hooks
+
+
+def _forget_instance(name, key, ref):
+    """called when an instance having scoped hooks is deleted: the other instances don't look for them anymore"""
+    with _LOCK:
+        refs = _SCOPED_REFS.get(name, {})
+        if refs.get(key) is ref:
+            del refs[key]
+            _publish(name)
+
+
+def _set_scoped_hooks(name, instance, fcts):
+    """replace the functions of the hook name scoped to the instance. The lock must be acquired"""
+    scoped_hooks = dict(getattr(instance, "_scoped_hooks", None) or {})
+    refs = _SCOPED_REFS.setdefault(name, {})
+    key = id(instance)
+    if fcts:
+        scoped_hooks[name] = fcts
+        # TypeError if the instance can't be weakly referenced
+        ref = refs.get(key) or weakref.ref(instance, lambda ref: _forget_instance(name, key, ref))
+    else:
+        scoped_hooks.pop(name, None)
+    # AttributeError if the instance has __slots__ without _scoped_hooks:
+    # the instance is registered once its functions are stored, nothing to undo on error
+    instance._scoped_hooks = scoped_hooks or None
+    if fcts:
+        refs[key] = ref
+    else:
+        refs.pop(key, None)
+    _publish(name)
+
+
+def install_hook(name, fct, instance=None):
     """
     Install one of the following hook
 
@@ -51,6 +123,17 @@ def install_hook(name, fct):
 
     modbus_rtu_over_tcp.RtuOverTcpMaster.after_recv((master, response))
 
+    modbus_async.AsyncTcpMaster.before_connect((master, ))
+    modbus_async.AsyncTcpMaster.after_connect((master, ))
+    modbus_async.AsyncTcpMaster.before_close((master, ))
+    modbus_async.AsyncTcpMaster.after_close((master, ))
+
+    modbus_async.AsyncTcpServer.on_connect((server, writer, address))
+    modbus_async.AsyncTcpServer.on_disconnect((server, writer))
+    modbus_async.AsyncTcpServer.after_recv((server, writer, request)) returns modified request or None
+    modbus_async.AsyncTcpServer.before_send((server, writer, response)) returns modified response or None
+    modbus_async.AsyncTcpServer.on_error((server, writer, excpt))
+
     modbus.Master.before_send((master, request)) returns modified request or None
     modbus.Master.after_send((master))
     modbus.Master.after_recv((master, response)) returns modified response or None
@@ -75,32 +158,51 @@ def install_hook(name, fct):
 
     modbus.Server.before_handle_request((server, request)) returns modified request or None
     modbus.Server.after_handle_request((server, response)) returns modified response or None
+
+    If instance is given, fct is only called when instance is the first of the args
+    (the master, the server, the slave...): the hooks of the other instances don't call it.
+    The scoped functions are stored in the _scoped_hooks attribute of the instance
     """
     with _LOCK:
-        try:
-            _HOOKS[name].append(fct)
-        except KeyError:
-            _HOOKS[name] = [fct]
+        if instance is None:
+            _GLOBAL_HOOKS[name] = _GLOBAL_HOOKS.get(name, ()) + (fct, )
+            _publish(name)
+        else:
+            scoped_hooks = getattr(instance, "_scoped_hooks", None) or {}
+            _set_scoped_hooks(name, instance, scoped_hooks.get(name, ()) + (fct, ))
 
 
-def uninstall_hook(name, fct=None):
-    """remove the function from the hooks"""
+def uninstall_hook(name, fct=None, instance=None):
+    """
+    remove the function from the hooks. If no function is given, remove all the functions
+    of the hook which are not scoped (or all the functions of the instance if given)
+    """
     with _LOCK:
+        if instance is None:
+            fcts = _GLOBAL_HOOKS[name]
+        else:
+            fcts = (getattr(instance, "_scoped_hooks", None) or {})[name]
         if fct:
-            _HOOKS[name].remove(fct)
+            fcts = list(fcts)
+            fcts.remove(fct)
+            fcts = tuple(fcts)
         else:
-            del _HOOKS[name][:]
+            fcts = ()
+        if instance is None:
+            _GLOBAL_HOOKS[name] = fcts
+            _publish(name)
+        else:
+            _set_scoped_hooks(name, instance, fcts)
 
 
 def call_hooks(name, args):
     """call the function associated with the hook and pass the given args"""
-    with _LOCK:
-        try:
-            for fct in _HOOKS[name]:
-                retval = fct(args)
-                if retval is not None:
-                    return retval
-        except KeyError:
-            pass
+    # no lock: the tuple of the functions can't change while they are called
+    fcts = _HOOKS.get(name)
+    if fcts is None:
         return None
-
+    for fct in fcts:
+        retval = fct(args)
+        if retval is not None:
+            return retval
+    return None
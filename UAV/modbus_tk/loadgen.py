@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Load generator: N masters send a mix of requests to a TcpServer or to RtuServers
+ on virtual serial links for a fixed duration. Run it with:
+   python -m modbus_tk.loadgen --transport tcp --masters 8 --duration 10 \\
+       --mix read_holding_registers:3,write_multiple_registers:1 --json results.json
+ The requests per second, the latency percentiles and the errors are printed and saved as
+ JSON. --compare gives the change from the results saved by a previous run
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import modbus_tk
+from modbus_tk import defines
+from modbus_tk import hooks
+from modbus_tk import modbus
+from modbus_tk import modbus_rtu
+from modbus_tk import modbus_tcp
+from modbus_tk import utils
+from modbus_tk.exceptions import ModbusError, ModbusInvalidResponseError
+from modbus_tk.virtual_serial import VirtualSerialLink
+
+# the requests which can be part of a mix: function code, quantity and value
+OPERATIONS = {
+    "read_coils": (defines.READ_COILS, 16, None),
+    "read_discrete_inputs": (defines.READ_DISCRETE_INPUTS, 16, None),
+    "read_holding_registers": (defines.READ_HOLDING_REGISTERS, 10, None),
+    "read_input_registers": (defines.READ_INPUT_REGISTERS, 10, None),
+    "write_single_coil": (defines.WRITE_SINGLE_COIL, 0, 1),
+    "write_single_register": (defines.WRITE_SINGLE_REGISTER, 0, 1234),
+    "write_multiple_coils": (defines.WRITE_MULTIPLE_COILS, 0, [1, 0] * 8),
+    "write_multiple_registers": (defines.WRITE_MULTIPLE_REGISTERS, 0, list(range(10))),
+}
+
+# the slave of the load generator has blocks of this size at address 0
+BLOCK_SIZE = 1000
+
+
+def parse_mix(mix):
+    """parse 'name:weight,name:weight' and returns the list of (name, weight)"""
+    operations = []
+    for item in mix.split(","):
+        (name, _, weight) = item.partition(":")
+        if name not in OPERATIONS:
+            raise ValueError("unknown operation {0}: choose in {1}".format(name, ", ".join(sorted(OPERATIONS))))
+        operations.append((name, float(weight or 1)))
+    return operations
+
+
+def make_databank():
+    """returns a databank with the slave 1 having a block of every type"""
+    databank = modbus.Databank()
+    slave = databank.add_slave(1)
+    for (name, block_type) in (
+        ("coils", defines.COILS), ("discrete_inputs", defines.DISCRETE_INPUTS),
+        ("holding_registers", defines.HOLDING_REGISTERS), ("input_registers", defines.ANALOG_INPUTS),
+    ):
+        slave.add_block(name, block_type, 0, BLOCK_SIZE)
+    return databank
+
+
+def find_free_port():
+    """returns a tcp port which is not used on the loopback interface"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_tcp_server(databank, server_class=modbus_tcp.TcpServer, **kwargs):
+    """start a tcp server on a free port of the loopback interface and returns it with its port"""
+    port = find_free_port()
+    server = server_class(port=port, address="127.0.0.1", databank=databank, **kwargs)
+    server.start()
+    # wait for the server socket
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            break
+        except socket.error:
+            time.sleep(0.01)
+    return server, port
+
+
+class LoadGenerator(object):
+    """run the masters against the servers and gather the results"""
+
+    def __init__(self, options):
+        """Constructor: options are the parsed command line"""
+        self.options = options
+        self.operations = parse_mix(options.mix)
+        self._servers = []
+        self._masters = []
+        self._links = []
+        # the last frame received by each rtu master
+        self._responses = {}
+
+    def _start(self):
+        """start the servers if needed and create the masters"""
+        options = self.options
+        if options.transport == "tcp":
+            (host, port) = (options.host, options.port)
+            if not port:
+                # a local server on a free port
+                (server, port) = start_tcp_server(make_databank())
+                host = "127.0.0.1"
+                self._servers.append(server)
+            self._masters = [
+                modbus_tcp.TcpMaster(host, port, options.timeout) for _ in range(options.masters)
+            ]
+        else:
+            # a link and a server for each master: a serial line has only one master
+            databank = make_databank()
+            for _ in range(options.masters):
+                link = VirtualSerialLink(options.baudrate, options.latency, options.error_rate)
+                self._links.append(link)
+                server = modbus_rtu.RtuServer(link.open(0), databank=databank)
+                server.start()
+                self._servers.append(server)
+                master = modbus_rtu.RtuMaster(link.open(1))
+                master.set_timeout(options.timeout)
+                hooks.install_hook("modbus_rtu.RtuMaster.after_recv", self._on_response, master)
+                self._masters.append(master)
+
+    def _stop(self):
+        """close the masters and stop the servers"""
+        for master in self._masters:
+            master.close()
+            if self.options.transport == "rtu":
+                hooks.uninstall_hook("modbus_rtu.RtuMaster.after_recv", instance=master)
+        for server in self._servers:
+            server.stop()
+        for link in self._links:
+            link.close()
+
+    def _on_response(self, args):
+        """after_recv hook of the rtu masters: keep the received frame"""
+        (master, response) = args
+        self._responses[master] = response
+
+    def _classify_invalid_response(self, master):
+        """returns the counter of an invalid response from the frame received by the master"""
+        response = self._responses.get(master)
+        if response is None:
+            return "errors"
+        length = modbus_rtu.get_response_length(response)
+        if length == 0 or len(response) < length:
+            # the frame is shorter than its header tells: the master has timed out
+            return "timeouts"
+        if len(response) >= 3 and struct.unpack(">H", response[-2:])[0] != utils.calculate_crc(response[:-2]):
+            return "crc_errors"
+        return "errors"
+
+    def _poll(self, master, results, end_time):
+        """main function of a master thread: send requests until end_time"""
+        names = [name for (name, weight) in self.operations]
+        weights = [weight for (name, weight) in self.operations]
+        cumulated = [sum(weights[:i + 1]) for i in range(len(weights))]
+        draw = random.Random(id(master))
+        while time.time() < end_time:
+            # a weighted choice compatible with every python version
+            threshold = draw.random() * cumulated[-1]
+            name = names[[i for (i, total) in enumerate(cumulated) if total > threshold][0]]
+            (function_code, quantity, value) = OPERATIONS[name]
+            address = draw.randrange(BLOCK_SIZE - 16)
+            start = time.time()
+            try:
+                master.execute(self.options.slave, function_code, address, quantity, value)
+                results["latencies"].append(time.time() - start)
+                results["by_operation"][name] += 1
+            except socket.timeout:
+                results["timeouts"] += 1
+            except ModbusError:
+                results["exceptions"] += 1
+            except ModbusInvalidResponseError:
+                results[self._classify_invalid_response(master)] += 1
+            except Exception:
+                results["errors"] += 1
+                # a new connection for the next request
+                master.close()
+
+    def run(self):
+        """run the load and returns the results as a dict"""
+        self._start()
+        try:
+            all_results = []
+            end_time = time.time() + self.options.duration
+            threads = []
+            for master in self._masters:
+                results = {
+                    "latencies": [], "timeouts": 0, "exceptions": 0, "crc_errors": 0, "errors": 0,
+                    "by_operation": dict((name, 0) for (name, weight) in self.operations),
+                }
+                all_results.append(results)
+                threads.append(threading.Thread(target=self._poll, args=(master, results, end_time)))
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            duration = time.time() - start
+        finally:
+            self._stop()
+        return self._summarize(all_results, duration)
+
+    def _summarize(self, all_results, duration):
+        """merge the results of the masters"""
+        latencies = sorted(latency for results in all_results for latency in results["latencies"])
+
+        def percentile(rank):
+            """latency of the given percentile in ms"""
+            if not latencies:
+                return None
+            return 1000.0 * latencies[min(len(latencies) - 1, int(len(latencies) * rank / 100.0))]
+
+        summary = {
+            "requests": len(latencies),
+            "requests_per_second": len(latencies) / duration,
+            "latency_ms": {
+                "p50": percentile(50), "p95": percentile(95), "p99": percentile(99),
+                "max": 1000.0 * latencies[-1] if latencies else None,
+            },
+            "by_operation": {},
+        }
+        for key in ("timeouts", "exceptions", "crc_errors", "errors"):
+            summary[key] = sum(results[key] for results in all_results)
+        for (name, weight) in self.operations:
+            summary["by_operation"][name] = sum(results["by_operation"][name] for results in all_results)
+        return {
+            "config": dict(vars(self.options), compare=None, json=None),
+            "environment": {
+                "modbus_tk": modbus_tk.VERSION, "python": sys.version.split()[0], "commit": get_commit(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": summary,
+        }
+
+
+def get_commit():
+    """returns the git commit of modbus_tk if it is known"""
+    try:
+        with open(os.devnull, "w") as devnull:
+            output = subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=devnull
+            )
+        return output.decode().strip()
+    except Exception:
+        return None
+
+
+def print_results(report, reference=None):
+    """print the results and their change from the reference results"""
+    results = report["results"]
+    lines = [("requests/s", results["requests_per_second"], "requests_per_second")]
+    for rank in ("p50", "p95", "p99", "max"):
+        lines.append(("latency {0} (ms)".format(rank), results["latency_ms"][rank], rank))
+    for key in ("timeouts", "exceptions", "crc_errors", "errors"):
+        lines.append((key, results[key], key))
+    for (label, value, key) in lines:
+        if isinstance(value, float):
+            value = "{0:.2f}".format(value)
+        line = "  {0:<20s} {1:>12}".format(label, "-" if value is None else value)
+        if reference:
+            ref = reference["results"]
+            old = ref["latency_ms"].get(key) if key in ref["latency_ms"] else ref.get(key)
+            new = results["latency_ms"].get(key) if key in results["latency_ms"] else results.get(key)
+            if old and new is not None:
+                line += "   {0:+.1f}%".format(100.0 * (new - old) / old)
+        print(line)
+    for (name, count) in sorted(results["by_operation"].items()):
+        print("  {0:<30s} {1:>10d}".format(name, count))
+
+
+def main(args=None):
+    """parse the command line, run the load and write the results"""
+    parser = argparse.ArgumentParser(description="Modbus load generator")
+    parser.add_argument("--transport", choices=("tcp", "rtu"), default="tcp")
+    parser.add_argument("--masters", type=int, default=4, help="number of masters, each in a thread")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument(
+        "--mix", default="read_holding_registers:3,write_multiple_registers:1",
+        help="weighted operations: {0}".format(", ".join(sorted(OPERATIONS)))
+    )
+    parser.add_argument("--slave", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=1.0, help="timeout of the masters in seconds")
+    parser.add_argument("--host", default="127.0.0.1", help="tcp: host of the server")
+    parser.add_argument("--port", type=int, default=0, help="tcp: port of a running server, else a server is started")
+    parser.add_argument("--baudrate", type=int, default=115200, help="rtu: simulated baudrate of the lines")
+    parser.add_argument("--latency", type=float, default=0.0, help="rtu: latency of the lines in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="rtu: probability of flipping each bit")
+    parser.add_argument("--json", help="file where the results are saved")
+    parser.add_argument("--compare", help="results saved by a previous run")
+    options = parser.parse_args(args)
+
+    report = LoadGenerator(options).run()
+
+    reference = None
+    if options.compare:
+        with open(options.compare) as the_file:
+            reference = json.load(the_file)
+    print_results(report, reference)
+    if options.json:
+        with open(options.json, "w") as the_file:
+            json.dump(report, the_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
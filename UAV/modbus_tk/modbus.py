@@ -14,18 +14,45 @@
 
 from __future__ import with_statement
 
+import array
+import bisect
+import collections
 import struct
+import sys
 import threading
 
 from modbus_tk import LOGGER
 from modbus_tk import defines
+from modbus_tk.capture import RECEIVED, SENT, new_connection_id
 from modbus_tk.exceptions import(
     ModbusError, ModbusFunctionNotSupportedError, DuplicatedKeyError, MissingKeyError, InvalidModbusBlockError,
     InvalidArgumentError, OverlapModbusBlockError, OutOfModbusBlockError, ModbusInvalidResponseError,
     ModbusInvalidRequestError
 )
 from modbus_tk.hooks import call_hooks
-from modbus_tk.utils import threadsafe_function, get_log_buffer
+from modbus_tk.utils import (
+    threadsafe_method, get_log_buffer, reorder_bytes, pack_bits, unpack_bits, bytes_to_int, int_to_bytes,
+    ReadWriteLock, ExclusiveLock, WORD_ORDER_PERMUTATIONS, PY2
+)
+
+# the registers are stored in native byte order and sent as big-endian
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+# the first byte of the requests which don't change the data of a slave
+_READ_REQUEST_CODES = tuple(
+    struct.pack(">B", function_code) for function_code in (
+        defines.READ_COILS, defines.READ_DISCRETE_INPUTS,
+        defines.READ_HOLDING_REGISTERS, defines.READ_INPUT_REGISTERS,
+    )
+)
+
+# the type of the blocks read by every read function
+_READ_BLOCK_TYPES = {
+    defines.READ_COILS: defines.COILS,
+    defines.READ_DISCRETE_INPUTS: defines.DISCRETE_INPUTS,
+    defines.READ_HOLDING_REGISTERS: defines.HOLDING_REGISTERS,
+    defines.READ_INPUT_REGISTERS: defines.ANALOG_INPUTS,
+}
 
 # modbus_tk is using the python logging mechanism
 # you can define this logger in your app in order to see its prints logs
@@ -71,6 +98,178 @@ class Query(object):
         """
         raise NotImplementedError()
 
+    def renew_request(self, request):
+        """
+        Get a request previously returned by build_request and make it ready
+        to be sent again. By default the request is sent unchanged
+        Returns a string
+        """
+        return request
+
+    def get_cache_key(self, request):
+        """
+        Get a full request and returns the part of it which identifies its response
+        for the response cache of the server. By default the responses are not cached
+        Returns a string or None
+        """
+        return None
+
+    def reuse_response(self, request, response):
+        """
+        Get the response cached for a request with the same cache key and make it
+        the response of this request. By default the response is sent unchanged
+        Returns a string
+        """
+        return response
+
+
+class PreparedRequest(object):
+    """
+    A modbus query compiled once by Master.prepare: it holds the request to be sent,
+    the expected length of the answer and the decoder of the returned data
+    """
+
+    def __init__(
+        self, query, request, slave, expected_length, is_read_function, data_format, nb_of_digits,
+        word_order=defines.WORD_ORDER_ABCD):
+        """Constructor"""
+        self.query = query
+        self.request = request
+        self.slave = slave
+        self.expected_length = expected_length
+        self.is_read_function = is_read_function
+        self.nb_of_digits = nb_of_digits
+        self.word_order = word_order
+        # without data format, the bits of the digits are unpacked
+        self._unpack = struct.Struct(data_format).unpack if data_format else None
+
+    def decode(self, response_pdu):
+        """
+        Analyze the response pdu and returns the data as a tuple according to the data_format
+        (calculated based on the function or user-defined)
+        """
+        (return_code, byte_2) = struct.unpack(">BB", response_pdu[0:2])
+
+        if return_code > 0x80:
+            # the slave has returned an error
+            exception_code = byte_2
+            raise ModbusError(exception_code)
+
+        if self.is_read_function:
+            # get the values returned by the reading function
+            byte_count = byte_2
+            data = response_pdu[2:]
+            if byte_count != len(data):
+                # the byte count in the pdu is invalid
+                raise ModbusInvalidResponseError(
+                    "Byte count is {0} while actual number of bytes is {1}. ".format(byte_count, len(data))
+                )
+            if self.word_order != defines.WORD_ORDER_ABCD:
+                data = reorder_bytes(data, self.word_order)
+        else:
+            # returns what is returned by the slave after a writing function
+            data = response_pdu[1:]
+
+        if self._unpack is None:
+            if len(data) != (self.nb_of_digits + 7) // 8:
+                raise ModbusInvalidResponseError(
+                    "{0} bytes are received for {1} digits. ".format(len(data), self.nb_of_digits)
+                )
+            return unpack_bits(data, self.nb_of_digits)
+
+        result = self._unpack(data)
+        if self.nb_of_digits > 0:
+            digits = []
+            for byte_val in result:
+                for i in range(8):
+                    if len(digits) >= self.nb_of_digits:
+                        break
+                    digits.append(byte_val % 2)
+                    byte_val = byte_val >> 1
+            result = tuple(digits)
+        return result
+
+
+class ReadPlan(object):
+    """
+    The requests needed for reading a list of register ranges (starting_address, quantity)
+    Overlapping ranges are read by the same request and ranges longer than max_quantity registers
+    are split in several requests. If max_gap is given, the ranges separated by max_gap registers
+    or less (0: touching ranges) are read by the same request too: the slave must answer a read
+    of the registers between them. modbus_tk slaves answer ILLEGAL_DATA_ADDRESS to a read across
+    2 blocks, even if they are contiguous
+    """
+
+    def __init__(self, ranges, max_gap=None, max_quantity=125):
+        """Constructor: computes the requests"""
+        if (max_gap is not None) and (max_gap < 0):
+            raise InvalidArgumentError("max_gap must be None, zero or a positive number")
+        if (max_quantity <= 0) or (max_quantity > 125):
+            raise InvalidArgumentError("max_quantity must be between 1 and 125")
+
+        self.max_quantity = max_quantity
+        self.ranges = [(starting_address, quantity) for (starting_address, quantity) in ranges]
+        for (starting_address, quantity) in self.ranges:
+            if quantity <= 0:
+                raise InvalidArgumentError("Invalid quantity {0} at address {1}".format(quantity, starting_address))
+
+        # the ranges starting before end + 1 + gap are merged with the current request
+        gap = -1 if max_gap is None else max_gap
+        # the (starting_address, quantity) of every request sorted by address
+        self.requests = []
+        start, end = None, None
+        for (range_start, range_end) in sorted((address, address + quantity) for (address, quantity) in self.ranges):
+            if start is not None:
+                if range_end <= end:
+                    # already read by the current request
+                    continue
+                if (range_start <= end + gap) and (range_end - start <= max_quantity):
+                    end = range_end
+                    continue
+                self.requests.append((start, end - start))
+                # don't read twice the registers of the current request
+                range_start = max(range_start, end)
+            while range_end - range_start > max_quantity:
+                self.requests.append((range_start, max_quantity))
+                range_start += max_quantity
+            start, end = range_start, range_end
+        if start is not None:
+            self.requests.append((start, end - start))
+        self._request_addresses = [starting_address for (starting_address, quantity) in self.requests]
+
+    @property
+    def round_trips(self):
+        """number of requests sent by the plan"""
+        return len(self.requests)
+
+    @property
+    def saved_round_trips(self):
+        """number of requests saved compared to reading every range on its own"""
+        one_by_one = sum(
+            (quantity + self.max_quantity - 1) // self.max_quantity for (address, quantity) in self.ranges
+        )
+        return one_by_one - len(self.requests)
+
+    def map_results(self, results):
+        """
+        Get the values returned by every request of the plan and returns
+        the values of every range as a list of tuples
+        """
+        values_of_ranges = []
+        for (starting_address, quantity) in self.ranges:
+            values = []
+            address, end = starting_address, starting_address + quantity
+            index = bisect.bisect_right(self._request_addresses, address) - 1
+            while address < end:
+                (request_address, request_quantity) = self.requests[index]
+                offset = address - request_address
+                chunk = results[index][offset:min(end - request_address, request_quantity)]
+                values.extend(chunk)
+                address += len(chunk)
+                index += 1
+            values_of_ranges.append(tuple(values))
+        return values_of_ranges
+
 
 class Master(object):
     """
@@ -82,7 +281,11 @@ class Master(object):
         """Constructor: can define a timeout"""
         self._timeout = timeout_in_sec
         self._verbose = False
+        self._capture = None
+        self._capture_id = 0
         self._is_opened = False
+        # one transaction at a time with this master: masters on different links run in parallel
+        self._lock = threading.RLock()
 
     def __del__(self):
         """Destructor: close the connection"""
@@ -92,6 +295,14 @@ class Master(object):
         """print some more log prints for debug purpose"""
         self._verbose = verbose
 
+    def set_capture(self, capture, connection_id=None):
+        """
+        record the sent and received frames in a capture.WireCapture: None stops recording
+        The frames are recorded with connection_id or with an id given to this master
+        """
+        self._capture = capture
+        self._capture_id = new_connection_id() if connection_id is None else connection_id
+
     def open(self):
         """open the communication with the slave"""
         if not self._is_opened:
@@ -132,23 +343,51 @@ class Master(object):
         """
         raise NotImplementedError()
 
-    @threadsafe_function
+    @threadsafe_method
     def execute(
-        self, slave, function_code, starting_address, quantity_of_x=0, output_value=0, data_format="", expected_length=-1):
+        self, slave, function_code, starting_address, quantity_of_x=0, output_value=0, data_format="", expected_length=-1,
+        word_order=defines.WORD_ORDER_ABCD):
         """
         Execute a modbus query and returns the data part of the answer as a tuple
         The returned tuple depends on the query function code. see modbus protocol
         specification for details
         data_format makes possible to extract the data like defined in the
         struct python module documentation
+        word_order is the order of the bytes of the registers data on the line
+        (see defines.WORD_ORDER_XXXX). The registers data is converted from/to
+        big-endian before being unpacked with data_format or after being packed
         """
+        prepared = self.prepare(
+            slave, function_code, starting_address, quantity_of_x, output_value, data_format, expected_length,
+            word_order
+        )
+        return self._send_and_decode(prepared, prepared.request)
+
+    @threadsafe_method
+    def execute_prepared(self, prepared):
+        """
+        Execute a query compiled by prepare and returns the data part of the answer as a tuple
+        Only the sending of the request and the decoding of the answer are done: the pdu,
+        the MAC layer part and the data format are reused from the prepared request
+        """
+        return self._send_and_decode(prepared, prepared.query.renew_request(prepared.request))
 
+    def prepare(
+        self, slave, function_code, starting_address, quantity_of_x=0, output_value=0, data_format="", expected_length=-1,
+        word_order=defines.WORD_ORDER_ABCD):
+        """
+        Build a modbus query once and returns it as a PreparedRequest which can be
+        executed many times with execute_prepared. Arguments are the same as execute
+        """
+        if word_order not in WORD_ORDER_PERMUTATIONS:
+            raise InvalidArgumentError("Invalid word order {0}".format(word_order))
+        # the number of bytes which are reordered together
+        group_size = max(len(WORD_ORDER_PERMUTATIONS[word_order]), 1)
         pdu = ""
         is_read_function = False
         nb_of_digits = 0
-
-        # open the connection if it is not already done
-        self.open()
+        # the word order only applies to the registers data
+        data_word_order = defines.WORD_ORDER_ABCD
 
         # Build the modbus pdu and the format of the expected data.
         # It depends of function code. see modbus specifications for details.
@@ -159,8 +398,6 @@ class Master(object):
             if (quantity_of_x % 8) > 0:
                 byte_count += 1
             nb_of_digits = quantity_of_x
-            if not data_format:
-                data_format = ">" + (byte_count * "B")
             if expected_length < 0:
                 # No length was specified and calculated length can be used:
                 # slave + func + bytcodeLen + bytecode + crc1 + crc2
@@ -168,6 +405,7 @@ class Master(object):
 
         elif function_code == defines.READ_INPUT_REGISTERS or function_code == defines.READ_HOLDING_REGISTERS:
             is_read_function = True
+            data_word_order = word_order
             pdu = struct.pack(">BHH", function_code, starting_address, quantity_of_x)
             if not data_format:
                 data_format = ">" + (quantity_of_x * "H")
@@ -196,17 +434,7 @@ class Master(object):
             if (len(output_value) % 8) > 0:
                 byte_count += 1
             pdu = struct.pack(">BHHB", function_code, starting_address, len(output_value), byte_count)
-            i, byte_value = 0, 0
-            for j in output_value:
-                if j > 0:
-                    byte_value += pow(2, i)
-                if i == 7:
-                    pdu += struct.pack(">B", byte_value)
-                    i, byte_value = 0, 0
-                else:
-                    i += 1
-            if i > 0:
-                pdu += struct.pack(">B", byte_value)
+            pdu += pack_bits(output_value)
             if not data_format:
                 data_format = ">HH"
             if expected_length < 0:
@@ -221,11 +449,15 @@ class Master(object):
                 byte_count = 2 * len(output_value)
             pdu = struct.pack(">BHHB", function_code, starting_address, byte_count // 2, byte_count)
             if output_value and data_format:
-                pdu += struct.pack(data_format, *output_value)
+                values = struct.pack(data_format, *output_value)
             else:
+                values = b""
                 for j in output_value:
                     fmt = "H" if j >= 0 else "h"
-                    pdu += struct.pack(">" + fmt, j)
+                    values += struct.pack(">" + fmt, j)
+            if byte_count % group_size:
+                raise InvalidArgumentError("{0} bytes can not be written as {1}".format(byte_count, word_order))
+            pdu += reorder_bytes(values, word_order)
             # data_format is now used to process response which is always 2 registers:
             #   1) data address of first register, 2) number of registers written
             data_format = ">HH"
@@ -257,6 +489,7 @@ class Master(object):
 
         elif function_code == defines.READ_WRITE_MULTIPLE_REGISTERS:
             is_read_function = True
+            data_word_order = word_order
             byte_count = 2 * len(output_value)
             pdu = struct.pack(
                 ">BHHHHB",
@@ -276,76 +509,73 @@ class Master(object):
         else:
             raise ModbusFunctionNotSupportedError("The {0} function code is not supported. ".format(function_code))
 
+        if is_read_function and (2 * quantity_of_x) % group_size and data_word_order != defines.WORD_ORDER_ABCD:
+            raise InvalidArgumentError("{0} registers can not be read as {1}".format(quantity_of_x, word_order))
+
         # instantiate a query which implements the MAC (TCP or RTU) part of the protocol
         query = self._make_query()
 
         # add the mac part of the protocol to the request
         request = query.build_request(pdu, slave)
 
+        return PreparedRequest(
+            query, request, slave, expected_length, is_read_function, data_format, nb_of_digits, data_word_order
+        )
+
+    def read_many(self, slave, ranges, function_code=defines.READ_HOLDING_REGISTERS, max_gap=None):
+        """
+        Read several ranges of registers (starting_address, quantity) with as few requests
+        as possible and returns the values of every range as a list of tuples.
+        ranges can also be a ReadPlan computed once and reused in a polling loop.
+        See ReadPlan for max_gap: the ranges it merges must be readable by one request
+        """
+        if function_code not in (defines.READ_HOLDING_REGISTERS, defines.READ_INPUT_REGISTERS):
+            raise InvalidArgumentError("read_many doesn't support the function code {0}".format(function_code))
+
+        plan = ranges if isinstance(ranges, ReadPlan) else ReadPlan(ranges, max_gap)
+        if self._verbose:
+            LOGGER.debug(
+                "read_many: %d ranges read with %d requests: %d round trips saved",
+                len(plan.ranges), plan.round_trips, plan.saved_round_trips
+            )
+
+        results = [
+            self.execute(slave, function_code, starting_address, quantity)
+            for (starting_address, quantity) in plan.requests
+        ]
+        return plan.map_results(results)
+
+    def _send_and_decode(self, prepared, request):
+        """send the request of a prepared query and returns the decoded answer"""
+        # open the connection if it is not already done
+        self.open()
+
         # send the request to the slave
         retval = call_hooks("modbus.Master.before_send", (self, request))
         if retval is not None:
             request = retval
         if self._verbose:
             LOGGER.debug(get_log_buffer("-> ", request))
+        if self._capture is not None:
+            self._capture.record(SENT, self._capture_id, request)
         self._send(request)
 
         call_hooks("modbus.Master.after_send", (self, ))
 
-        if slave != 0:
+        if prepared.slave != 0:
             # receive the data from the slave
-            response = self._recv(expected_length)
+            response = self._recv(prepared.expected_length)
             retval = call_hooks("modbus.Master.after_recv", (self, response))
             if retval is not None:
                 response = retval
             if self._verbose:
                 LOGGER.debug(get_log_buffer("<- ", response))
+            if self._capture is not None:
+                self._capture.record(RECEIVED, self._capture_id, response)
 
             # extract the pdu part of the response
-            response_pdu = query.parse_response(response)
-
-            # analyze the received data
-            (return_code, byte_2) = struct.unpack(">BB", response_pdu[0:2])
-
-            if return_code > 0x80:
-                # the slave has returned an error
-                exception_code = byte_2
-                raise ModbusError(exception_code)
-            else:
-                if is_read_function:
-                    # get the values returned by the reading function
-                    byte_count = byte_2
-                    data = response_pdu[2:]
-                    if byte_count != len(data):
-                        # the byte count in the pdu is invalid
-                        raise ModbusInvalidResponseError(
-                            "Byte count is {0} while actual number of bytes is {1}. ".format(byte_count, len(data))
-                        )
-                else:
-                    # returns what is returned by the slave after a writing function
-                    data = response_pdu[1:]
-
-                new_data = []
-                for i in range(5):
-                    new_data.append(data[2 + i * 4])
-                    new_data.append(data[3 + i * 4])
-                    new_data.append(data[0 + i * 4])
-                    new_data.append(data[1 + i * 4])
-                new_data = bytearray(new_data)
-
-                # returns the data as a tuple according to the data_format
-                # (calculated based on the function or user-defined)
-                result = struct.unpack(data_format, new_data)
-                if nb_of_digits > 0:
-                    digits = []
-                    for byte_val in result:
-                        for i in range(8):
-                            if len(digits) >= nb_of_digits:
-                                break
-                            digits.append(byte_val % 2)
-                            byte_val = byte_val >> 1
-                    result = tuple(digits)
-                return result
+            response_pdu = prepared.query.parse_response(response)
+            return prepared.decode(response_pdu)
 
     def set_timeout(self, timeout_in_sec):
         """Defines a timeout on the MAC layer"""
@@ -359,13 +589,19 @@ class Master(object):
 class ModbusBlock(object):
     """This class represents the values for a range of addresses"""
 
-    def __init__(self, starting_address, size, name=''):
+    # the responses of the read requests of the block can be reused while its generation is unchanged
+    cacheable = True
+
+    def __init__(self, starting_address, size, name='', unsigned=True):
         """
         Contructor: defines the address range and creates the array of values
+        The values are stored on 16 bits: unsigned if unsigned is true, signed otherwise
         """
         self.starting_address = starting_address
-        self._data = [0] * size
+        self._data = array.array("H" if unsigned else "h", [0]) * size
         self.size = len(self._data)
+        # incremented on every write: the values are unchanged as long as it is the same
+        self.generation = 0
 
     def is_in(self, starting_address, size):
         """
@@ -385,7 +621,232 @@ class ModbusBlock(object):
     def __setitem__(self, item, value):
         """"""
         call_hooks("modbus.ModbusBlock.setitem", (self, item, value))
-        return self._data.__setitem__(item, value)
+        if isinstance(item, slice) and not isinstance(value, array.array):
+            value = array.array(self._data.typecode, value)
+        self._data.__setitem__(item, value)
+        self.generation += 1
+
+    def get_bytes(self, offset, count):
+        """returns the values of count items from offset as big-endian words"""
+        values = self._data[offset:offset+count]
+        if _LITTLE_ENDIAN:
+            values.byteswap()
+        return values.tostring() if PY2 else values.tobytes()
+
+    def set_bytes(self, offset, data):
+        """write the values given as big-endian words from offset"""
+        values = array.array(self._data.typecode)
+        if PY2:
+            values.fromstring(bytes(data))
+        else:
+            values.frombytes(data)
+        if _LITTLE_ENDIAN:
+            values.byteswap()
+        self[offset:offset+len(values)] = values
+
+
+class SharedModbusBlock(ModbusBlock):
+    """
+    The values of a range of registers stored in a buffer shared with other processes, for
+    example the memory mapped file of a shared_bank.SharedRegisterBank. The values are big-endian
+    16-bit words like in the modbus frames: the item i is in the bytes 2*i and 2*i+1 of the buffer
+    """
+
+    # another process can write the values at any time: the responses are never reused
+    cacheable = False
+
+    def __init__(self, starting_address, size, buffer, name='', unsigned=True):
+        """Contructor: the buffer must be writable and 2*size bytes long"""
+        self.starting_address = starting_address
+        self.size = size
+        self._buffer = memoryview(buffer)
+        if len(self._buffer) != 2 * size or self._buffer.readonly:
+            raise InvalidArgumentError("a writable buffer of {0} bytes is needed".format(2 * size))
+        self._type = "H" if unsigned else "h"
+        # only the writes of this process are counted
+        self.generation = 0
+
+    def __getitem__(self, item):
+        """returns the value of an item or the values of a slice as a list"""
+        if isinstance(item, slice):
+            (start, stop, step) = item.indices(self.size)
+            count = max(stop - start, 0)
+            values = list(struct.unpack_from(">{0}{1}".format(count, self._type), self._buffer, 2 * start))
+            return values[::step] if step != 1 else values
+        if item < 0:
+            item += self.size
+        if not 0 <= item < self.size:
+            raise IndexError("shared block index out of range")
+        return struct.unpack_from(">" + self._type, self._buffer, 2 * item)[0]
+
+    def __setitem__(self, item, value):
+        """set the value of an item or the values of a slice"""
+        call_hooks("modbus.ModbusBlock.setitem", (self, item, value))
+        if isinstance(item, slice):
+            (start, stop, step) = item.indices(self.size)
+            if step != 1:
+                values = self[:]
+                values[item] = value
+                self._write(0, values)
+                return
+            values = list(value)
+            if len(values) != max(stop - start, 0):
+                raise ValueError("shared block slices can not be resized")
+            self._write(start, values)
+            return
+        if item < 0:
+            item += self.size
+        if not 0 <= item < self.size:
+            raise IndexError("shared block index out of range")
+        self._write(item, (value, ))
+
+    def _write(self, offset, values):
+        """write the values from offset without calling the hook"""
+        struct.pack_into(">{0}{1}".format(len(values), self._type), self._buffer, 2 * offset, *values)
+        self.generation += 1
+
+    def get_bytes(self, offset, count):
+        """returns the values of count items from offset as big-endian words: they are stored this way"""
+        return self._buffer[2 * offset:2 * (offset + count)].tobytes()
+
+    def set_bytes(self, offset, data):
+        """write the values given as big-endian words from offset"""
+        count = len(data) // 2
+        values = struct.unpack(">{0}{1}".format(count, self._type), data)
+        call_hooks("modbus.ModbusBlock.setitem", (self, slice(offset, offset + count), values))
+        self._buffer[2 * offset:2 * (offset + count)] = data
+        self.generation += 1
+
+
+class ModbusBitBlock(ModbusBlock):
+    """
+    The values of a range of coils or discrete inputs packed 8 per byte like on the line:
+    the first item is the least significant bit of the first byte
+    """
+
+    def __init__(self, starting_address, size, name=''):
+        """Contructor: defines the address range and creates the bytes of the values"""
+        self.starting_address = starting_address
+        self.size = size
+        # one more byte for shifting the last bits
+        self._data = bytearray((size + 7) // 8 + 1)
+        self.generation = 0
+
+    def __getitem__(self, item):
+        """returns the value of an item or the values of a slice as a list"""
+        if isinstance(item, slice):
+            (start, stop, step) = item.indices(self.size)
+            if step != 1:
+                return self[start:stop][::step]
+            return list(self.get_bits(start, max(stop - start, 0)))
+        if item < 0:
+            item += self.size
+        if not 0 <= item < self.size:
+            raise IndexError("bit block index out of range")
+        return (self._data[item >> 3] >> (item & 7)) & 1
+
+    def __setitem__(self, item, value):
+        """set the value of an item or the values of a slice: a value is 1 if true"""
+        call_hooks("modbus.ModbusBlock.setitem", (self, item, value))
+        if isinstance(item, slice):
+            (start, stop, step) = item.indices(self.size)
+            if step != 1:
+                values = self[:]
+                values[item] = value
+                self._set_packed_bits(0, pack_bits(values), self.size)
+                return
+            values = list(value)
+            if len(values) != max(stop - start, 0):
+                raise ValueError("bit block slices can not be resized")
+            self._set_packed_bits(start, pack_bits(values), len(values))
+            return
+        if item < 0:
+            item += self.size
+        if not 0 <= item < self.size:
+            raise IndexError("bit block index out of range")
+        if value:
+            self._data[item >> 3] |= 1 << (item & 7)
+        else:
+            self._data[item >> 3] &= ~(1 << (item & 7)) & 0xFF
+        self.generation += 1
+
+    def get_bits(self, offset, count):
+        """returns the values of count items from offset as a tuple of 0 and 1"""
+        return unpack_bits(self.get_packed_bits(offset, count), count)
+
+    def get_packed_bits(self, offset, count):
+        """returns the values of count items from offset packed 8 per byte"""
+        byte_count = (count + 7) // 8
+        (first, shift) = (offset >> 3, offset & 7)
+        if not shift:
+            data = self._data[first:first+byte_count]
+        else:
+            value = bytes_to_int(self._data[first:first+byte_count+1]) >> shift
+            data = bytearray(int_to_bytes(value & ((1 << (8 * byte_count)) - 1), byte_count))
+        if count & 7:
+            # clear the bits after the last item
+            data[-1] &= (1 << (count & 7)) - 1
+        return bytes(data)
+
+    def set_packed_bits(self, offset, data, count):
+        """write the values of count items packed 8 per byte from offset"""
+        call_hooks("modbus.ModbusBlock.setitem", (self, slice(offset, offset+count), unpack_bits(data, count)))
+        self._set_packed_bits(offset, data, count)
+
+    def _set_packed_bits(self, offset, data, count):
+        """write the bits without calling the hook"""
+        (first, shift) = (offset >> 3, offset & 7)
+        last = (offset + count + 7) >> 3
+        mask = ((1 << count) - 1) << shift
+        bits = (bytes_to_int(bytearray(data)) << shift) & mask
+        value = bytes_to_int(self._data[first:last])
+        self._data[first:last] = int_to_bytes((value & ~mask) | bits, last - first)
+        self.generation += 1
+
+
+class ModbusBlockList(list):
+    """
+    The blocks of a type sorted by starting address. The list of their starting
+    addresses makes possible to find a block by bisection
+    """
+
+    def __init__(self, blocks=()):
+        """Constructor: sort the given blocks"""
+        super(ModbusBlockList, self).__init__(sorted(blocks, key=lambda block: block.starting_address))
+        self.starting_addresses = [block.starting_address for block in self]
+
+    def find(self, address, length=1):
+        """returns the block containing the given number of items at address and their offset or (None, 0)"""
+        index = bisect.bisect_right(self.starting_addresses, address) - 1
+        if index >= 0:
+            block = self[index]
+            offset = address - block.starting_address
+            if block.size >= offset + length:
+                return block, offset
+        return None, 0
+
+    def find_overlap(self, starting_address, size):
+        """returns a block overlapping the given address range or None"""
+        index = bisect.bisect_right(self.starting_addresses, starting_address)
+        # only the previous block and the next one can overlap
+        for block in self[max(index - 1, 0):index + 1]:
+            if block.is_in(starting_address, size):
+                return block
+        return None
+
+    def add(self, block):
+        """insert the block at its place"""
+        index = bisect.bisect_left(self.starting_addresses, block.starting_address)
+        self.starting_addresses.insert(index, block.starting_address)
+        self.insert(index, block)
+
+    def remove(self, block):
+        """remove the block"""
+        index = bisect.bisect_left(self.starting_addresses, block.starting_address)
+        if index >= len(self) or self[index] is not block:
+            raise ValueError("The block at {0} is not in the list".format(block.starting_address))
+        del self.starting_addresses[index]
+        del self[index]
 
 
 class Slave(object):
@@ -394,8 +855,8 @@ class Slave(object):
     asked by a modbus query
     """
 
-    def __init__(self, slave_id, unsigned=True, memory=None):
-        """Constructor"""
+    def __init__(self, slave_id, unsigned=True, memory=None, concurrent_reads=False):
+        """Constructor: if concurrent_reads is true, the read requests are handled at the same time"""
         self._id = slave_id
 
         # treat every value written to/read from register as an unsigned value
@@ -406,15 +867,20 @@ class Slave(object):
         # a shortcut to find blocks per type
         if memory is None:
             self._memory = {
-                defines.COILS: [],
-                defines.DISCRETE_INPUTS: [],
-                defines.HOLDING_REGISTERS: [],
-                defines.ANALOG_INPUTS: [],
+                defines.COILS: ModbusBlockList(),
+                defines.DISCRETE_INPUTS: ModbusBlockList(),
+                defines.HOLDING_REGISTERS: ModbusBlockList(),
+                defines.ANALOG_INPUTS: ModbusBlockList(),
             }
         else:
+            # the lists are replaced in the given map: they stay shared by the slaves using it
+            for block_type in memory:
+                if not isinstance(memory[block_type], ModbusBlockList):
+                    memory[block_type] = ModbusBlockList(memory[block_type])
             self._memory = memory
-        # a lock for mutual access to the _blocks and _memory maps
-        self._data_lock = threading.RLock()
+        # a lock for mutual access to the _blocks and _memory maps: many readers or one writer
+        # if the reads are concurrent, else a plain lock which is cheaper for a single thread
+        self._data_lock = ReadWriteLock() if concurrent_reads else ExclusiveLock()
         # map modbus function code to a function:
         self._fn_code_map = {
             defines.READ_COILS: self._read_coils,
@@ -429,12 +895,10 @@ class Slave(object):
 
     def _get_block_and_offset(self, block_type, address, length):
         """returns the block and offset corresponding to the given address"""
-        for block in self._memory[block_type]:
-            if address >= block.starting_address:
-                offset = address - block.starting_address
-                if block.size >= offset + length:
-                    return block, offset
-        raise ModbusError(defines.ILLEGAL_DATA_ADDRESS)
+        block, offset = self._memory[block_type].find(address, length)
+        if block is None:
+            raise ModbusError(defines.ILLEGAL_DATA_ADDRESS)
+        return block, offset
 
     def _read_digital(self, block_type, request_pdu):
         """read the value of coils and discrete inputs"""
@@ -446,33 +910,13 @@ class Slave(object):
 
         block, offset = self._get_block_and_offset(block_type, starting_address, quantity_of_x)
 
-        values = block[offset:offset+quantity_of_x]
-
-        # pack bits in bytes
-        byte_count = quantity_of_x // 8
-        if (quantity_of_x % 8) > 0:
-            byte_count += 1
-
-        # write the response header
-        response = struct.pack(">B", byte_count)
-
-        i, byte_value = 0, 0
-        for coil in values:
-            if coil:
-                byte_value += (1 << i)
-            if i >= 7:
-                # write the values of 8 bits in a byte
-                response += struct.pack(">B", byte_value)
-                # reset the counters
-                i, byte_value = 0, 0
-            else:
-                i += 1
-
-        # if there is remaining bits: add one more byte with their values
-        if i > 0:
-            fmt = "B" if self.unsigned else "b"
-            response += struct.pack(">"+fmt, byte_value)
-        return response
+        # write the response header and the bits packed 8 per byte
+        if isinstance(block, ModbusBitBlock):
+            data = block.get_packed_bits(offset, quantity_of_x)
+        else:
+            # a block of registers given for bits in the memory map of the slave
+            data = pack_bits(list(block[offset:offset+quantity_of_x]))
+        return struct.pack(">B", len(data)) + data
 
     def _read_coils(self, request_pdu):
         """handle read coils modbus function"""
@@ -496,16 +940,8 @@ class Slave(object):
         # look for the block corresponding to the request
         block, offset = self._get_block_and_offset(block_type, starting_address, quantity_of_x)
 
-        # get the values
-        values = block[offset:offset+quantity_of_x]
-
-        # write the response header
-        response = struct.pack(">B", 2 * quantity_of_x)
-        # add the values of every register on 2 bytes
-        for reg in values:
-            fmt = "H" if self.unsigned else "h"
-            response += struct.pack(">"+fmt, reg)
-        return response
+        # write the response header and the values of every register on 2 bytes
+        return struct.pack(">B", 2 * quantity_of_x) + block.get_bytes(offset, quantity_of_x)
 
     def _read_holding_registers(self, request_pdu):
         """handle read coils modbus function"""
@@ -523,20 +959,17 @@ class Slave(object):
         # get the starting address and the number of items from the request pdu
         (starting_address, quantity_of_x, byte_count) = struct.unpack(">HHB", request_pdu[1:6])
 
-        if (quantity_of_x <= 0) or (quantity_of_x > 123) or (byte_count != (quantity_of_x * 2)):
+        if (quantity_of_x <= 0) or (quantity_of_x > 123) or (byte_count != (quantity_of_x * 2)) \
+                or (len(request_pdu) < 6 + byte_count):
             # maximum allowed size is 123 registers in one reading
             raise ModbusError(defines.ILLEGAL_DATA_VALUE)
 
         # look for the block corresponding to the request
         block, offset = self._get_block_and_offset(defines.HOLDING_REGISTERS, starting_address, quantity_of_x)
 
-        count = 0
-        for i in range(quantity_of_x):
-            count += 1
-            fmt = "H" if self.unsigned else "h"
-            block[offset+i] = struct.unpack(">"+fmt, request_pdu[6+2*i:8+2*i])[0]
+        block.set_bytes(offset, request_pdu[6:6+byte_count])
 
-        return struct.pack(">HH", starting_address, count)
+        return struct.pack(">HH", starting_address, quantity_of_x)
 
     def _write_multiple_coils(self, request_pdu):
         """execute modbus function 15"""
@@ -548,30 +981,20 @@ class Slave(object):
         if (quantity_of_x % 8) > 0:
             expected_byte_count += 1
 
-        if (quantity_of_x <= 0) or (quantity_of_x > 1968) or (byte_count != expected_byte_count):
+        if (quantity_of_x <= 0) or (quantity_of_x > 1968) or (byte_count != expected_byte_count) \
+                or (len(request_pdu) < 6 + byte_count):
             # maximum allowed size is 1968 coils
             raise ModbusError(defines.ILLEGAL_DATA_VALUE)
 
         # look for the block corresponding to the request
         block, offset = self._get_block_and_offset(defines.COILS, starting_address, quantity_of_x)
 
-        count = 0
-        for i in range(byte_count):
-            if count >= quantity_of_x:
-                break
-            fmt = "B" if self.unsigned else "b"
-            (byte_value, ) = struct.unpack(">"+fmt, request_pdu[6+i:7+i])
-            for j in range(8):
-                if count >= quantity_of_x:
-                    break
-
-                if byte_value & (1 << j):
-                    block[offset+i*8+j] = 1
-                else:
-                    block[offset+i*8+j] = 0
-
-                count += 1
-        return struct.pack(">HH", starting_address, count)
+        if isinstance(block, ModbusBitBlock):
+            block.set_packed_bits(offset, request_pdu[6:6+byte_count], quantity_of_x)
+        else:
+            # a block of registers given for bits in the memory map of the slave
+            block[offset:offset+quantity_of_x] = unpack_bits(request_pdu[6:6+byte_count], quantity_of_x)
+        return struct.pack(">HH", starting_address, quantity_of_x)
 
     def _write_single_register(self, request_pdu):
         """execute modbus function 6"""
@@ -604,8 +1027,12 @@ class Slave(object):
         parse the request pdu, makes the corresponding action
         and returns the response pdu
         """
-        # thread-safe
-        with self._data_lock:
+        # thread-safe: the reading requests are handled at the same time
+        if request_pdu[0:1] in _READ_REQUEST_CODES:
+            lock = self._data_lock.read_lock
+        else:
+            lock = self._data_lock.write_lock
+        with lock:
             try:
                 retval = call_hooks("modbus.Slave.handle_request", (self, request_pdu))
                 if retval is not None:
@@ -644,10 +1071,14 @@ class Slave(object):
                 call_hooks("modbus.Slave.on_exception", (self, function_code, excpt))
                 return struct.pack(">BB", function_code+128, excpt.get_exception_code())
 
-    def add_block(self, block_name, block_type, starting_address, size):
-        """Add a new block identified by its name"""
+    def add_block(self, block_name, block_type, starting_address, size, buffer=None):
+        """
+        Add a new block identified by its name
+        The values of a block of registers can be stored in a buffer shared with other processes:
+        see SharedModbusBlock
+        """
         # thread-safe
-        with self._data_lock:
+        with self._data_lock.write_lock:
             if size <= 0:
                 raise InvalidArgumentError("size must be a positive number")
 
@@ -660,24 +1091,28 @@ class Slave(object):
             if block_type not in self._memory:
                 raise InvalidModbusBlockError("Invalid block type {0}".format(block_type))
 
+            if buffer is not None and block_type in (defines.COILS, defines.DISCRETE_INPUTS):
+                raise InvalidArgumentError("only the values of the registers can be stored in a buffer")
+
             # check that the new block doesn't overlap an existing block
             # it means that only 1 block per type must correspond to a given address
             # for example: it must not have 2 holding registers at address 100
-            index = 0
-            for i in range(len(self._memory[block_type])):
-                block = self._memory[block_type][i]
-                if block.is_in(starting_address, size):
-                    raise OverlapModbusBlockError(
-                        "Overlap block at {0} size {1}".format(block.starting_address, block.size)
-                    )
-                if block.starting_address > starting_address:
-                    index = i
-                    break
+            block = self._memory[block_type].find_overlap(starting_address, size)
+            if block:
+                raise OverlapModbusBlockError(
+                    "Overlap block at {0} size {1}".format(block.starting_address, block.size)
+                )
 
+            if block_type in (defines.COILS, defines.DISCRETE_INPUTS):
+                block = ModbusBitBlock(starting_address, size, block_name)
+            elif buffer is not None:
+                block = SharedModbusBlock(starting_address, size, buffer, block_name, self.unsigned)
+            else:
+                block = ModbusBlock(starting_address, size, block_name, self.unsigned)
             # if the block is ok: register it
             self._blocks[block_name] = (block_type, starting_address)
             # add it in the 'per type' shortcut
-            self._memory[block_type].insert(index, ModbusBlock(starting_address, size, block_name))
+            self._memory[block_type].add(block)
 
     def remove_block(self, block_name):
         """
@@ -685,31 +1120,37 @@ class Slave(object):
         Raise an exception if not found
         """
         # thread safe
-        with self._data_lock:
+        with self._data_lock.write_lock:
             block = self._get_block(block_name)
 
             # the block has been found: remove it from the shortcut
             block_type = self._blocks.pop(block_name)[0]
             self._memory[block_type].remove(block)
+            # the responses cached for the block can't be reused
+            block.generation += 1
 
     def remove_all_blocks(self):
         """
         Remove all the blocks
         """
         # thread safe
-        with self._data_lock:
+        with self._data_lock.write_lock:
+            for blocks in self._memory.values():
+                for block in blocks:
+                    # the responses cached for the block can't be reused
+                    block.generation += 1
             self._blocks.clear()
             for key in self._memory:
-                self._memory[key] = []
+                self._memory[key] = ModbusBlockList()
 
     def _get_block(self, block_name):
         """Find a block by its name and raise and exception if not found"""
         if block_name not in self._blocks:
             raise MissingKeyError("block {0} not found".format(block_name))
         (block_type, starting_address) = self._blocks[block_name]
-        for block in self._memory[block_type]:
-            if block.starting_address == starting_address:
-                return block
+        block = self._memory[block_type].find(starting_address)[0]
+        if block is not None and block.starting_address == starting_address:
+            return block
         raise Exception("Bug?: the block {0} is not registered properly in memory".format(block_name))
 
     def set_values(self, block_name, address, values):
@@ -719,34 +1160,44 @@ class Slave(object):
         If values is a number, only one value is written
         """
         # thread safe
-        with self._data_lock:
-            block = self._get_block(block_name)
+        with self._data_lock.write_lock:
+            self._write_values(self._get_write_offset(block_name, address, values), values)
 
-            # the block has been found
-            # check that it doesn't write out of the block
-            offset = address-block.starting_address
+    def _get_write_offset(self, block_name, address, values):
+        """
+        returns the block and the offset where the values are written by set_values
+        The lock must be acquired
+        """
+        block = self._get_block(block_name)
 
-            size = 1
-            if isinstance(values, list) or isinstance(values, tuple):
-                size = len(values)
+        # the block has been found
+        # check that it doesn't write out of the block
+        offset = address-block.starting_address
 
-            if (offset < 0) or ((offset + size) > block.size):
-                raise OutOfModbusBlockError(
-                    "address {0} size {1} is out of block {2}".format(address, size, block_name)
-                )
+        size = 1
+        if isinstance(values, list) or isinstance(values, tuple):
+            size = len(values)
 
-            # if Ok: write the values
-            if isinstance(values, list) or isinstance(values, tuple):
-                block[offset:offset+len(values)] = values
-            else:
-                block[offset] = values
+        if (offset < 0) or ((offset + size) > block.size):
+            raise OutOfModbusBlockError(
+                "address {0} size {1} is out of block {2}".format(address, size, block_name)
+            )
+        return block, offset
+
+    def _write_values(self, block_offset, values):
+        """write the values at the offset of the block. The lock must be acquired"""
+        (block, offset) = block_offset
+        if isinstance(values, list) or isinstance(values, tuple):
+            block[offset:offset+len(values)] = values
+        else:
+            block[offset] = values
 
     def get_values(self, block_name, address, size=1):
         """
         return the values of n items at the given address of the given block
         """
         # thread safe
-        with self._data_lock:
+        with self._data_lock.read_lock:
             block = self._get_block(block_name)
 
             # the block has been found
@@ -764,40 +1215,73 @@ class Slave(object):
             else:
                 return tuple(block[offset:offset+size])
 
+    def _find_read_block(self, request_pdu):
+        """returns the block read by a valid read request or None"""
+        if len(request_pdu) != 5:
+            return None
+        (function_code, address, quantity) = struct.unpack(">BHH", request_pdu)
+        block_type = _READ_BLOCK_TYPES.get(function_code)
+        if block_type is None:
+            return None
+        with self._data_lock.read_lock:
+            return self._memory[block_type].find(address, quantity)[0]
+
+    def get_blocks(self):
+        """returns a dict of the blocks of the slave by name"""
+        with self._data_lock.read_lock:
+            return dict((block_name, self._get_block(block_name)) for block_name in self._blocks)
+
+    def get_generation(self, block_name):
+        """
+        return the generation of the given block: it is incremented on every write,
+        the values of the block have not changed as long as it is the same
+        """
+        with self._data_lock.read_lock:
+            return self._get_block(block_name).generation
+
 
 class Databank(object):
     """A databank is a shared place containing the data of all slaves"""
 
-    def __init__(self, error_on_missing_slave=True):
-        """Constructor"""
+    def __init__(self, error_on_missing_slave=True, concurrent_reads=False):
+        """
+        Constructor: if concurrent_reads is true, the read requests of a slave are handled at the
+        same time by several threads. It is slower when there is a single thread, like in TcpServer and RtuServer
+        """
         # the map of slaves by ids
         self._slaves = {}
-        # protect access to the map of slaves
-        self._lock = threading.RLock()
+        self._concurrent_reads = concurrent_reads
+        # protect access to the map of slaves: many readers or one writer
+        self._lock = ReadWriteLock() if concurrent_reads else ExclusiveLock()
         self.error_on_missing_slave = error_on_missing_slave
 
     def add_slave(self, slave_id, unsigned=True, memory=None):
         """Add a new slave with the given id"""
-        with self._lock:
+        with self._lock.write_lock:
             if (slave_id <= 0) or (slave_id > 255):
                 raise Exception("Invalid slave id {0}".format(slave_id))
             if slave_id not in self._slaves:
-                self._slaves[slave_id] = Slave(slave_id, unsigned, memory)
+                self._slaves[slave_id] = Slave(slave_id, unsigned, memory, self._concurrent_reads)
                 return self._slaves[slave_id]
             else:
                 raise DuplicatedKeyError("Slave {0} already exists".format(slave_id))
 
     def get_slave(self, slave_id):
         """Get the slave with the given id"""
-        with self._lock:
+        with self._lock.read_lock:
             if slave_id in self._slaves:
                 return self._slaves[slave_id]
             else:
                 raise MissingKeyError("Slave {0} doesn't exist".format(slave_id))
 
+    def get_slaves(self):
+        """returns a dict of the slaves by id"""
+        with self._lock.read_lock:
+            return dict(self._slaves)
+
     def remove_slave(self, slave_id):
         """Remove the slave with the given id"""
-        with self._lock:
+        with self._lock.write_lock:
             if slave_id in self._slaves:
                 self._slaves.pop(slave_id)
             else:
@@ -805,23 +1289,81 @@ class Databank(object):
 
     def remove_all_slaves(self):
         """clean the list of slaves"""
-        with self._lock:
+        with self._lock.write_lock:
             self._slaves.clear()
 
-    def handle_request(self, query, request):
+    def apply_updates(self, batch):
+        """
+        Write many values at once. batch is a sequence of (slave_id, block_name, address, values)
+        written like with Slave.set_values. Every slave of the batch is locked once for the whole batch:
+        the readers see all the new values or none of them. Nothing is written if an entry is invalid
+        """
+        batch = list(batch)
+        with self._lock.read_lock:
+            slaves = {}
+            for (slave_id, block_name, address, values) in batch:
+                if slave_id not in slaves:
+                    if slave_id not in self._slaves:
+                        raise MissingKeyError("Slave {0} doesn't exist".format(slave_id))
+                    slaves[slave_id] = self._slaves[slave_id]
+
+        # the slaves are always locked in the same order: two batches can't wait for each other
+        locked = []
+        try:
+            for slave_id in sorted(slaves):
+                slaves[slave_id]._data_lock.acquire_write()
+                locked.append(slaves[slave_id])
+            # check every entry before writing
+            offsets = [
+                slaves[slave_id]._get_write_offset(block_name, address, values)
+                for (slave_id, block_name, address, values) in batch
+            ]
+            written = []
+            try:
+                for (block_offset, (slave_id, block_name, address, values)) in zip(offsets, batch):
+                    (block, offset) = block_offset
+                    size = len(values) if isinstance(values, (list, tuple)) else 1
+                    written.append((block_offset, block[offset:offset + size]))
+                    slaves[slave_id]._write_values(block_offset, values)
+            except Exception:
+                # a value out of the range of its block: the entries written get their previous values back
+                for ((block, offset), previous_values) in reversed(written):
+                    block[offset:offset + len(previous_values)] = previous_values
+                raise
+        finally:
+            for slave in reversed(locked):
+                slave._data_lock.release_write()
+
+    def get_read_block(self, slave_id, request_pdu):
+        """
+        returns the slave and the block read by a valid read request of the slave,
+        or the slave and None if it is not a read request, or (None, None) if there is no such slave
+        """
+        with self._lock.read_lock:
+            slave = self._slaves.get(slave_id)
+        if slave is None:
+            return (None, None)
+        return (slave, slave._find_read_block(request_pdu))
+
+    def handle_request(self, query, request, parsed_request=None):
         """
         when a request is received, handle it and returns the response pdu
+        parsed_request is the (slave_id, request_pdu) of the request if the query has already parsed it
         """
         request_pdu = ""
         try:
             # extract the pdu and the slave id
-            (slave_id, request_pdu) = query.parse_request(request)
+            if parsed_request is None:
+                parsed_request = query.parse_request(request)
+            (slave_id, request_pdu) = parsed_request
 
             # get the slave and let him executes the action
             if slave_id == 0:
                 # broadcast
-                for key in self._slaves:
-                    self._slaves[key].handle_request(request_pdu, broadcast=True)
+                with self._lock.read_lock:
+                    slaves = list(self._slaves.values())
+                for slave in slaves:
+                    slave.handle_request(request_pdu, broadcast=True)
                 return
             else:
                 try:
@@ -856,6 +1398,45 @@ class Databank(object):
         return struct.pack(">BB", func_code + 0x80, defines.SLAVE_DEVICE_FAILURE)
 
 
+class ResponseCache(object):
+    """
+    The entries of the response cache of a server by request key.
+    The least recently used entry is evicted when there are more than max_entries
+    """
+
+    def __init__(self, max_entries=256):
+        """Constructor: the cache is empty"""
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """returns the number of entries"""
+        return len(self._entries)
+
+    def get(self, key):
+        """returns the entry of the given key or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # it becomes the most recently used
+                self._entries[key] = entry
+            return entry
+
+    def put(self, key, entry):
+        """add or replace the entry of the given key"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """remove every entry"""
+        with self._lock:
+            self._entries.clear()
+
+
 class Server(object):
     """
     This class owns several slaves and defines an interface
@@ -867,6 +1448,9 @@ class Server(object):
         # never use a mutable type as default argument
         self._databank = databank if databank else Databank()
         self._verbose = False
+        self._capture = None
+        self._capture_id = 0
+        self._response_cache = None
         self._thread = None
         self._go = None
         self._make_thread()
@@ -892,6 +1476,22 @@ class Server(object):
         """if verbose is true the sent and received packets will be logged"""
         self._verbose = verbose
 
+    def set_capture(self, capture, connection_id=None):
+        """
+        record the received requests and the sent responses in a capture.WireCapture: None stops recording
+        The tcp servers record the frames of each client with the id of its connection
+        """
+        self._capture = capture
+        self._capture_id = new_connection_id() if connection_id is None else connection_id
+
+    def set_response_cache(self, max_entries=256):
+        """
+        Keep the responses of up to max_entries different read requests: 0 disables the cache
+        A response is sent again as long as the block it has been read from is not written.
+        The hooks of the slaves are not called when a response is found in the cache
+        """
+        self._response_cache = ResponseCache(max_entries) if max_entries else None
+
     def get_db(self):
         """returns the databank"""
         return self._databank
@@ -912,6 +1512,10 @@ class Server(object):
         """remove the slave with the given id"""
         self._databank.remove_all_slaves()
 
+    def apply_updates(self, batch):
+        """write many (slave_id, block_name, address, values) at once: see Databank.apply_updates"""
+        self._databank.apply_updates(batch)
+
     def _make_query(self):
         """
         Returns an instance of a Query subclass implementing
@@ -926,10 +1530,22 @@ class Server(object):
 
     def stop(self):
         """stop the server. It doesn't handle request anymore"""
-        if self._thread.isAlive():
+        if self._thread.is_alive():
             self._go.clear()
             self._thread.join()
 
+    def run_until(self, is_stopped):
+        """
+        handle the requests in the calling thread until is_stopped() returns true,
+        instead of start and stop: for example in a worker process
+        """
+        self._do_init()
+        try:
+            while not is_stopped():
+                self._do_run()
+        finally:
+            self._do_exit()
+
     def _run_server(self):
         """main function of the main thread"""
         try:
@@ -943,11 +1559,16 @@ class Server(object):
         # make possible to rerun in future
         self._make_thread()
 
-    def _handle(self, request):
-        """handle a received sentence"""
+    def _handle(self, request, connection_id=None):
+        """handle a received sentence: connection_id identifies the client in the capture"""
 
         if self._verbose:
             LOGGER.debug(get_log_buffer("-->", request))
+        capture = self._capture
+        if capture is not None:
+            if connection_id is None:
+                connection_id = self._capture_id
+            capture.record(RECEIVED, connection_id, request)
 
         # gets a query for analyzing the request
         query = self._make_query()
@@ -956,11 +1577,58 @@ class Server(object):
         if retval:
             request = retval
 
-        response = self._databank.handle_request(query, request)
+        if self._response_cache is not None:
+            response = self._handle_cached(query, request)
+        else:
+            response = self._databank.handle_request(query, request)
         retval = call_hooks("modbus.Server.after_handle_request", (self, response))
         if retval:
             response = retval
 
         if response and self._verbose:
             LOGGER.debug(get_log_buffer("<--", response))
+        if response and capture is not None:
+            capture.record(SENT, connection_id, response)
+        return response
+
+    def _is_current_slave(self, slave_id, slave):
+        """returns true if the slave still has this id in the databank"""
+        try:
+            return self._databank.get_slave(slave_id) is slave
+        except MissingKeyError:
+            return False
+
+    def _handle_cached(self, query, request):
+        """handle a request: the response of a read request is reused until its block is written"""
+        key = query.get_cache_key(request)
+        if key is None:
+            return self._databank.handle_request(query, request)
+
+        entry = self._response_cache.get(key)
+        if entry is not None:
+            (response, block, generation, slave_id, slave) = entry
+            if block.generation == generation and self._is_current_slave(slave_id, slave):
+                return query.reuse_response(request, response)
+
+        try:
+            parsed_request = query.parse_request(request)
+        except Exception:
+            # the databank handles the invalid requests
+            return self._databank.handle_request(query, request)
+        (slave_id, request_pdu) = parsed_request
+        (slave, block) = self._databank.get_read_block(slave_id, request_pdu)
+        if block is None or not block.cacheable:
+            return self._databank.handle_request(query, request, parsed_request)
+
+        # the generation is read before the values: a write in between makes the entry invalid
+        generation = block.generation
+        try:
+            response_pdu = slave.handle_request(request_pdu)
+        except Exception:
+            # the databank reports the error
+            return self._databank.handle_request(query, request, parsed_request)
+        response = query.build_response(response_pdu)
+        # the exception responses are not cached: their function code has the bit 0x80
+        if struct.unpack(">B", response_pdu[0:1])[0] < 0x80:
+            self._response_cache.put(key, (response, block, generation, slave_id, slave))
         return response
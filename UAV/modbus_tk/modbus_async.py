@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Modbus TCP and RTU over TCP masters and Modbus TCP server built on asyncio streams:
+ one event loop can poll many slaves or serve many clients without a thread for each
+"""
+
+import asyncio
+import itertools
+import struct
+
+from modbus_tk import LOGGER
+from modbus_tk import defines
+from modbus_tk.capture import RECEIVED, SENT, new_connection_id
+from modbus_tk.hooks import call_hooks
+from modbus_tk.modbus import Databank, Master, Server, ModbusInvalidResponseError
+from modbus_tk.modbus_rtu import RtuQuery, get_response_length
+from modbus_tk.modbus_tcp import TcpQuery, ModbusInvalidMbapError
+from modbus_tk.utils import get_log_buffer
+
+
+class AsyncTcpMaster(Master):
+    """
+    Subclass of Master. Implements the Modbus TCP MAC layer with asyncio streams
+    open, close, execute and execute_prepared are coroutines
+    """
+
+    def __init__(self, host="127.0.0.1", port=502, timeout_in_sec=5.0):
+        """Constructor. Set the communication settings"""
+        super(AsyncTcpMaster, self).__init__(timeout_in_sec)
+        self._host = host
+        self._port = port
+        self._reader = None
+        self._writer = None
+        # an asyncio lock replaces the lock of the threads
+        self._lock = None
+        self._transaction_ids = itertools.count(1)
+
+    def __del__(self):
+        """Destructor: close the connection"""
+        if self._writer:
+            self._writer.close()
+
+    async def open(self):
+        """open the communication with the slave"""
+        if not self._is_opened:
+            call_hooks("modbus_async.AsyncTcpMaster.before_connect", (self, ))
+            (self._reader, self._writer) = await asyncio.wait_for(
+                asyncio.open_connection(self._host, self._port), self.get_timeout() or None
+            )
+            call_hooks("modbus_async.AsyncTcpMaster.after_connect", (self, ))
+            self._is_opened = True
+
+    async def close(self):
+        """close the communication with the slave"""
+        if self._is_opened:
+            call_hooks("modbus_async.AsyncTcpMaster.before_close", (self, ))
+            self._writer.close()
+            self._reader, self._writer = None, None
+            self._is_opened = False
+            call_hooks("modbus_async.AsyncTcpMaster.after_close", (self, ))
+
+    async def execute(
+        self, slave, function_code, starting_address, quantity_of_x=0, output_value=0, data_format="", expected_length=-1,
+        word_order=defines.WORD_ORDER_ABCD):
+        """
+        Execute a modbus query and returns the data part of the answer as a tuple
+        Arguments are the same as Master.execute
+        """
+        prepared = self.prepare(
+            slave, function_code, starting_address, quantity_of_x, output_value, data_format, expected_length,
+            word_order
+        )
+        return await self._send_and_decode(prepared, prepared.request)
+
+    async def execute_prepared(self, prepared):
+        """Execute a query compiled by prepare and returns the data part of the answer as a tuple"""
+        return await self._send_and_decode(prepared, prepared.query.renew_request(prepared.request))
+
+    async def _send_and_decode(self, prepared, request):
+        """send the request of a prepared query and returns the decoded answer"""
+        if self._lock is None:
+            # created here for being bound to the running loop
+            self._lock = asyncio.Lock()
+
+        # one transaction at a time on the connection
+        async with self._lock:
+            await self.open()
+
+            retval = call_hooks("modbus.Master.before_send", (self, request))
+            if retval is not None:
+                request = retval
+            if self._verbose:
+                LOGGER.debug(get_log_buffer("-> ", request))
+            if self._capture is not None:
+                self._capture.record(SENT, self._capture_id, request)
+            try:
+                self._writer.write(request)
+                await self._writer.drain()
+                call_hooks("modbus.Master.after_send", (self, ))
+
+                if prepared.slave == 0:
+                    return None
+
+                response = await asyncio.wait_for(self._recv(prepared.expected_length), self.get_timeout() or None)
+
+                retval = call_hooks("modbus.Master.after_recv", (self, response))
+                if retval is not None:
+                    response = retval
+                if self._verbose:
+                    LOGGER.debug(get_log_buffer("<- ", response))
+                if self._capture is not None:
+                    self._capture.record(RECEIVED, self._capture_id, response)
+
+                response_pdu = prepared.query.parse_response(response)
+            except (
+                asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ModbusInvalidResponseError,
+                ModbusInvalidMbapError
+            ):
+                # the stream can't be trusted anymore: it may be in the middle of a frame. Reconnect on next request
+                await self.close()
+                raise
+
+        return prepared.decode(response_pdu)
+
+    async def _recv(self, expected_length=-1):
+        """Receive the response from the slave: the length of the response is written in the mbap"""
+        mbap = await self._reader.readexactly(7)
+        (length, ) = struct.unpack(">H", mbap[4:6])
+        if length < 1:
+            raise ModbusInvalidResponseError("Invalid length {0} in the mbap".format(length))
+        return mbap + await self._reader.readexactly(length - 1)
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
+        return TcpQuery(self._transaction_ids)
+
+
+class AsyncRtuOverTcpMaster(AsyncTcpMaster):
+    """Subclass of AsyncTcpMaster. Implements the Modbus RTU over TCP MAC layer"""
+
+    async def _recv(self, expected_length=-1):
+        """
+        Receive the response from the slave
+        Its length is given by the function code. expected_length is used for the other functions
+        """
+        response = await self._reader.readexactly(2)
+        length = get_response_length(response, expected_length)
+        if length == 0:
+            response += await self._reader.readexactly(1)
+            length = get_response_length(response, expected_length)
+        if length < 0:
+            raise ModbusInvalidResponseError("The length of the response is unknown")
+        return response + await self._reader.readexactly(length - len(response))
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus RTU protocol"""
+        return RtuQuery()
+
+
+class AsyncTcpServer(Server):
+    """
+    This class implements a modbus tcp server serving every client from the asyncio event loop
+    start and stop are coroutines
+    """
+
+    def __init__(self, port=502, address='', databank=None, error_on_missing_slave=True):
+        """Constructor: initializes the server settings"""
+        databank = databank if databank else Databank(error_on_missing_slave=error_on_missing_slave)
+        super(AsyncTcpServer, self).__init__(databank)
+        self._sa = (address, port)
+        self._server = None
+
+    def _make_thread(self):
+        """the server runs in the event loop: no thread is needed"""
+        pass
+
+    def _make_query(self):
+        """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
+        return TcpQuery()
+
+    async def start(self):
+        """Start the server. It will handle request"""
+        self._server = await asyncio.start_server(self._serve_client, self._sa[0] or None, self._sa[1])
+
+    async def stop(self):
+        """stop the server. It doesn't handle request anymore"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            LOGGER.info("%s has stopped", self.__class__)
+
+    async def _serve_client(self, reader, writer):
+        """handle the requests of a client until it disconnects"""
+        address = writer.get_extra_info("peername")
+        LOGGER.info("%s is connected", str(address))
+        # the id of the connection in the capture of the server
+        capture_id = new_connection_id()
+        call_hooks("modbus_async.AsyncTcpServer.on_connect", (self, writer, address))
+        try:
+            while True:
+                # read the mbap and the rest of the request
+                request = await reader.readexactly(7)
+                (length, ) = struct.unpack(">H", request[4:6])
+                if length < 1:
+                    raise ModbusInvalidResponseError("Invalid length {0} in the mbap".format(length))
+                request += await reader.readexactly(length - 1)
+
+                retval = call_hooks("modbus_async.AsyncTcpServer.after_recv", (self, writer, request))
+                if retval is not None:
+                    request = retval
+
+                response = self._handle(request, capture_id)
+
+                if response:
+                    retval = call_hooks("modbus_async.AsyncTcpServer.before_send", (self, writer, response))
+                    if retval is not None:
+                        response = retval
+                    writer.write(response)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # the client is disconnected
+            pass
+        except Exception as excpt:
+            LOGGER.warning("Error while processing data from %s: %s", str(address), excpt)
+            call_hooks("modbus_async.AsyncTcpServer.on_error", (self, writer, excpt))
+        finally:
+            LOGGER.info("%s is disconnected", str(address))
+            call_hooks("modbus_async.AsyncTcpServer.on_disconnect", (self, writer))
+            writer.close()
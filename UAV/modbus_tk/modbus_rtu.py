@@ -14,6 +14,7 @@ import struct
 import time
 
 from modbus_tk import LOGGER
+from modbus_tk import defines
 from modbus_tk.modbus import (
     Databank, Query, Master, Server,
     InvalidArgumentError, ModbusInvalidResponseError, ModbusInvalidRequestError
@@ -22,6 +23,86 @@ from modbus_tk.hooks import call_hooks
 from modbus_tk import utils
 
 
+# function codes whose response gives its data length in the byte after the function code
+BYTE_COUNT_RESPONSES = (
+    defines.READ_COILS, defines.READ_DISCRETE_INPUTS, defines.READ_HOLDING_REGISTERS, defines.READ_INPUT_REGISTERS,
+    defines.READ_WRITE_MULTIPLE_REGISTERS, defines.REPORT_SLAVE_ID,
+)
+
+# length of the responses which have always the same size
+FIXED_RESPONSE_LENGTHS = {
+    defines.WRITE_SINGLE_COIL: 8,
+    defines.WRITE_SINGLE_REGISTER: 8,
+    defines.WRITE_MULTIPLE_COILS: 8,
+    defines.WRITE_MULTIPLE_REGISTERS: 8,
+    defines.READ_EXCEPTION_STATUS: 5,
+}
+
+# the delays on the line are measured with a clock which doesn't jump when the system time is set
+# python 2 has no monotonic clock
+_clock = getattr(time, "monotonic", time.time)
+
+
+def get_response_length(frame, expected_length=-1):
+    """
+    Returns the full length of a RTU response from its first bytes:
+    0 if more bytes are needed (the function code and maybe the byte count)
+    expected_length if the function code doesn't tell the length of the response
+    """
+    header = bytearray(frame[:3])
+    if len(header) < 2:
+        return 0
+    function_code = header[1]
+    if function_code & 0x80:
+        # exception: slave + func + exception code + crc1 + crc2
+        return 5
+    if function_code in BYTE_COUNT_RESPONSES:
+        if len(header) < 3:
+            return 0
+        # slave + func + byte count + data + crc1 + crc2
+        return header[2] + 5
+    return FIXED_RESPONSE_LENGTHS.get(function_code, expected_length)
+
+
+# position of the byte count in the requests which give their data length
+BYTE_COUNT_REQUESTS = {
+    defines.WRITE_MULTIPLE_COILS: 6,
+    defines.WRITE_MULTIPLE_REGISTERS: 6,
+    defines.READ_WRITE_MULTIPLE_REGISTERS: 10,
+}
+
+# length of the requests which have always the same size
+FIXED_REQUEST_LENGTHS = {
+    defines.READ_COILS: 8,
+    defines.READ_DISCRETE_INPUTS: 8,
+    defines.READ_HOLDING_REGISTERS: 8,
+    defines.READ_INPUT_REGISTERS: 8,
+    defines.WRITE_SINGLE_COIL: 8,
+    defines.WRITE_SINGLE_REGISTER: 8,
+    defines.READ_EXCEPTION_STATUS: 4,
+    defines.REPORT_SLAVE_ID: 4,
+}
+
+
+def get_request_length(frame):
+    """
+    Returns the full length of a RTU request from its first bytes:
+    0 if more bytes are needed (the function code and maybe the byte count)
+    -1 if the function code doesn't tell the length of the request
+    """
+    header = bytearray(frame[:11])
+    if len(header) < 2:
+        return 0
+    function_code = header[1]
+    if function_code in BYTE_COUNT_REQUESTS:
+        position = BYTE_COUNT_REQUESTS[function_code]
+        if len(header) <= position:
+            return 0
+        # header + byte count + data + crc1 + crc2
+        return position + header[position] + 3
+    return FIXED_REQUEST_LENGTHS.get(function_code, -1)
+
+
 class RtuQuery(Query):
     """Subclass of a Query. Adds the Modbus RTU specific part of the protocol"""
 
@@ -81,6 +162,10 @@ class RtuQuery(Query):
         crc = struct.pack(">H", utils.calculate_crc(data))
         return data + crc
 
+    def get_cache_key(self, request):
+        """A request identifies its response: the crc included"""
+        return bytes(request)
+
 
 class RtuMaster(Master):
     """Subclass of Master. Implements the Modbus RTU MAC layer"""
@@ -140,21 +225,41 @@ class RtuMaster(Master):
             self._serial.read(len(request))
 
     def _recv(self, expected_length=-1):
-        """Receive the response from the slave"""
+        """
+        Receive the response from the slave
+        The length of the response is worked out from its function code as soon as it is received:
+        an exception is detected after 2 bytes and the read stops when the frame is complete.
+        expected_length is used for the functions which don't tell the length of their response.
+        If it is unknown too, the read stops when the received bytes end with their crc
+        """
         response = utils.to_data("")
-        start_time = time.time() if self.use_sw_timeout else 0
+        length = 0
+        start_time = _clock() if self.use_sw_timeout else 0
         while True:
-            read_bytes = self._serial.read(expected_length if expected_length > 0 else 1)
+            if length > 0:
+                size = length - len(response)
+            elif length == 0:
+                # read up to the function code, then up to the byte count
+                size = (3 if len(response) >= 2 else 2) - len(response)
+            else:
+                # unknown length: read until the timeout
+                size = 1
+            if size <= 0:
+                break
+            read_bytes = self._serial.read(size)
             if self.use_sw_timeout:
-                read_duration = time.time() - start_time
+                read_duration = _clock() - start_time
             else:
                 read_duration = 0
             if (not read_bytes) or (read_duration > self._serial.timeout):
                 break
             response += read_bytes
-            if expected_length >= 0 and len(response) >= expected_length:
-                # if the expected number of byte is received consider that the response is done
-                # improve performance by avoiding end-of-response detection by timeout
+            if length == 0:
+                length = get_response_length(response, expected_length)
+                if length < 0:
+                    crc = utils.Crc16(response)
+            elif length < 0 and crc.update(read_bytes).is_valid():
+                # the frame of unknown length is complete when it ends with its crc
                 break
 
         retval = call_hooks("modbus_rtu.RtuMaster.after_recv", (self, response))
@@ -265,17 +370,47 @@ class RtuServer(Server):
                     self._serial.open()
                 self._serial.timeout = self._timeout
 
-            # Read rest of the request
-            while True:
+            # Read rest of the request: the read stops as soon as its length is reached
+            length = get_request_length(request)
+            while length >= 0:
+                if length > 0:
+                    size = length - len(request)
+                elif len(request) < 2:
+                    size = 2 - len(request)
+                else:
+                    # read up to the byte count
+                    size = BYTE_COUNT_REQUESTS[bytearray(request[1:2])[0]] + 1 - len(request)
+                if size <= 0:
+                    break
                 try:
-                    read_bytes = self._serial.read(128)
-                    if not read_bytes:
-                        break
+                    read_bytes = self._serial.read(size)
                 except Exception as e:
                     self._serial.close()
                     self._serial.open()
                     break
+                if not read_bytes:
+                    break
                 request += read_bytes
+                if length == 0:
+                    length = get_request_length(request)
+
+            crc = utils.Crc16(request)
+            if request and (length <= 0 or not crc.is_valid()):
+                # unknown function or corrupted frame: read until the silence
+                while True:
+                    try:
+                        read_bytes = self._serial.read(128)
+                        if not read_bytes:
+                            break
+                    except Exception as e:
+                        self._serial.close()
+                        self._serial.open()
+                        break
+                    request += read_bytes
+                    # the request is complete when it ends with its crc: don't wait for the silence
+                    if crc.update(read_bytes).is_valid() and len(request) >= 4:
+                        break
+            end_of_request = _clock()
 
             # parse the request
             if request:
@@ -291,6 +426,10 @@ class RtuServer(Server):
                     response = retval
 
                 if response:
+                    # the line must be silent for t3.5 between the request and the response
+                    silence = end_of_request + self.get_timeout() - _clock()
+                    if silence > 0:
+                        time.sleep(silence)
                     if self._serial.in_waiting > 0:
                         # Most likely master timed out on this request and started a new one
                         # for which we already received atleast 1 byte
@@ -298,7 +437,6 @@ class RtuServer(Server):
                     else:
                         self._serial.write(response)
                         self._serial.flush()
-                        time.sleep(self.get_timeout())
 
                 call_hooks("modbus_rtu.RtuServer.after_write", (self, response))
 
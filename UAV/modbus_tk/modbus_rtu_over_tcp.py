@@ -10,24 +10,33 @@
 """
 
 from modbus_tk.hooks import call_hooks
-from modbus_tk.modbus_rtu import RtuQuery
+from modbus_tk.modbus_rtu import RtuQuery, get_response_length
 from modbus_tk.modbus_tcp import TcpMaster
-from modbus_tk.utils import to_data
+from modbus_tk.utils import recv_into_exactly
 
 
 class RtuOverTcpMaster(TcpMaster):
     """Subclass of TcpMaster. Implements the Modbus RTU over TCP MAC layer"""
 
     def _recv(self, expected_length=-1):
-        """Receive the response from the slave"""
-        response = to_data('')
-        length = 255
-        while len(response) < length:
-            rcv_byte = self._sock.recv(1)
-            if rcv_byte:
-                response += rcv_byte
-            if expected_length >= 0 and len(response) >= expected_length:
-                break
+        """
+        Receive the response from the slave
+        Its length is given by the function code. expected_length is used for the other functions
+        """
+        # read the slave and the function code, then the byte count if needed
+        received = recv_into_exactly(self._sock, self._recv_view, 2)
+        length = get_response_length(self._recv_buffer[:received], expected_length)
+        if received == 2 and length == 0:
+            received += recv_into_exactly(self._sock, self._recv_view[2:], 1)
+            length = get_response_length(self._recv_buffer[:received], expected_length)
+
+        if length > received:
+            # read the rest of the response
+            received += recv_into_exactly(self._sock, self._recv_view[received:], length - received)
+        elif length < 0 and received == 2:
+            # unknown length: take what is already there
+            received += self._sock.recv_into(self._recv_view[received:])
+        response = self._recv_buffer[:received]
         retval = call_hooks("modbus_rtu_over_tcp.RtuOverTcpMaster.after_recv", (self, response))
         if retval is not None:
             return retval
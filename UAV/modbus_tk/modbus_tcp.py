@@ -9,17 +9,31 @@
  This is distributed under GNU LGPL license, see license.txt
 """
 
+import contextlib
+import errno
+import itertools
 import socket
 import select
+try:
+    import selectors
+except ImportError:
+    # python 2: pip install selectors34
+    import selectors34 as selectors
 import struct
+import threading
+import time
 
 from modbus_tk import LOGGER
+from modbus_tk.capture import new_connection_id
 from modbus_tk.hooks import call_hooks
 from modbus_tk.modbus import (
     Databank, Master, Query, Server,
     InvalidArgumentError, ModbusInvalidResponseError, ModbusInvalidRequestError
 )
-from modbus_tk.utils import threadsafe_function, flush_socket, to_data
+from modbus_tk.utils import flush_socket, recv_into_exactly
+
+# the errors of a non-blocking socket which is not ready
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
 
 
 #-------------------------------------------------------------------------------
@@ -95,23 +109,23 @@ class TcpMbap(object):
 class TcpQuery(Query):
     """Subclass of a Query. Adds the Modbus TCP specific part of the protocol"""
 
-    #static variable for giving a unique id to each query
-    _last_transaction_id = 0
+    #static counter giving a unique id to the queries which are not bound to a master
+    _transaction_ids = itertools.count(1)
 
-    def __init__(self):
-        """Constructor"""
+    def __init__(self, transaction_ids=None):
+        """
+        Constructor: transaction_ids is the counter giving the identifiers of the queries
+        Every master has its own counter. Getting the next id needs no lock
+        """
         super(TcpQuery, self).__init__()
+        if transaction_ids is not None:
+            self._transaction_ids = transaction_ids
         self._request_mbap = TcpMbap()
         self._response_mbap = TcpMbap()
 
-    @threadsafe_function
     def _get_transaction_id(self):
         """returns an identifier for the query"""
-        if TcpQuery._last_transaction_id < 0xffff:
-            TcpQuery._last_transaction_id += 1
-        else:
-            TcpQuery._last_transaction_id = 0
-        return TcpQuery._last_transaction_id
+        return next(self._transaction_ids) & 0xffff
 
     def build_request(self, pdu, slave):
         """Add the Modbus TCP part to the request"""
@@ -123,6 +137,12 @@ class TcpQuery(Query):
         mbap = self._request_mbap.pack()
         return mbap + pdu
 
+    def renew_request(self, request):
+        """Give a new transaction id to a request built previously"""
+        self._request_mbap.unpack(request[:7])
+        self._request_mbap.transaction_id = self._get_transaction_id()
+        return self._request_mbap.pack() + request[7:]
+
     def parse_response(self, response):
         """Extract the pdu from the Modbus TCP response"""
         if len(response) > 6:
@@ -151,6 +171,14 @@ class TcpQuery(Query):
         self._response_mbap.length = len(response_pdu) + 1
         return self._response_mbap.pack() + response_pdu
 
+    def get_cache_key(self, request):
+        """The mbap and the pdu of a request identify its response except the transaction id"""
+        return bytes(request[2:])
+
+    def reuse_response(self, request, response):
+        """Give the transaction id of the request to the response cached for another request"""
+        return request[:2] + response[2:]
+
 
 class TcpMaster(Master):
     """Subclass of Master. Implements the Modbus TCP MAC layer"""
@@ -161,6 +189,11 @@ class TcpMaster(Master):
         self._host = host
         self._port = port
         self._sock = None
+        # reused for receiving every response: large enough for the biggest modbus frame
+        self._recv_buffer = bytearray(260)
+        self._recv_view = memoryview(self._recv_buffer)
+        # the transaction ids of the queries of this master
+        self._transaction_ids = itertools.count(1)
 
     def _do_open(self):
         """Connect to the Modbus slave"""
@@ -210,17 +243,16 @@ class TcpMaster(Master):
         Do not take expected_length into account because the length of the response is
         written in the mbap. Used for RTU only
         """
-        response = to_data('')
-        length = 255
-        while len(response) < length:
-            rcv_byte = self._sock.recv(1)
-            if rcv_byte:
-                response += rcv_byte
-                if len(response) == 6:
-                    to_be_recv_length = struct.unpack(">HHH", response)[2]
-                    length = to_be_recv_length + 6
-            else:
-                break
+        # read the mbap
+        received = recv_into_exactly(self._sock, self._recv_view, 7)
+        if received == 7:
+            # read the rest of the response
+            length = struct.unpack(">H", self._recv_buffer[4:6])[0] + 6
+            if length > len(self._recv_buffer):
+                self._recv_buffer = self._recv_buffer + bytearray(length - len(self._recv_buffer))
+                self._recv_view = memoryview(self._recv_buffer)
+            received += recv_into_exactly(self._sock, self._recv_view[7:], length - 7)
+        response = self._recv_buffer[:received]
         retval = call_hooks("modbus_tcp.TcpMaster.after_recv", (self, response))
         if retval is not None:
             return retval
@@ -228,24 +260,182 @@ class TcpMaster(Master):
 
     def _make_query(self):
         """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
-        return TcpQuery()
+        return TcpQuery(self._transaction_ids)
+
+
+class TcpMasterPool(object):
+    """
+    Connections to modbus tcp slaves shared by several threads. A thread borrows a
+    master connected to (host, port), executes its queries and gives it back:
+    the connection is kept open for the next thread instead of being opened on every poll
+    """
+
+    def __init__(self, max_connections_per_host=4, timeout_in_sec=5.0, idle_timeout=60.0, master_class=TcpMaster):
+        """
+        Constructor: at most max_connections_per_host masters are created for each (host, port)
+        The connections which have not been used for idle_timeout seconds are closed
+        """
+        self._max_connections = max_connections_per_host
+        self._timeout = timeout_in_sec
+        self._idle_timeout = idle_timeout
+        self._master_class = master_class
+        self._condition = threading.Condition()
+        # the (master, time of the last use) which are not borrowed by (host, port)
+        self._idle = {}
+        # the number of masters by (host, port)
+        self._counts = {}
+        # the (host, port) of the borrowed masters
+        self._borrowed = {}
+
+    def acquire(self, host="127.0.0.1", port=502, timeout=None):
+        """
+        Returns a master connected to (host, port) which must be given back with release
+        Wait at most timeout seconds for a free master if max_connections_per_host are borrowed
+        """
+        key = (host, port)
+        end_time = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                self._evict_idle()
+                idle = self._idle.setdefault(key, [])
+                if idle:
+                    # the last used connection is the most likely to be alive
+                    master = idle.pop()[0]
+                    if not self._is_healthy(master):
+                        # reconnect on the next query
+                        master.close()
+                    self._borrowed[master] = key
+                    return master
+                if self._counts.get(key, 0) < self._max_connections:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                    break
+                remaining = None if end_time is None else end_time - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise socket.timeout("No free connection to {0}:{1}".format(host, port))
+                self._condition.wait(remaining)
+        try:
+            # the master connects itself on the first query
+            master = self._master_class(host, port, self._timeout)
+        except Exception:
+            with self._condition:
+                self._counts[key] -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._borrowed[master] = key
+        return master
+
+    def release(self, master, reconnect=False):
+        """
+        give back a master: it is closed for reconnecting on next query if reconnect is true
+        Raise InvalidArgumentError if the master is not borrowed from the pool
+        """
+        with self._condition:
+            key = self._borrowed.pop(master, None)
+            if key is None:
+                raise InvalidArgumentError("The master is not borrowed from the pool")
+            if reconnect:
+                master.close()
+            self._idle.setdefault(key, []).append((master, time.time()))
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def borrow(self, host="127.0.0.1", port=502, timeout=None):
+        """
+        Context manager giving a master connected to (host, port) and giving it back on exit
+        The connection is closed if the link to the slave is broken
+        """
+        master = self.acquire(host, port, timeout)
+        reconnect = False
+        try:
+            yield master
+        except (socket.error, ModbusInvalidResponseError, ModbusInvalidMbapError):
+            # the connection can't be trusted anymore
+            reconnect = True
+            raise
+        finally:
+            self.release(master, reconnect)
+
+    def evict_idle(self):
+        """close the connections which have not been used for idle_timeout seconds"""
+        with self._condition:
+            self._evict_idle()
+
+    def close(self):
+        """close the connections which are not borrowed"""
+        with self._condition:
+            for (key, idle) in self._idle.items():
+                for (master, last_use) in idle:
+                    master.close()
+                self._counts[key] -= len(idle)
+            self._idle = {}
+            self._condition.notify_all()
+
+    def _evict_idle(self):
+        """close the masters not used for idle_timeout seconds. The pool must be locked"""
+        limit = time.time() - self._idle_timeout
+        for (key, idle) in self._idle.items():
+            # the masters are ordered by time of last use
+            nb_evicted = 0
+            while nb_evicted < len(idle) and idle[nb_evicted][1] < limit:
+                idle[nb_evicted][0].close()
+                nb_evicted += 1
+            if nb_evicted:
+                del idle[:nb_evicted]
+                self._counts[key] -= nb_evicted
+                self._condition.notify_all()
+
+    def _is_healthy(self, master):
+        """check that the connection of an idle master has not been closed by the slave"""
+        sock = master._sock
+        if not master._is_opened or sock is None:
+            return True
+        try:
+            # nothing should be received on an idle connection except its closing
+            return not select.select([sock], [], [], 0)[0]
+        except (socket.error, ValueError):
+            return False
+
+
+class _TcpConnection(object):
+    """the state of a client connected to the TcpServer"""
+
+    def __init__(self, sock, address):
+        """Constructor: the buffers are empty"""
+        self.sock = sock
+        self.address = address
+        # the bytes received but not handled yet: it may contain several requests
+        self.in_buffer = bytearray()
+        # the bytes of the responses that the socket has not accepted yet
+        self.out_buffer = bytearray()
+        # the id of the connection in the capture of the server
+        self.capture_id = new_connection_id()
 
 
 class TcpServer(Server):
     """
-    This class implements a simple and mono-threaded modbus tcp server
+    This class implements a mono-threaded and event-driven modbus tcp server
+    Every socket is non-blocking: a slow client doesn't delay the other clients
     !! Change in 0.5.0: By default the TcpServer is not bound to a specific address
     for example: You must set address to 'loaclhost', if youjust want to accept local connections
     """
 
-    def __init__(self, port=502, address='', timeout_in_sec=1, databank=None, error_on_missing_slave=True):
-        """Constructor: initializes the server settings"""
+    def __init__(
+        self, port=502, address='', timeout_in_sec=1, databank=None, error_on_missing_slave=True, reuse_port=False):
+        """
+        Constructor: initializes the server settings
+        If reuse_port is true, several servers can listen on the same port: the system shares
+        the connections between them (SO_REUSEPORT, linux and bsd only)
+        """
         databank = databank if databank else Databank(error_on_missing_slave=error_on_missing_slave)
         super(TcpServer, self).__init__(databank)
         self._sock = None
         self._sa = (address, port)
+        self._reuse_port = reuse_port
+        # how long the loop waits for an event: the server checks if it must stop at this rate
         self._timeout_in_sec = timeout_in_sec
         self._sockets = []
+        self._selector = None
 
     def _make_query(self):
         """Returns an instance of a Query subclass implementing the modbus TCP protocol"""
@@ -262,99 +452,135 @@ class TcpServer(Server):
         """initialize server"""
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        if self._timeout_in_sec:
-            self._sock.settimeout(self._timeout_in_sec)
+        if self._reuse_port:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._sock.setblocking(0)
         self._sock.bind(self._sa)
-        self._sock.listen(10)
+        self._sock.listen(128)
         self._sockets.append(self._sock)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
 
     def _do_exit(self):
         """clean the server tasks"""
         #close the sockets
-        for sock in self._sockets:
+        for sock in list(self._sockets):
             try:
+                self._selector.unregister(sock)
                 sock.close()
                 self._sockets.remove(sock)
             except Exception as msg:
                 LOGGER.warning("Error while closing socket, Exception occurred: %s", msg)
-        self._sock.close()
+        self._selector.close()
+        self._selector = None
         self._sock = None
 
     def _do_run(self):
         """called in a almost-for-ever loop by the server"""
-        # check the status of every socket
-        inputready = select.select(self._sockets, [], [], 1.0)[0]
-
-        # handle data on each a socket
-        for sock in inputready:
+        # wait for the sockets which are ready
+        for (key, events) in self._selector.select(self._timeout_in_sec or 1.0):
+            connection = key.data
+            if connection is None:
+                self._accept()
+                continue
             try:
-                if sock == self._sock:
-                    # handle the server socket
-                    client, address = self._sock.accept()
-                    client.setblocking(0)
-                    LOGGER.info("%s is connected with socket %d...", str(address), client.fileno())
-                    self._sockets.append(client)
-                    call_hooks("modbus_tcp.TcpServer.on_connect", (self, client, address))
-                else:
-                    if len(sock.recv(1, socket.MSG_PEEK)) == 0:
-                        # socket is disconnected
-                        LOGGER.info("%d is disconnected" % (sock.fileno()))
-                        call_hooks("modbus_tcp.TcpServer.on_disconnect", (self, sock))
-                        sock.close()
-                        self._sockets.remove(sock)
-                        break
-
-                    # handle all other sockets
-                    sock.settimeout(1.0)
-                    request = to_data("")
-                    is_ok = True
-
-                    # read the 7 bytes of the mbap
-                    while (len(request) < 7) and is_ok:
-                        new_byte = sock.recv(1)
-                        if len(new_byte) == 0:
-                            is_ok = False
-                        else:
-                            request += new_byte
-
-                    retval = call_hooks("modbus_tcp.TcpServer.after_recv", (self, sock, request))
-                    if retval is not None:
-                        request = retval
-
-                    if is_ok:
-                        # read the rest of the request
-                        length = self._get_request_length(request)
-                        while (len(request) < (length + 6)) and is_ok:
-                            new_byte = sock.recv(1)
-                            if len(new_byte) == 0:
-                                is_ok = False
-                            else:
-                                request += new_byte
-
-                    if is_ok:
-                        response = ""
-                        # parse the request
-                        try:
-                            response = self._handle(request)
-                        except Exception as msg:
-                            LOGGER.error("Error while handling a request, Exception occurred: %s", msg)
-
-                        # send back the response
-                        if response:
-                            try:
-                                retval = call_hooks("modbus_tcp.TcpServer.before_send", (self, sock, response))
-                                if retval is not None:
-                                    response = retval
-                                sock.send(response)
-                                call_hooks("modbus_tcp.TcpServer.after_send", (self, sock, response))
-                            except Exception as msg:
-                                is_ok = False
-                                LOGGER.error(
-                                    "Error while sending on socket %d, Exception occurred: %s", sock.fileno(), msg
-                                )
+                if events & selectors.EVENT_WRITE:
+                    self._flush(connection)
+                if events & selectors.EVENT_READ:
+                    self._read(connection)
             except Exception as excpt:
-                LOGGER.warning("Error while processing data on socket %d: %s", sock.fileno(), excpt)
-                call_hooks("modbus_tcp.TcpServer.on_error", (self, sock, excpt))
-                sock.close()
-                self._sockets.remove(sock)
+                LOGGER.warning("Error while processing data on socket %d: %s", connection.sock.fileno(), excpt)
+                call_hooks("modbus_tcp.TcpServer.on_error", (self, connection.sock, excpt))
+                self._disconnect(connection, False)
+
+    def _accept(self):
+        """accept the pending connections"""
+        while True:
+            try:
+                client, address = self._sock.accept()
+            except socket.error:
+                # no more pending connection
+                return
+            client.setblocking(0)
+            LOGGER.info("%s is connected with socket %d...", str(address), client.fileno())
+            self._sockets.append(client)
+            self._selector.register(client, selectors.EVENT_READ, _TcpConnection(client, address))
+            call_hooks("modbus_tcp.TcpServer.on_connect", (self, client, address))
+
+    def _disconnect(self, connection, notify=True):
+        """forget a client and close its socket"""
+        sock = connection.sock
+        if notify:
+            LOGGER.info("%d is disconnected" % (sock.fileno()))
+            call_hooks("modbus_tcp.TcpServer.on_disconnect", (self, sock))
+        self._selector.unregister(sock)
+        self._sockets.remove(sock)
+        sock.close()
+
+    def _read(self, connection):
+        """read what the client has sent and handle every complete request"""
+        try:
+            data = connection.sock.recv(4096)
+        except socket.error as excpt:
+            if excpt.errno in _WOULD_BLOCK:
+                # spurious wake up: nothing to read yet
+                return
+            data = b""
+        if not data:
+            # socket is disconnected
+            self._disconnect(connection)
+            return
+
+        in_buffer = connection.in_buffer
+        in_buffer += data
+        # a pipelining client may have sent several requests at once
+        while len(in_buffer) >= 7:
+            length = self._get_request_length(in_buffer)
+            if length < 2:
+                raise ModbusInvalidRequestError("Invalid length {0} in the mbap".format(length))
+            if len(in_buffer) < length + 6:
+                # wait for the rest of the request
+                break
+            request = bytes(in_buffer[:length + 6])
+            del in_buffer[:length + 6]
+            self._handle_request(connection, request)
+
+        self._flush(connection)
+
+    def _handle_request(self, connection, request):
+        """handle a complete request and queue its response"""
+        sock = connection.sock
+        retval = call_hooks("modbus_tcp.TcpServer.after_recv", (self, sock, request))
+        if retval is not None:
+            request = retval
+
+        response = ""
+        # parse the request
+        try:
+            response = self._handle(request, connection.capture_id)
+        except Exception as msg:
+            LOGGER.error("Error while handling a request, Exception occurred: %s", msg)
+
+        # send back the response
+        if response:
+            retval = call_hooks("modbus_tcp.TcpServer.before_send", (self, sock, response))
+            if retval is not None:
+                response = retval
+            connection.out_buffer += response
+            call_hooks("modbus_tcp.TcpServer.after_send", (self, sock, response))
+
+    def _flush(self, connection):
+        """send as much of the responses as the socket accepts without blocking"""
+        out_buffer = connection.out_buffer
+        if out_buffer:
+            try:
+                nb_sent = connection.sock.send(out_buffer)
+            except socket.error as excpt:
+                if excpt.errno not in _WOULD_BLOCK:
+                    raise
+                nb_sent = 0
+            del out_buffer[:nb_sent]
+        # while the client doesn't read its responses, its requests are not read either
+        events = selectors.EVENT_WRITE if out_buffer else selectors.EVENT_READ
+        if self._selector.get_key(connection.sock).events != events:
+            self._selector.modify(connection.sock, events, connection)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Modbus TCP server forking worker processes which listen on the same port thanks to SO_REUSEPORT:
+ the requests are not handled under a single GIL. Python 3, linux and bsd only
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+
+from modbus_tk import LOGGER
+from modbus_tk.exceptions import InvalidArgumentError
+from modbus_tk.modbus import Databank, SharedModbusBlock
+from modbus_tk.modbus_tcp import TcpServer
+
+
+class MultiProcessTcpServer(object):
+    """
+    Run a TcpServer in each of nb_workers forked processes. Every worker has the copy of the databank
+    made by the fork: only the blocks stored in a shared_bank.SharedRegisterBank are shared between
+    the workers, the other blocks of a worker are its own and a warning is logged for them.
+    The slaves and blocks must be added before start, and start must be called before any other
+    thread is started: a lock held by another thread at the time of the fork would never be released
+    in the workers
+    """
+
+    def __init__(
+        self, nb_workers=None, port=502, address='', timeout_in_sec=1, databank=None, error_on_missing_slave=True):
+        """Constructor: initializes the server settings. By default, there is a worker for each cpu"""
+        self._databank = databank if databank else Databank(error_on_missing_slave=error_on_missing_slave)
+        self._nb_workers = nb_workers or multiprocessing.cpu_count()
+        self._server_args = (port, address, timeout_in_sec)
+        self._workers = []
+
+    def get_db(self):
+        """returns the databank"""
+        return self._databank
+
+    def add_slave(self, slave_id, unsigned=True, memory=None):
+        """add slave to the server"""
+        return self._databank.add_slave(slave_id, unsigned, memory)
+
+    def get_slave(self, slave_id):
+        """get the slave with the given id"""
+        return self._databank.get_slave(slave_id)
+
+    def start(self):
+        """fork the workers. They handle requests until stop is called"""
+        if threading.active_count() > 1:
+            raise InvalidArgumentError("MultiProcessTcpServer must be started before any other thread")
+        for (slave_id, slave) in sorted(self._databank.get_slaves().items()):
+            for (name, block) in sorted(slave.get_blocks().items()):
+                if not isinstance(block, SharedModbusBlock):
+                    LOGGER.warning(
+                        "block %s of slave %d is not in a shared bank: each worker has its own values", name, slave_id
+                    )
+        # the databank and the mapped files are inherited by the workers
+        context = multiprocessing.get_context("fork")
+        for _ in range(self._nb_workers):
+            worker = context.Process(target=self._run_worker)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        LOGGER.info("%s has started %d workers", self.__class__, self._nb_workers)
+
+    def stop(self):
+        """stop the workers and wait for them"""
+        for worker in self._workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        LOGGER.info("%s has stopped", self.__class__)
+
+    def _run_worker(self):
+        """main function of a worker: serve the requests until SIGTERM"""
+        stopped = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+        (port, address, timeout_in_sec) = self._server_args
+        server = TcpServer(port, address, timeout_in_sec, databank=self._databank, reuse_port=True)
+        server.run_until(lambda: stopped)
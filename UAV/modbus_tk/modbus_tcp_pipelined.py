@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Modbus TCP master keeping several transactions in flight on the same connection
+"""
+
+from concurrent import futures
+import socket
+import struct
+import threading
+
+from modbus_tk import LOGGER
+from modbus_tk import defines
+from modbus_tk.capture import RECEIVED, SENT
+from modbus_tk.hooks import call_hooks
+from modbus_tk.modbus import ModbusInvalidResponseError
+from modbus_tk.modbus_tcp import TcpMaster
+from modbus_tk.utils import get_log_buffer
+
+
+class PipelinedTcpMaster(TcpMaster):
+    """
+    Subclass of TcpMaster. Up to max_in_flight requests are sent without waiting for
+    the previous answers. A reader thread matches every answer with its request thanks
+    to the transaction id of the mbap, whatever the order of the answers
+    """
+
+    def __init__(self, host="127.0.0.1", port=502, timeout_in_sec=5.0, max_in_flight=8):
+        """Constructor. Set the communication settings"""
+        super(PipelinedTcpMaster, self).__init__(host, port, timeout_in_sec)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        # the requests waiting for an answer by transaction id
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # protect the connection and the sending of the requests
+        self._send_lock = threading.RLock()
+        self._reader = None
+
+    def _do_open(self):
+        """Connect to the Modbus slave and start reading the answers"""
+        super(PipelinedTcpMaster, self)._do_open()
+        # the reader thread blocks on the socket: the timeout applies to the answers
+        self._sock.settimeout(None)
+        self._reader = threading.Thread(target=PipelinedTcpMaster._read_responses, args=(self, ))
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _do_close(self):
+        """Close the connection and wait for the reader thread"""
+        reader, self._reader = self._reader, None
+        if self._sock:
+            try:
+                # wake up the reader thread
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        ret = super(PipelinedTcpMaster, self)._do_close()
+        if reader and reader is not threading.current_thread():
+            reader.join()
+        return ret
+
+    def set_timeout(self, timeout_in_sec):
+        """Change the timeout value: once connected, it is applied while waiting for the answers"""
+        super(PipelinedTcpMaster, self).set_timeout(timeout_in_sec)
+        if self._is_opened and self._sock:
+            self._sock.settimeout(None)
+
+    def _send(self, request):
+        """Send request to the slave: the socket is not flushed, it contains the answers of other requests"""
+        retval = call_hooks("modbus_tcp.TcpMaster.before_send", (self, request))
+        if retval is not None:
+            request = retval
+        self._sock.sendall(request)
+
+    def execute(self, *args, **kwargs):
+        """
+        Execute a modbus query and returns the data part of the answer as a tuple.
+        Arguments are the same as Master.execute. Several threads can wait for
+        their answer at the same time
+        """
+        kwargs.pop("threadsafe", None)
+        return self._wait(self.submit(*args, **kwargs))
+
+    def execute_prepared(self, prepared, threadsafe=True):
+        """Execute a query compiled by prepare and returns the data part of the answer as a tuple"""
+        return self._wait(self.submit_prepared(prepared))
+
+    def submit(
+        self, slave, function_code, starting_address, quantity_of_x=0, output_value=0, data_format="", expected_length=-1,
+        word_order=defines.WORD_ORDER_ABCD):
+        """
+        Send a modbus query without waiting for the answer. Arguments are the same as Master.execute
+        Returns a concurrent.futures.Future of the data part of the answer
+        """
+        prepared = self.prepare(
+            slave, function_code, starting_address, quantity_of_x, output_value, data_format, expected_length,
+            word_order
+        )
+        return self._submit(prepared, prepared.query, prepared.request)
+
+    def submit_prepared(self, prepared):
+        """
+        Send a query compiled by prepare without waiting for the answer
+        Returns a concurrent.futures.Future of the data part of the answer
+        """
+        query = self._make_query()
+        return self._submit(prepared, query, query.renew_request(prepared.request))
+
+    def _submit(self, prepared, query, request):
+        """send the request and register it as waiting for an answer"""
+        future = futures.Future()
+        future.transaction_id = None
+
+        retval = call_hooks("modbus.Master.before_send", (self, request))
+        if retval is not None:
+            request = retval
+
+        # wait for a free slot
+        self._in_flight.acquire()
+        try:
+            with self._send_lock:
+                self.open()
+                if prepared.slave != 0:
+                    (future.transaction_id, ) = struct.unpack(">H", request[0:2])
+                    with self._pending_lock:
+                        self._pending[future.transaction_id] = (query, prepared, future)
+                if self._verbose:
+                    LOGGER.debug(get_log_buffer("-> ", request))
+                if self._capture is not None:
+                    self._capture.record(SENT, self._capture_id, request)
+                self._send(request)
+        except Exception:
+            self._forget(future)
+            raise
+
+        call_hooks("modbus.Master.after_send", (self, ))
+
+        if prepared.slave == 0:
+            # broadcast: no answer is expected
+            self._in_flight.release()
+            future.set_result(None)
+        return future
+
+    def _forget(self, future):
+        """stop waiting for the answer of the request and free its slot"""
+        with self._pending_lock:
+            entry = self._pending.pop(future.transaction_id, None)
+        if (entry is not None) or (future.transaction_id is None):
+            self._in_flight.release()
+        return entry
+
+    def _wait(self, future):
+        """wait for the answer of a request and returns its data"""
+        try:
+            return future.result(self.get_timeout() or None)
+        except futures.TimeoutError:
+            self._forget(future)
+            raise socket.timeout("No answer to transaction {0}".format(future.transaction_id))
+
+    def _read_responses(self):
+        """main function of the reader thread: dispatch every answer to its request"""
+        try:
+            while True:
+                response = self._recv()
+                if len(response) < 7:
+                    # the connection is closed
+                    break
+                retval = call_hooks("modbus.Master.after_recv", (self, response))
+                if retval is not None:
+                    response = retval
+                if self._verbose:
+                    LOGGER.debug(get_log_buffer("<- ", response))
+                if self._capture is not None:
+                    self._capture.record(RECEIVED, self._capture_id, response)
+
+                (transaction_id, ) = struct.unpack(">H", response[0:2])
+                with self._pending_lock:
+                    entry = self._pending.pop(transaction_id, None)
+                if entry is None:
+                    LOGGER.warning("Unexpected answer for transaction %d", transaction_id)
+                    continue
+                self._in_flight.release()
+
+                (query, prepared, future) = entry
+                try:
+                    future.set_result(prepared.decode(query.parse_response(response)))
+                except Exception as excpt:
+                    future.set_exception(excpt)
+        except Exception as excpt:
+            LOGGER.debug("PipelinedTcpMaster stops reading: %s", excpt)
+        finally:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for (query, prepared, future) in pending.values():
+                self._in_flight.release()
+                future.set_exception(ModbusInvalidResponseError("The connection has been closed"))
+            with self._send_lock:
+                if self._reader is threading.current_thread():
+                    # reconnect on next request
+                    self.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Registers shared by several processes through a file mapped in memory: a producer process
+ writes the values and the server reads them without message nor copy. Python 3 only
+
+ Layout of the file:
+   offset   size   content
+   0        8      b"MBTKSRB1": the layout and its version
+   8        4      n: the number of registers as a big-endian unsigned integer
+   12       4      reserved: 0
+   16       2*n    the registers as big-endian 16-bit words: the register i is at 16 + 2*i
+
+ The server side gives the registers to Slave.add_block:
+   bank = SharedRegisterBank("/dev/shm/wellhead", 100)
+   slave.add_block("b", defines.HOLDING_REGISTERS, 0, 2, buffer=bank.registers(0, 2))
+ The producer side opens the same file:
+   bank = SharedRegisterBank("/dev/shm/wellhead")
+   bank.write(0, (x, y))
+ There is no lock between the processes: a reader may see some registers of a write before the others
+"""
+
+import mmap
+import struct
+
+from modbus_tk.exceptions import InvalidArgumentError
+
+_MAGIC = b"MBTKSRB1"
+_HEADER = struct.Struct(">8sII")
+
+
+class SharedRegisterBank(object):
+    """A file of registers mapped in memory with the layout described above"""
+
+    def __init__(self, path, size=0):
+        """
+        Constructor: map the file in memory. If size is not 0, the file is created
+        (or reset) with size registers set to 0. Otherwise its size is read in its header
+        """
+        if size:
+            with open(path, "wb") as the_file:
+                the_file.write(_HEADER.pack(_MAGIC, size, 0))
+                the_file.write(bytes(2 * size))
+        self._file = open(path, "r+b")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except Exception:
+            self._file.close()
+            raise
+        (magic, self.size, reserved) = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or len(self._map) < _HEADER.size + 2 * self.size:
+            self._map.close()
+            self._file.close()
+            raise InvalidArgumentError("{0} is not a shared register bank".format(path))
+        self._registers = memoryview(self._map)[_HEADER.size:_HEADER.size + 2 * self.size]
+
+    def _check_range(self, index, count):
+        """raise an exception if the registers are not in the bank"""
+        if index < 0 or count < 0 or index + count > self.size:
+            raise InvalidArgumentError(
+                "registers {0} to {1} are out of a bank of {2}".format(index, index + count - 1, self.size)
+            )
+
+    def registers(self, index, count):
+        """returns the buffer of count registers from index: it can be given to Slave.add_block"""
+        self._check_range(index, count)
+        return self._registers[2 * index:2 * (index + count)]
+
+    def write(self, index, values, unsigned=True):
+        """write the values of the registers from index"""
+        self._check_range(index, len(values))
+        struct.pack_into(">{0}{1}".format(len(values), "H" if unsigned else "h"), self._registers, 2 * index, *values)
+
+    def read(self, index, count, unsigned=True):
+        """returns the values of count registers from index"""
+        self._check_range(index, count)
+        return struct.unpack_from(">{0}{1}".format(count, "H" if unsigned else "h"), self._registers, 2 * index)
+
+    def close(self):
+        """unmap the file: the blocks using its registers must be removed before"""
+        self._registers.release()
+        self._map.close()
+        self._file.close()
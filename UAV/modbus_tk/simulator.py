@@ -10,6 +10,9 @@
 
  The modbus_tk simulator is a console application which is running a server with TCP and RTU communication
  It is possible to interact with the server from the command line or from a RPC (Remote Process Call)
+ The RPC port 2711 handles one command per connection. The port 2712 keeps the connection open and
+ accepts batches of commands: a "batch <n>" line followed by n commands is answered by n lines at once.
+ The batch port is chosen or disabled with --batch-rpc-port
 """
 from __future__ import print_function
 
@@ -26,6 +29,7 @@ from modbus_tk import hooks
 from modbus_tk import modbus
 from modbus_tk import modbus_tcp
 from modbus_tk import modbus_rtu
+from modbus_tk.utils import to_data, to_text
 
 if modbus_tk.utils.PY2:
     import Queue as queue
@@ -90,22 +94,74 @@ class RpcHandler(SocketServer.BaseRequestHandler):
         """This function is called automatically by the SocketServer"""
         # self.request is the TCP socket connected to the client
         # read the incoming command
-        request = self.request.recv(1024).strip()
+        request = to_text(self.request.recv(1024)).strip()
         # write to the queue waiting to be processed by the server
         INPUT_QUEUE.put(request)
         # wait for the server answer in the output queue
         response = OUTPUT_QUEUE.get(timeout=5.0)
         # send back the answer
-        self.request.send(response)
+        self.request.sendall(to_data(response))
+
+
+class BatchRpcHandler(SocketServer.StreamRequestHandler):
+    """
+    Handle the commands of a client until it disconnects. A line is a command, or "batch <n>"
+    followed by n commands executed together and answered at once. The connection is closed
+    after a "batch" line without a valid count
+    """
+
+    def handle(self):
+        """This function is called automatically by the SocketServer"""
+        simulator = self.server.simulator
+        while True:
+            line = to_text(self.rfile.readline())
+            if not line:
+                # the client is disconnected
+                break
+            args = line.strip("\r\n").split(" ")
+            if args[0] == "batch":
+                try:
+                    (_, count) = args
+                    count = int(count)
+                    if count < 0:
+                        raise ValueError("negative count")
+                except ValueError as msg:
+                    # the following lines can't be told from the commands of the batch: the client must reconnect
+                    self.wfile.write(to_data("batch error: %s\r\n" % msg))
+                    break
+                cmds = []
+                while len(cmds) < count:
+                    cmd = to_text(self.rfile.readline())
+                    if not cmd.endswith("\n"):
+                        # the client is disconnected in the middle of the batch
+                        break
+                    cmds.append(cmd)
+                if len(cmds) < count:
+                    # nothing is executed
+                    break
+            else:
+                cmds = [line]
+            # all the answers in one send
+            self.wfile.write(to_data("".join(simulator.execute_batch(cmds))))
+
+
+class BatchRpcServer(SocketServer.ThreadingTCPServer):
+    """The connections of the BatchRpcHandler are kept open: each one has its thread"""
+    allow_reuse_address = True
+    daemon_threads = True
 
 
 class RpcInterface(threading.Thread):
     """Manage RPC call over TCP/IP thanks to the SocketServer module"""
 
-    def __init__(self):
-        """Constructor"""
+    def __init__(self, port=2711, handler_class=RpcHandler, simulator=None):
+        """Constructor: the commands received by a BatchRpcHandler are executed by the simulator"""
         super(RpcInterface, self).__init__()
-        self.rpc_server = SocketServer.TCPServer(("", 2711), RpcHandler)
+        if simulator is None:
+            self.rpc_server = SocketServer.TCPServer(("", port), handler_class)
+        else:
+            self.rpc_server = BatchRpcServer(("", port), handler_class)
+            self.rpc_server.simulator = simulator
 
     def run(self):
         """run the server and wait that it returns"""
@@ -115,6 +171,7 @@ class RpcInterface(threading.Thread):
         """force the socket server to exit"""
         try:
             self.rpc_server.shutdown()
+            self.rpc_server.server_close()
             self.join(1.0)
         except Exception:
             LOGGER.warning("An error occurred while closing RPC interface")
@@ -179,16 +236,21 @@ class ConsoleInterface(threading.Thread):
 class Simulator(object):
     """The main class of the app in charge of running everything"""
 
-    def __init__(self, server=None):
-        """Constructor"""
+    def __init__(self, server=None, batch_rpc_port=2712):
+        """Constructor: the batch RPC interface is disabled if batch_rpc_port is None"""
         if server is None:
             self.server = CompositeServer([modbus_rtu.RtuServer, modbus_tcp.TcpServer], [(serial.Serial(0),), ()])
         else:
             self.server = server
         self.rpc = RpcInterface()
+        self.batch_rpc = None
+        if batch_rpc_port is not None:
+            self.batch_rpc = RpcInterface(batch_rpc_port, BatchRpcHandler, self)
         self.console = ConsoleInterface()
         self.inq, self.outq = INPUT_QUEUE, OUTPUT_QUEUE
         self._hooks_fct = {}
+        # the commands of the interfaces are executed one at a time
+        self._lock = threading.Lock()
 
         self.cmds = {
             "add_slave": self._do_add_slave,
@@ -214,6 +276,8 @@ class Simulator(object):
         self.server.start()
         self.console.start()
         self.rpc.start()
+        if self.batch_rpc:
+            self.batch_rpc.start()
 
         LOGGER.info("modbus_tk.simulator is running...")
 
@@ -326,27 +390,38 @@ class Simulator(object):
         self.server.set_verbose(verbose)
         return "%d" % verbose
 
+    def execute_batch(self, cmds):
+        """execute the commands one after the other and returns the list of their answers"""
+        with self._lock:
+            return [self._execute(cmd) for cmd in cmds]
+
+    def _execute(self, cmd):
+        """execute a command and returns its answer"""
+        args = cmd.strip('\r\n').split(' ')
+        if args[0] in self.cmds:
+            try:
+                answer = self.cmds[args[0]](args)
+                return "%s done: %s\r\n" % (args[0], answer)
+            except Exception as msg:
+                return "%s error: %s\r\n" % (args[0], msg)
+        else:
+            return "error: unknown command %s\r\n" % (args[0])
+
     def _handle(self):
         """almost-for-ever loop in charge of listening for command and executing it"""
         while True:
             cmd = self.inq.get()
-            args = cmd.strip('\r\n').split(' ')
             if cmd.find('quit') == 0:
                 self.outq.put('bye-bye\r\n')
                 break
-            elif args[0] in self.cmds:
-                try:
-                    answer = self.cmds[args[0]](args)
-                    self.outq.put("%s done: %s\r\n" % (args[0], answer))
-                except Exception as msg:
-                    self.outq.put("%s error: %s\r\n" % (args[0], msg))
-            else:
-                self.outq.put("error: unknown command %s\r\n" % (args[0]))
+            self.outq.put(self.execute_batch([cmd])[0])
 
     def close(self):
         """close every server"""
         self.console.close()
         self.rpc.close()
+        if self.batch_rpc:
+            self.batch_rpc.close()
         self.server.stop()
 
 
@@ -356,9 +431,17 @@ def print_me(args):
     print("print_me: len = ", len(request))
 
 
-def run_simulator():
+def run_simulator(args=None):
     """run simulator"""
-    simulator = Simulator()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="modbus_tk simulator")
+    parser.add_argument(
+        "--batch-rpc-port", type=int, default=2712, help="port of the batch RPC interface, 0 for disabling it"
+    )
+    options = parser.parse_args(args)
+
+    simulator = Simulator(batch_rpc_port=options.batch_rpc_port or None)
 
     try:
         LOGGER.info("'quit' for closing the server")
@@ -12,6 +12,7 @@ from __future__ import print_function
 
 import socket
 import modbus_tk.defines
+from modbus_tk.utils import to_data, to_text
 
 
 class SimulatorRpcClient(object):
@@ -28,8 +29,8 @@ class SimulatorRpcClient(object):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(self.timeout)
         sock.connect((self.host, self.port))
-        sock.send(query)
-        response = sock.recv(1024)
+        sock.sendall(to_data(query))
+        response = to_text(sock.recv(1024))
         sock.close()
         return self._response_to_values(response.strip("\r\n"), query.split(" ")[0])
 
@@ -78,12 +79,16 @@ class SimulatorRpcClient(object):
         query = "remove_all_blocks %d" % (slave_id)
         self._rpc_call(query)
 
-    def set_values(self, slave_id, block_name, address, values):
-        """set the values of registers"""
+    def _set_values_query(self, slave_id, block_name, address, values):
+        """returns the set_values command"""
         query = "set_values %d %s %d" % (slave_id, block_name, address)
         for val in values:
             query += (" " + str(val))
-        return self._rpc_call(query)
+        return query
+
+    def set_values(self, slave_id, block_name, address, values):
+        """set the values of registers"""
+        return self._rpc_call(self._set_values_query(slave_id, block_name, address, values))
 
     def get_values(self, slave_id, block_name, address, length):
         """get the values of some registers"""
@@ -102,6 +107,72 @@ class SimulatorRpcClient(object):
         self._rpc_call(query)
 
 
+class PersistentSimulatorRpcClient(SimulatorRpcClient):
+    """
+    Send the commands to the batch RPC port of the simulator on a connection kept open.
+    Several commands can be sent in one round trip with call_batch
+    """
+
+    def __init__(self, host="127.0.0.1", port=2712, timeout=0.5):
+        """Constructor"""
+        super(PersistentSimulatorRpcClient, self).__init__(host, port, timeout)
+        self._sock = None
+        self._rfile = None
+
+    def __del__(self):
+        """Destructor: close the connection"""
+        self.close()
+
+    def close(self):
+        """close the connection: it is opened again by the next call"""
+        if self._sock:
+            self._rfile.close()
+            self._sock.close()
+            self._sock, self._rfile = None, None
+
+    def _rpc_call(self, query):
+        """send a rpc call and return the result"""
+        result = self.call_batch([query])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def call_batch(self, queries):
+        """
+        send the commands in one message and returns the list of their results
+        The result of a command which has failed is the Exception giving its error
+        """
+        if not self._sock:
+            self._sock = socket.create_connection((self.host, self.port), self.timeout)
+            self._rfile = self._sock.makefile("rb")
+        message = "batch %d\n" % len(queries) + "".join([query + "\n" for query in queries])
+        try:
+            self._sock.sendall(to_data(message))
+            responses = [to_text(self._rfile.readline()) for _ in queries]
+        except Exception:
+            # the answers can't be matched with the commands anymore
+            self.close()
+            raise
+        results = []
+        for (query, response) in zip(queries, responses):
+            try:
+                results.append(self._response_to_values(response.strip("\r\n"), query.split(" ")[0]))
+            except Exception as excpt:
+                results.append(excpt)
+        return results
+
+    def set_many_values(self, updates):
+        """
+        set the values of many registers in one round trip: updates is a sequence of
+        (slave_id, block_name, address, values). Raise the first error if any
+        """
+        results = self.call_batch([self._set_values_query(*update) for update in updates])
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+
 if __name__ == "__main__":
     modbus_simu = SimulatorRpcClient()
     modbus_simu.remove_all_slaves()
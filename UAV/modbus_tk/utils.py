@@ -10,12 +10,14 @@
 """
 from __future__ import print_function
 
+import binascii
 import sys
 import threading
 import logging
 import socket
 import select
 from modbus_tk import LOGGER
+from modbus_tk import defines
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
@@ -44,6 +46,158 @@ def threadsafe_function(fcn):
     return new
 
 
+def threadsafe_method(fcn):
+    """
+    decorator making sure that the decorated method is thread safe
+    The lock is the _lock attribute of the object: the calls on different objects run in parallel
+    """
+    def new(self, *args, **kwargs):
+        """Lock the object and call the decorated method
+
+           Unless kwargs['threadsafe'] == False
+        """
+        threadsafe = kwargs.pop('threadsafe', True)
+        if threadsafe:
+            with self._lock:
+                return fcn(self, *args, **kwargs)
+        return fcn(self, *args, **kwargs)
+    new.__name__ = fcn.__name__
+    new.__doc__ = fcn.__doc__
+    return new
+
+
+# identifies the current thread
+_get_thread_id = getattr(threading, "get_ident", threading.current_thread)
+
+
+class ReadWriteLock(object):
+    """
+    A lock shared by many readers or held by one writer. A thread waiting for writing
+    is served before the new readers: a continuous flow of readers doesn't starve the writers.
+    Both sides are reentrant and the writer can also read. A reader can't become a writer.
+    Used as a context manager, the lock is taken for writing
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # the number of read locks held by the current thread: a thread which reads already doesn't wait
+        self._local = threading.local()
+        # the number of threads reading
+        self._nb_readers = 0
+        self._writer = None
+        self._write_count = 0
+        self._waiting_writers = 0
+        self.read_lock = _LockSide(self.acquire_read, self.release_read)
+        self.write_lock = _LockSide(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        """wait until there is no writer and lock for reading"""
+        local = self._local
+        count = getattr(local, "count", 0)
+        if count:
+            # reentrant: waiting for the writers would be a deadlock
+            local.count = count + 1
+            return
+        with self._lock:
+            if self._writer is not None or self._waiting_writers:
+                thread = _get_thread_id()
+                # the writer can read
+                while self._writer != thread and (self._writer is not None or self._waiting_writers):
+                    self._condition.wait()
+            self._nb_readers += 1
+        local.count = 1
+
+    def release_read(self):
+        """release a read lock of the current thread"""
+        local = self._local
+        local.count -= 1
+        if local.count:
+            return
+        with self._lock:
+            self._nb_readers -= 1
+            if not self._nb_readers and self._waiting_writers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        """wait until there is no other reader or writer and lock for writing"""
+        thread = _get_thread_id()
+        with self._lock:
+            if self._writer == thread:
+                self._write_count += 1
+                return
+            if getattr(self._local, "count", 0):
+                raise RuntimeError("A reader can't lock for writing")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._nb_readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = thread
+            self._write_count = 1
+
+    def release_write(self):
+        """release a write lock of the current thread"""
+        with self._lock:
+            if self._writer != _get_thread_id():
+                raise RuntimeError("The lock is not held for writing by this thread")
+            self._write_count -= 1
+            if not self._write_count:
+                self._writer = None
+                self._condition.notify_all()
+
+    def __enter__(self):
+        """lock for writing"""
+        self.acquire_write()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """release the write lock"""
+        self.release_write()
+
+
+class _LockSide(object):
+    """context manager taking one side of a ReadWriteLock"""
+
+    def __init__(self, acquire, release):
+        """Constructor"""
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        """acquire the lock"""
+        self._acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """release the lock"""
+        self._release()
+
+
+class ExclusiveLock(object):
+    """
+    A reentrant lock with the interface of a ReadWriteLock: the readers wait for each other.
+    It is much cheaper than a ReadWriteLock when the requests are handled by a single thread
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self._lock = threading.RLock()
+        self.read_lock = self.write_lock = self._lock
+        self.acquire_read = self.acquire_write = self._lock.acquire
+        self.release_read = self.release_write = self._lock.release
+
+    def __enter__(self):
+        """lock for writing"""
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """release the lock"""
+        self._lock.release()
+
+
 def flush_socket(socks, lim=0):
     """remove the data present on the socket"""
     input_socks = [socks]
@@ -61,12 +215,24 @@ def flush_socket(socks, lim=0):
                 raise Exception("flush_socket: maximum number of iterations reached")
 
 
+def recv_into_exactly(sock, view, size):
+    """
+    Receive size bytes from the socket into the given memoryview
+    Returns the number of bytes received: less than size if the connection is closed
+    """
+    received = 0
+    while received < size:
+        nbytes = sock.recv_into(view[received:size])
+        if nbytes == 0:
+            break
+        received += nbytes
+    return received
+
+
 def get_log_buffer(prefix, buff):
     """Format binary data into a string for debug purpose"""
-    log = prefix
-    for i in buff:
-        log += str(ord(i) if PY2 else i) + "-"
-    return log[:-1]
+    # bytearray gives the values of the bytes of a str or a bytes
+    return prefix + "-".join([str(byte) for byte in bytearray(buff)])
 
 
 class ConsoleHandler(logging.Handler):
@@ -138,50 +304,211 @@ def swap_bytes(word_val):
     return (lsb << 8) + msb
 
 
-def calculate_crc(data):
-    """Calculate the CRC16 of a datagram"""
-    CRC16table = (
-        0x0000, 0xC0C1, 0xC181, 0x0140, 0xC301, 0x03C0, 0x0280, 0xC241,
-        0xC601, 0x06C0, 0x0780, 0xC741, 0x0500, 0xC5C1, 0xC481, 0x0440,
-        0xCC01, 0x0CC0, 0x0D80, 0xCD41, 0x0F00, 0xCFC1, 0xCE81, 0x0E40,
-        0x0A00, 0xCAC1, 0xCB81, 0x0B40, 0xC901, 0x09C0, 0x0880, 0xC841,
-        0xD801, 0x18C0, 0x1980, 0xD941, 0x1B00, 0xDBC1, 0xDA81, 0x1A40,
-        0x1E00, 0xDEC1, 0xDF81, 0x1F40, 0xDD01, 0x1DC0, 0x1C80, 0xDC41,
-        0x1400, 0xD4C1, 0xD581, 0x1540, 0xD701, 0x17C0, 0x1680, 0xD641,
-        0xD201, 0x12C0, 0x1380, 0xD341, 0x1100, 0xD1C1, 0xD081, 0x1040,
-        0xF001, 0x30C0, 0x3180, 0xF141, 0x3300, 0xF3C1, 0xF281, 0x3240,
-        0x3600, 0xF6C1, 0xF781, 0x3740, 0xF501, 0x35C0, 0x3480, 0xF441,
-        0x3C00, 0xFCC1, 0xFD81, 0x3D40, 0xFF01, 0x3FC0, 0x3E80, 0xFE41,
-        0xFA01, 0x3AC0, 0x3B80, 0xFB41, 0x3900, 0xF9C1, 0xF881, 0x3840,
-        0x2800, 0xE8C1, 0xE981, 0x2940, 0xEB01, 0x2BC0, 0x2A80, 0xEA41,
-        0xEE01, 0x2EC0, 0x2F80, 0xEF41, 0x2D00, 0xEDC1, 0xEC81, 0x2C40,
-        0xE401, 0x24C0, 0x2580, 0xE541, 0x2700, 0xE7C1, 0xE681, 0x2640,
-        0x2200, 0xE2C1, 0xE381, 0x2340, 0xE101, 0x21C0, 0x2080, 0xE041,
-        0xA001, 0x60C0, 0x6180, 0xA141, 0x6300, 0xA3C1, 0xA281, 0x6240,
-        0x6600, 0xA6C1, 0xA781, 0x6740, 0xA501, 0x65C0, 0x6480, 0xA441,
-        0x6C00, 0xACC1, 0xAD81, 0x6D40, 0xAF01, 0x6FC0, 0x6E80, 0xAE41,
-        0xAA01, 0x6AC0, 0x6B80, 0xAB41, 0x6900, 0xA9C1, 0xA881, 0x6840,
-        0x7800, 0xB8C1, 0xB981, 0x7940, 0xBB01, 0x7BC0, 0x7A80, 0xBA41,
-        0xBE01, 0x7EC0, 0x7F80, 0xBF41, 0x7D00, 0xBDC1, 0xBC81, 0x7C40,
-        0xB401, 0x74C0, 0x7580, 0xB541, 0x7700, 0xB7C1, 0xB681, 0x7640,
-        0x7200, 0xB2C1, 0xB381, 0x7340, 0xB101, 0x71C0, 0x7080, 0xB041,
-        0x5000, 0x90C1, 0x9181, 0x5140, 0x9301, 0x53C0, 0x5280, 0x9241,
-        0x9601, 0x56C0, 0x5780, 0x9741, 0x5500, 0x95C1, 0x9481, 0x5440,
-        0x9C01, 0x5CC0, 0x5D80, 0x9D41, 0x5F00, 0x9FC1, 0x9E81, 0x5E40,
-        0x5A00, 0x9AC1, 0x9B81, 0x5B40, 0x9901, 0x59C0, 0x5880, 0x9841,
-        0x8801, 0x48C0, 0x4980, 0x8941, 0x4B00, 0x8BC1, 0x8A81, 0x4A40,
-        0x4E00, 0x8EC1, 0x8F81, 0x4F40, 0x8D01, 0x4DC0, 0x4C80, 0x8C41,
-        0x4400, 0x84C1, 0x8581, 0x4540, 0x8701, 0x47C0, 0x4680, 0x8641,
-        0x8201, 0x42C0, 0x4380, 0x8341, 0x4100, 0x81C1, 0x8081, 0x4040
-    )
-    crc = 0xFFFF
+# the characters "0" and "1" of a binary string replaced by bytes 0 and 1
+# and the bytes replaced by "0" if 0 and "1" otherwise
+_BINARY_TO_BITS = bytes(bytearray(256))[:48] + b"\x00\x01" + bytes(bytearray(206))
+_BITS_TO_BINARY = b"0" + b"1" * 255
+
+
+def unpack_bits(data, count):
+    """
+    returns the count first bits of data as a tuple of 0 and 1: the bits of every byte are given
+    from the least significant one like in modbus coils. The bits are extracted by converting
+    data into a big integer and its binary string: there is no loop on the bits in python
+    """
     if PY2:
+        bits = []
+        for byte_value in bytearray(data):
+            for i in range(8):
+                bits.append((byte_value >> i) & 1)
+        return tuple(bits[:count])
+    if count <= 0:
+        return ()
+    value = int.from_bytes(data, "little")
+    binary = format(value, "0{0}b".format(8 * len(data))).encode("ascii")
+    # the binary string begins with the most significant bit
+    return tuple(binary[::-1][:count].translate(_BINARY_TO_BITS))
+
+
+def bytes_to_int(data):
+    """returns the bytes of data as an integer: the first byte is the least significant one"""
+    if PY2:
+        return int(binascii.hexlify(bytes(bytearray(data))[::-1]) or "0", 16)
+    return int.from_bytes(data, "little")
+
+
+def int_to_bytes(value, length):
+    """returns an integer as length bytes: the first byte is the least significant one"""
+    if PY2:
+        return binascii.unhexlify("%0*x" % (2 * length, value))[::-1] if length else b""
+    return value.to_bytes(length, "little")
+
+
+def pack_bits(values):
+    """
+    returns the values packed 8 per byte like modbus coils: the first value is the least
+    significant bit of the first byte. A value is 1 if true
+    """
+    if PY2:
+        data = bytearray((len(values) + 7) // 8)
+        for i, value in enumerate(values):
+            if value:
+                data[i // 8] |= 1 << (i % 8)
+        return bytes(data)
+    try:
+        bits = bytes(values)
+    except (TypeError, ValueError):
+        # the values are not all in 0..255
+        bits = bytes(map(bool, values))
+    if not bits:
+        return b""
+    # the last value is the most significant bit of the binary string
+    value = int(bits[::-1].translate(_BITS_TO_BINARY), 2)
+    return value.to_bytes((len(bits) + 7) // 8, "little")
+
+
+# new position of the bytes of a group for every word order
+WORD_ORDER_PERMUTATIONS = {
+    defines.WORD_ORDER_ABCD: (),
+    defines.WORD_ORDER_BADC: (1, 0),
+    defines.WORD_ORDER_CDAB: (2, 3, 0, 1),
+    defines.WORD_ORDER_DCBA: (3, 2, 1, 0),
+}
+
+
+def reorder_bytes(data, word_order):
+    """
+    Convert data between big-endian (ABCD) and the given word order
+    The bytes are moved with one slice copy per byte of a group whatever the length of data
+    """
+    permutation = WORD_ORDER_PERMUTATIONS[word_order]
+    if not permutation:
+        return data
+    group_size = len(permutation)
+    if PY2 and isinstance(data, memoryview):
+        # a memoryview of python 2 can't be sliced with a step
+        data = data.tobytes()
+    if len(data) % group_size:
+        raise ValueError("{0} bytes can not be reordered as {1}".format(len(data), word_order))
+    new_data = bytearray(len(data))
+    for i, j in enumerate(permutation):
+        new_data[i::group_size] = data[j::group_size]
+    return new_data
+
+
+# the crc16 of every byte value
+_CRC16_TABLE = (
+    0x0000, 0xC0C1, 0xC181, 0x0140, 0xC301, 0x03C0, 0x0280, 0xC241,
+    0xC601, 0x06C0, 0x0780, 0xC741, 0x0500, 0xC5C1, 0xC481, 0x0440,
+    0xCC01, 0x0CC0, 0x0D80, 0xCD41, 0x0F00, 0xCFC1, 0xCE81, 0x0E40,
+    0x0A00, 0xCAC1, 0xCB81, 0x0B40, 0xC901, 0x09C0, 0x0880, 0xC841,
+    0xD801, 0x18C0, 0x1980, 0xD941, 0x1B00, 0xDBC1, 0xDA81, 0x1A40,
+    0x1E00, 0xDEC1, 0xDF81, 0x1F40, 0xDD01, 0x1DC0, 0x1C80, 0xDC41,
+    0x1400, 0xD4C1, 0xD581, 0x1540, 0xD701, 0x17C0, 0x1680, 0xD641,
+    0xD201, 0x12C0, 0x1380, 0xD341, 0x1100, 0xD1C1, 0xD081, 0x1040,
+    0xF001, 0x30C0, 0x3180, 0xF141, 0x3300, 0xF3C1, 0xF281, 0x3240,
+    0x3600, 0xF6C1, 0xF781, 0x3740, 0xF501, 0x35C0, 0x3480, 0xF441,
+    0x3C00, 0xFCC1, 0xFD81, 0x3D40, 0xFF01, 0x3FC0, 0x3E80, 0xFE41,
+    0xFA01, 0x3AC0, 0x3B80, 0xFB41, 0x3900, 0xF9C1, 0xF881, 0x3840,
+    0x2800, 0xE8C1, 0xE981, 0x2940, 0xEB01, 0x2BC0, 0x2A80, 0xEA41,
+    0xEE01, 0x2EC0, 0x2F80, 0xEF41, 0x2D00, 0xEDC1, 0xEC81, 0x2C40,
+    0xE401, 0x24C0, 0x2580, 0xE541, 0x2700, 0xE7C1, 0xE681, 0x2640,
+    0x2200, 0xE2C1, 0xE381, 0x2340, 0xE101, 0x21C0, 0x2080, 0xE041,
+    0xA001, 0x60C0, 0x6180, 0xA141, 0x6300, 0xA3C1, 0xA281, 0x6240,
+    0x6600, 0xA6C1, 0xA781, 0x6740, 0xA501, 0x65C0, 0x6480, 0xA441,
+    0x6C00, 0xACC1, 0xAD81, 0x6D40, 0xAF01, 0x6FC0, 0x6E80, 0xAE41,
+    0xAA01, 0x6AC0, 0x6B80, 0xAB41, 0x6900, 0xA9C1, 0xA881, 0x6840,
+    0x7800, 0xB8C1, 0xB981, 0x7940, 0xBB01, 0x7BC0, 0x7A80, 0xBA41,
+    0xBE01, 0x7EC0, 0x7F80, 0xBF41, 0x7D00, 0xBDC1, 0xBC81, 0x7C40,
+    0xB401, 0x74C0, 0x7580, 0xB541, 0x7700, 0xB7C1, 0xB681, 0x7640,
+    0x7200, 0xB2C1, 0xB381, 0x7340, 0xB101, 0x71C0, 0x7080, 0xB041,
+    0x5000, 0x90C1, 0x9181, 0x5140, 0x9301, 0x53C0, 0x5280, 0x9241,
+    0x9601, 0x56C0, 0x5780, 0x9741, 0x5500, 0x95C1, 0x9481, 0x5440,
+    0x9C01, 0x5CC0, 0x5D80, 0x9D41, 0x5F00, 0x9FC1, 0x9E81, 0x5E40,
+    0x5A00, 0x9AC1, 0x9B81, 0x5B40, 0x9901, 0x59C0, 0x5880, 0x9841,
+    0x8801, 0x48C0, 0x4980, 0x8941, 0x4B00, 0x8BC1, 0x8A81, 0x4A40,
+    0x4E00, 0x8EC1, 0x8F81, 0x4F40, 0x8D01, 0x4DC0, 0x4C80, 0x8C41,
+    0x4400, 0x84C1, 0x8581, 0x4540, 0x8701, 0x47C0, 0x4680, 0x8641,
+    0x8201, 0x42C0, 0x4380, 0x8341, 0x4100, 0x81C1, 0x8081, 0x4040
+)
+
+# the crc16 of 2 bytes at once, indexed by the crc xor the 2 bytes read as a little-endian word
+# 65536 entries: built on the first use
+_CRC16_WORD_TABLE = None
+
+# the words of a memoryview can be read in native byte order only
+_WORD_CRC = PY3 and sys.byteorder == "little"
+
+# shorter data is processed byte by byte: cheaper than making a view of its words
+_WORD_CRC_MIN_LENGTH = 16
+
+
+def _make_crc16_word_table():
+    """returns the crc16 of every 2 bytes value"""
+    return tuple(
+        (_CRC16_TABLE[low] >> 8) ^ _CRC16_TABLE[(high ^ _CRC16_TABLE[low]) & 0xFF]
+        for high in range(256) for low in range(256)
+    )
+
+
+def _update_crc(crc, data, table=_CRC16_TABLE):
+    """returns the crc16 register after processing data"""
+    global _CRC16_WORD_TABLE
+    if PY3:
+        if isinstance(data, memoryview) and data.format != 'B':
+            data = data.cast('B')
+        length = len(data)
+        if _WORD_CRC and length >= _WORD_CRC_MIN_LENGTH:
+            word_table = _CRC16_WORD_TABLE
+            if word_table is None:
+                word_table = _CRC16_WORD_TABLE = _make_crc16_word_table()
+            view = memoryview(data)
+            for word in view[:length & ~1].cast('H'):
+                crc = word_table[crc ^ word]
+            if length & 1:
+                crc = (crc >> 8) ^ table[(view[length - 1] ^ crc) & 0xFF]
+            return crc
+    # the items of a bytearray are ints whatever the type of data and the python version
+    for c in bytearray(data):
+        crc = (crc >> 8) ^ table[(c ^ crc) & 0xFF]
+    return crc
+
+
+def calculate_crc(data, table=_CRC16_TABLE):
+    """Calculate the CRC16 of a datagram: bytes, bytearray or memoryview are read without copy"""
+    if PY3 and len(data) < _WORD_CRC_MIN_LENGTH and not isinstance(data, memoryview):
+        # the usual short requests
+        crc = 0xFFFF
         for c in data:
-            crc = (crc >> 8) ^ CRC16table[(ord(c) ^ crc) & 0xFF]
+            crc = (crc >> 8) ^ table[(c ^ crc) & 0xFF]
     else:
-        for c in data:
-            crc = (crc >> 8) ^ CRC16table[((c) ^ crc) & 0xFF]
-    return swap_bytes(crc)
+        crc = _update_crc(0xFFFF, data)
+    return ((crc & 0xFF) << 8) | (crc >> 8)
+
+
+class Crc16(object):
+    """CRC16 of a datagram computed as its bytes are received"""
+
+    def __init__(self, data=b""):
+        """Constructor: start with the crc of the given data"""
+        self._crc = 0xFFFF
+        self.update(data)
+
+    def update(self, data):
+        """add the given bytes to the datagram"""
+        self._crc = _update_crc(self._crc, data)
+        return self
+
+    def value(self):
+        """returns the CRC16 like calculate_crc"""
+        return swap_bytes(self._crc)
+
+    def is_valid(self):
+        """
+        returns True if the datagram ends with its CRC16: the crc of a modbus
+        frame including its crc is 0
+        """
+        return self._crc == 0
 
 
 def calculate_rtu_inter_char(baudrate):
@@ -211,7 +538,7 @@ class WorkerThread(object):
 
     def stop(self):
         """stop the thread"""
-        if self._thread.isAlive():
+        if self._thread.is_alive():
             self._go.clear()
             self._thread.join()
 
@@ -235,3 +562,11 @@ def to_data(string_data):
         return string_data
     else:
         return bytearray(string_data, 'ascii')
+
+
+def to_text(data):
+    """convert the data received on a socket to a string"""
+    if PY2:
+        return data
+    else:
+        return bytes(data).decode('ascii', 'replace')
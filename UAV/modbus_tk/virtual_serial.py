@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Virtual serial link: 2 pseudo-terminals connected like by a null-modem cable, for running
+ RtuMaster and RtuServer together without hardware. Linux and bsd only
+   link = VirtualSerialLink(baudrate=19200, latency=0.005, error_rate=1e-5)
+   server = modbus_rtu.RtuServer(serial.Serial(link.ports[0]))
+   master = modbus_rtu.RtuMaster(serial.Serial(link.ports[1]))
+   ...
+   link.close()
+ The ports are device paths: they can be given to functions.get_port. For running programs in
+ several processes, python -m modbus_tk.virtual_serial prints the paths and keeps the link open
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import select
+import threading
+import time
+
+from modbus_tk import LOGGER
+
+
+class _Direction(object):
+    """forward the bytes written on a terminal to the other one with the delays and errors of the line"""
+
+    def __init__(self, link, index, source_fd, destination_fd):
+        """Constructor: nothing is sent on the line yet. index makes the errors of each direction different"""
+        self._link = link
+        self._source_fd = source_fd
+        self._destination_fd = destination_fd
+        # time when the last byte given to the line is completely sent
+        self._line_free_time = 0.0
+        # a tuple is not accepted as a seed by recent pythons: a string is
+        self._random = random.Random(None if link.seed is None else "{0}/{1}".format(link.seed, index))
+        self.nb_bytes = 0
+        self.nb_errors = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _corrupt(self, data):
+        """flip random bits of the data according to the bit error rate"""
+        data = bytearray(data)
+        for i in range(len(data)):
+            for bit in range(8):
+                if self._random.random() < self._link.error_rate:
+                    data[i] ^= 1 << bit
+                    self.nb_errors += 1
+        return data
+
+    def _run(self):
+        """main function of the thread: copy the bytes until the link is closed"""
+        link = self._link
+        while not link.closed:
+            try:
+                if not select.select([self._source_fd], [], [], 0.1)[0]:
+                    continue
+                data = os.read(self._source_fd, 1024)
+            except (OSError, select.error):
+                break
+            now = time.time()
+            if link.baudrate:
+                # 10 bits per byte: start, 8 data bits and stop
+                self._line_free_time = max(now, self._line_free_time) + len(data) * 10.0 / link.baudrate
+                delivery_time = self._line_free_time + link.latency
+            else:
+                delivery_time = now + link.latency
+            if link.error_rate:
+                data = self._corrupt(data)
+            delay = delivery_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                os.write(self._destination_fd, data)
+            except OSError:
+                break
+            self.nb_bytes += len(data)
+
+
+class VirtualSerialLink(object):
+    """
+    2 pseudo-terminals connected to each other. The bytes written on a port are read on the other port
+    after the time needed for sending them at baudrate (None for no delay) plus latency in seconds.
+    Each bit is flipped with the probability error_rate. The seed makes the errors reproducible
+    """
+
+    def __init__(self, baudrate=None, latency=0.0, error_rate=0.0, seed=None):
+        """Constructor: create the terminals and start forwarding"""
+        import tty
+
+        self.baudrate = baudrate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.closed = False
+        self._fds = []
+        ports = []
+        for _ in range(2):
+            (master_fd, slave_fd) = os.openpty()
+            # no echo and no translation of the bytes
+            tty.setraw(slave_fd)
+            tty.setraw(master_fd)
+            # the terminal is kept open: reading the master side fails once all its users are closed
+            self._fds.extend((master_fd, slave_fd))
+            ports.append(os.ttyname(slave_fd))
+        self.ports = tuple(ports)
+        (master_a, master_b) = (self._fds[0], self._fds[2])
+        self._directions = (_Direction(self, 0, master_a, master_b), _Direction(self, 1, master_b, master_a))
+        for direction in self._directions:
+            direction.thread.start()
+        LOGGER.debug("virtual serial link between %s and %s", *self.ports)
+
+    def open(self, index, **kwargs):
+        """returns a pyserial object for the port of the given index (0 or 1): kwargs are given to serial.Serial"""
+        import serial
+        kwargs.setdefault("baudrate", self.baudrate or 115200)
+        return serial.Serial(self.ports[index], **kwargs)
+
+    def get_stats(self):
+        """returns the number of bytes sent and of bits flipped as a dict"""
+        return {
+            "nb_bytes": sum(direction.nb_bytes for direction in self._directions),
+            "nb_errors": sum(direction.nb_errors for direction in self._directions),
+        }
+
+    def close(self):
+        """stop forwarding and close the terminals"""
+        if self.closed:
+            return
+        self.closed = True
+        for direction in self._directions:
+            direction.thread.join()
+        for fd in self._fds:
+            os.close(fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(args=None):
+    """open a link and print its ports until Ctrl-C"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Virtual serial link between 2 pseudo-terminals")
+    parser.add_argument("--baudrate", type=int, default=None, help="simulated baudrate, no delay by default")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of flipping each bit")
+    options = parser.parse_args(args)
+
+    with VirtualSerialLink(options.baudrate, options.latency, options.error_rate) as link:
+        print("{0} <-> {1}".format(*link.ports))
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            print(link.get_stats())
+
+
+if __name__ == "__main__":
+    main()
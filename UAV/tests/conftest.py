@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ The tests import modbus_tk from the UAV directory: pytest can be run from the root of the repository
+"""
+
+import os
+import sys
+
+UAV_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if UAV_DIR not in sys.path:
+    sys.path.insert(0, UAV_DIR)
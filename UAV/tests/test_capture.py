@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the wire captures: the records read back are the records written
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from modbus_tk import capture
+from modbus_tk.exceptions import InvalidArgumentError
+
+FRAMES = [
+    (capture.RECEIVED, 1, b"\x00\x01\x00\x00\x00\x06\x01\x03\x00\x00\x00\x02"),
+    (capture.SENT, 1, b"\x00\x01\x00\x00\x00\x07\x01\x03\x04\x00\x05\x00\x06"),
+    (capture.RECEIVED, 2, bytearray(b"\x01\x03\x00\x00\x00\x0a\xc5\xcd")),
+    (capture.SENT, 0xFFFFFFFF, memoryview(b"")),
+    (capture.RECEIVED, 3, b"\xff" * 300),
+]
+
+
+class TestWireCapture(unittest.TestCase):
+    """the records are written in memory or in a file and read back"""
+
+    def setUp(self):
+        """a directory for the capture files"""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.cap")
+
+    def tearDown(self):
+        """remove the capture files"""
+        shutil.rmtree(self.directory)
+
+    def record_frames(self, wire_capture):
+        """record the test frames"""
+        for (direction, connection_id, frame) in FRAMES:
+            wire_capture.record(direction, connection_id, frame)
+
+    def assert_frames(self, start_time):
+        """the capture file has the test frames in order, recorded since start_time"""
+        records = list(capture.read_capture(self.path))
+        self.assertEqual(
+            [record[1:] for record in records],
+            [(direction, connection_id, bytes(bytearray(frame))) for (direction, connection_id, frame) in FRAMES]
+        )
+        times = [record[0] for record in records]
+        self.assertEqual(times, sorted(times))
+        self.assertTrue(start_time - 1.0 <= times[0] and times[-1] <= time.time() + 1.0)
+
+    def test_memory(self):
+        """the records kept in memory are saved in a file"""
+        start_time = time.time()
+        wire_capture = capture.WireCapture()
+        self.record_frames(wire_capture)
+        wire_capture.save(self.path)
+        self.assert_frames(start_time)
+
+    def test_max_records(self):
+        """only the last records are kept in memory"""
+        wire_capture = capture.WireCapture(max_records=2)
+        self.record_frames(wire_capture)
+        wire_capture.save(self.path)
+        self.assertEqual([record[2] for record in capture.read_capture(self.path)], [0xFFFFFFFF, 3])
+
+    def test_file(self):
+        """the records are written by flush_every and on close"""
+        start_time = time.time()
+        wire_capture = capture.WireCapture(self.path, flush_every=2)
+        self.record_frames(wire_capture)
+        wire_capture.flush()
+        self.assert_frames(start_time)
+        self.assertRaises(InvalidArgumentError, wire_capture.save, os.path.join(self.directory, "other.cap"))
+        wire_capture.close()
+        self.assert_frames(start_time)
+
+    def test_save_while_recording(self):
+        """the records can be saved while threads are recording"""
+        wire_capture = capture.WireCapture(max_records=1000)
+        done = threading.Event()
+
+        def record():
+            while not done.is_set():
+                wire_capture.record(capture.SENT, 1, b"\x01\x02")
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(50):
+                wire_capture.save(self.path)
+                for record in capture.read_capture(self.path):
+                    self.assertEqual(record[1:], (capture.SENT, 1, b"\x01\x02"))
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+
+    def test_not_a_capture(self):
+        """a file without the header of the captures is refused"""
+        with open(self.path, "wb") as the_file:
+            the_file.write(b"MBTKSRB1" + b"\x00" * 8)
+        self.assertRaises(InvalidArgumentError, list, capture.read_capture(self.path))
+
+    def test_format_record(self):
+        """a record as a line of csv or text"""
+        timestamp = time.mktime((2024, 5, 6, 7, 8, 9, 0, 0, -1)) + 0.25
+        record = (timestamp, capture.SENT, 7, b"\x01\x83\x02")
+        self.assertEqual(
+            capture.format_record(record, csv=True), "{0:.6f},sent,7,3,018302".format(timestamp)
+        )
+        self.assertEqual(capture.format_record(record), "2024-05-06 07:08:09.250000     7 -> 01 83 02")
+        record = (timestamp, capture.RECEIVED, 12345, b"")
+        self.assertEqual(capture.format_record(record, csv=True), "{0:.6f},received,12345,0,".format(timestamp))
+        self.assertEqual(capture.format_record(record), "2024-05-06 07:08:09.250000 12345 <- ")
+
+    def test_formatted_file(self):
+        """every record of a file is formatted"""
+        wire_capture = capture.WireCapture(self.path)
+        self.record_frames(wire_capture)
+        wire_capture.close()
+        lines = [capture.format_record(record, csv=True) for record in capture.read_capture(self.path)]
+        self.assertEqual(
+            [line.split(",", 1)[1] for line in lines],
+            [
+                "received,1,12,000100000006010300000002",
+                "sent,1,13,00010000000701030400050006",
+                "received,2,8,01030000000ac5cd",
+                "sent,4294967295,0,",
+                "received,3,300," + "ff" * 300,
+            ]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the global hooks and of the hooks scoped to an instance
+"""
+
+import gc
+import unittest
+
+from modbus_tk import hooks
+
+HOOK_NAME = "tests.Device.before_send"
+
+
+class Device(object):
+    """an instance calling the hook"""
+
+    def send(self, request):
+        """returns the value of the hooks"""
+        return hooks.call_hooks(HOOK_NAME, (self, request))
+
+
+class SlotsDevice(object):
+    """an instance which can't store its scoped hooks"""
+    __slots__ = ("__weakref__", )
+
+
+class NoWeakrefDevice(object):
+    """an instance which can store its scoped hooks but can't be weakly referenced"""
+    __slots__ = ("_scoped_hooks", )
+
+
+def answer(value):
+    """returns a hook returning the value"""
+    return lambda args: value
+
+
+class TestHooks(unittest.TestCase):
+    """the scoped hooks are called for their instance only"""
+
+    def tearDown(self):
+        """remove the hooks of the test"""
+        with hooks._LOCK:
+            hooks._GLOBAL_HOOKS.pop(HOOK_NAME, None)
+            hooks._SCOPED_REFS.pop(HOOK_NAME, None)
+            hooks._publish(HOOK_NAME)
+
+    def assert_no_scoped_hooks(self):
+        """no instance is registered and the hook doesn't look for scoped hooks anymore"""
+        self.assertFalse(hooks._SCOPED_REFS.get(HOOK_NAME))
+        self.assertNotIn(HOOK_NAME, hooks._HOOKS)
+
+    def test_global(self):
+        """a global hook is called for every instance"""
+        calls = []
+        hooks.install_hook(HOOK_NAME, calls.append)
+        (first, second) = (Device(), Device())
+        self.assertIsNone(first.send(b"1"))
+        self.assertIsNone(second.send(b"2"))
+        self.assertEqual(calls, [(first, b"1"), (second, b"2")])
+        hooks.uninstall_hook(HOOK_NAME, calls.append)
+        self.assert_no_scoped_hooks()
+
+    def test_scoped(self):
+        """a scoped hook is called for its instance only, before the global hooks"""
+        (first, second) = (Device(), Device())
+        hooks.install_hook(HOOK_NAME, answer("global"))
+        hooks.install_hook(HOOK_NAME, answer("first"), first)
+        self.assertEqual(first.send(b""), "first")
+        self.assertEqual(second.send(b""), "global")
+
+        calls = []
+        hooks.install_hook(HOOK_NAME, calls.append, second)
+        self.assertEqual(second.send(b"2"), "global")
+        self.assertEqual(calls, [(second, b"2")])
+
+        hooks.uninstall_hook(HOOK_NAME, instance=first)
+        self.assertEqual(first.send(b""), "global")
+        self.assertIsNone(first._scoped_hooks)
+        hooks.uninstall_hook(HOOK_NAME, calls.append, second)
+        hooks.uninstall_hook(HOOK_NAME)
+        self.assert_no_scoped_hooks()
+        self.assertIsNone(second.send(b""))
+
+    def test_garbage_collection(self):
+        """the hook doesn't look for the scoped hooks of the deleted instances"""
+        device = Device()
+        hooks.install_hook(HOOK_NAME, answer("device"), device)
+        hooks.install_hook(HOOK_NAME, answer("again"), device)
+        self.assertEqual(len(hooks._SCOPED_REFS[HOOK_NAME]), 1)
+        self.assertEqual(device.send(b""), "device")
+        del device
+        gc.collect()
+        self.assert_no_scoped_hooks()
+        self.assertIsNone(Device().send(b""))
+
+    def test_slots(self):
+        """an instance which can't have scoped hooks isn't registered"""
+        for (device, error) in ((SlotsDevice(), AttributeError), (NoWeakrefDevice(), TypeError)):
+            self.assertRaises(error, hooks.install_hook, HOOK_NAME, answer("device"), device)
+            self.assert_no_scoped_hooks()
+            self.assertIsNone(hooks.call_hooks(HOOK_NAME, (device, b"")))
+            self.assertIsNone(Device().send(b""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the blocks, slaves and databanks of modbus_tk.modbus
+"""
+
+import random
+import struct
+import threading
+import unittest
+
+from modbus_tk import defines
+from modbus_tk import modbus
+from modbus_tk import utils
+from modbus_tk.exceptions import MissingKeyError, OutOfModbusBlockError
+
+
+def read_pdu(function_code, address, quantity):
+    """returns the pdu of a read request"""
+    return struct.pack(">BHH", function_code, address, quantity)
+
+
+def write_registers_pdu(address, values):
+    """returns the pdu of a write multiple registers request"""
+    return struct.pack(
+        ">BHHB{0}H".format(len(values)), defines.WRITE_MULTIPLE_REGISTERS, address, len(values), 2 * len(values),
+        *values
+    )
+
+
+def exception_pdu(function_code, exception_code):
+    """returns the pdu of an exception response"""
+    return struct.pack(">BB", function_code + 0x80, exception_code)
+
+
+class TestModbusBlock(unittest.TestCase):
+    """the values of the registers stored in a typed array"""
+
+    def test_unsigned(self):
+        """the values are between 0 and 65535"""
+        block = modbus.ModbusBlock(100, 4)
+        self.assertEqual(list(block[:]), [0, 0, 0, 0])
+        block[0] = 65535
+        block[1:3] = [1, 2]
+        self.assertEqual(list(block[:]), [65535, 1, 2, 0])
+        self.assertRaises(OverflowError, block.__setitem__, 3, -1)
+        self.assertRaises(OverflowError, block.__setitem__, 3, 65536)
+
+    def test_signed(self):
+        """the values are between -32768 and 32767"""
+        block = modbus.ModbusBlock(0, 2, unsigned=False)
+        block[0:2] = [-32768, 32767]
+        self.assertEqual(list(block[:]), [-32768, 32767])
+        self.assertRaises(OverflowError, block.__setitem__, 0, 32768)
+
+    def test_bytes(self):
+        """the values are read and written as big-endian words"""
+        block = modbus.ModbusBlock(0, 4)
+        block.set_bytes(1, b"\x12\x34\xff\xfe")
+        self.assertEqual(list(block[:]), [0, 0x1234, 0xfffe, 0])
+        self.assertEqual(block.get_bytes(1, 2), b"\x12\x34\xff\xfe")
+        self.assertEqual(block.get_bytes(0, 4), b"\x00\x00\x12\x34\xff\xfe\x00\x00")
+
+        block = modbus.ModbusBlock(0, 2, unsigned=False)
+        block.set_bytes(0, b"\xff\xfe\x00\x05")
+        self.assertEqual(list(block[:]), [-2, 5])
+        self.assertEqual(block.get_bytes(0, 2), b"\xff\xfe\x00\x05")
+
+    def test_generation(self):
+        """every write changes the generation"""
+        block = modbus.ModbusBlock(0, 4)
+        generation = block.generation
+        block[0] = 1
+        self.assertNotEqual(block.generation, generation)
+        generation = block.generation
+        block.set_bytes(0, b"\x00\x01")
+        self.assertNotEqual(block.generation, generation)
+
+
+class TestSlaveBlocks(unittest.TestCase):
+    """the requests are handled by the block containing all their items"""
+
+    def setUp(self):
+        """contiguous blocks at 0 and 10, another one at 30"""
+        self.slave = modbus.Slave(1)
+        for (name, address) in (("a", 0), ("b", 10), ("c", 30)):
+            self.slave.add_block(name, defines.HOLDING_REGISTERS, address, 10)
+            self.slave.set_values(name, address, list(range(address, address + 10)))
+
+    def read(self, address, quantity):
+        """returns the response pdu of a read of holding registers"""
+        return self.slave.handle_request(read_pdu(defines.READ_HOLDING_REGISTERS, address, quantity))
+
+    def assert_read(self, address, quantity):
+        """the read returns the address of every register as its value"""
+        values = list(range(address, address + quantity))
+        self.assertEqual(
+            self.read(address, quantity), struct.pack(">BB{0}H".format(quantity), 3, 2 * quantity, *values)
+        )
+
+    def assert_illegal_address(self, response_pdu, function_code=defines.READ_HOLDING_REGISTERS):
+        """the request is refused"""
+        self.assertEqual(response_pdu, exception_pdu(function_code, defines.ILLEGAL_DATA_ADDRESS))
+
+    def test_reads_in_a_block(self):
+        """first, last and all the registers of the blocks"""
+        self.assert_read(0, 10)
+        self.assert_read(9, 1)
+        self.assert_read(10, 1)
+        self.assert_read(10, 10)
+        self.assert_read(35, 5)
+
+    def test_reads_across_blocks(self):
+        """a read across 2 contiguous blocks, over a gap or after the last block is refused"""
+        self.assert_illegal_address(self.read(8, 3))
+        self.assert_illegal_address(self.read(19, 2))
+        self.assert_illegal_address(self.read(20, 1))
+        self.assert_illegal_address(self.read(28, 3))
+        self.assert_illegal_address(self.read(39, 2))
+        self.assert_illegal_address(self.read(40, 1))
+        self.assert_illegal_address(self.slave.handle_request(read_pdu(defines.READ_INPUT_REGISTERS, 0, 1)),
+                                    defines.READ_INPUT_REGISTERS)
+
+    def test_write_across_blocks(self):
+        """a write across 2 blocks is refused and changes nothing"""
+        self.assert_illegal_address(
+            self.slave.handle_request(write_registers_pdu(9, [1, 2])), defines.WRITE_MULTIPLE_REGISTERS
+        )
+        self.assertEqual(self.slave.get_values("a", 9), (9, ))
+        self.assertEqual(self.slave.get_values("b", 10), (10, ))
+
+    def test_values_out_of_block(self):
+        """set_values and get_values stay in the named block"""
+        self.assertRaises(OutOfModbusBlockError, self.slave.set_values, "a", 9, [1, 2])
+        self.assertRaises(OutOfModbusBlockError, self.slave.get_values, "b", 9)
+        self.assertRaises(OutOfModbusBlockError, self.slave.get_values, "b", 15, 6)
+        self.assertEqual(self.slave.get_values("b", 15, 5), (15, 16, 17, 18, 19))
+
+    def test_signed_slave(self):
+        """the registers of a signed slave hold negative values"""
+        slave = modbus.Slave(1, unsigned=False)
+        slave.add_block("a", defines.HOLDING_REGISTERS, 0, 2)
+        slave.handle_request(struct.pack(">BHH", defines.WRITE_SINGLE_REGISTER, 1, 0xfffe))
+        self.assertEqual(slave.get_values("a", 0, 2), (0, -2))
+        self.assertEqual(
+            slave.handle_request(read_pdu(defines.READ_HOLDING_REGISTERS, 0, 2)), b"\x03\x04\x00\x00\xff\xfe"
+        )
+
+    def test_random_layouts(self):
+        """random blocks and reads: the block found is the one containing all the registers"""
+        draw = random.Random(4)
+        for _ in range(200):
+            slave = modbus.Slave(1)
+            layout = []
+            address = 0
+            for i in range(draw.randint(1, 20)):
+                address += draw.choice((0, 0, 1, 5))
+                size = draw.randint(1, 20)
+                slave.add_block(str(i), defines.HOLDING_REGISTERS, address, size)
+                layout.append((address, size))
+                address += size
+            for _ in range(50):
+                (address, quantity) = (draw.randrange(address + 5), draw.randint(1, 25))
+                inside = [
+                    start for (start, size) in layout if start <= address and address + quantity <= start + size
+                ]
+                response = slave.handle_request(read_pdu(defines.READ_HOLDING_REGISTERS, address, quantity))
+                if inside:
+                    self.assertEqual(response[:2], struct.pack(">BB", 3, 2 * quantity))
+                else:
+                    self.assert_illegal_address(response)
+
+
+class TestModbusBitBlock(unittest.TestCase):
+    """the coils packed 8 per byte compared with a list of their values"""
+
+    def test_random_writes(self):
+        """items, slices and packed bits written and read at every offset"""
+        draw = random.Random(6)
+        for size in (1, 7, 8, 9, 17, 40):
+            block = modbus.ModbusBitBlock(0, size)
+            values = [0] * size
+            for _ in range(300):
+                offset = draw.randrange(size)
+                count = draw.randint(1, size - offset)
+                new_values = [draw.randint(0, 1) for _ in range(count)]
+                operation = draw.randrange(3)
+                if operation == 0:
+                    block[offset] = new_values[0]
+                    values[offset] = new_values[0]
+                elif operation == 1:
+                    block[offset:offset + count] = new_values
+                    values[offset:offset + count] = new_values
+                else:
+                    block.set_packed_bits(offset, utils.pack_bits(new_values), count)
+                    values[offset:offset + count] = new_values
+
+                self.assertEqual(block[:], values)
+                offset = draw.randrange(size)
+                count = draw.randint(1, size - offset)
+                self.assertEqual(block.get_packed_bits(offset, count), utils.pack_bits(values[offset:offset + count]))
+                self.assertEqual(block.get_bits(offset, count), tuple(values[offset:offset + count]))
+
+    def test_out_of_range(self):
+        """the items after the last one don't exist"""
+        block = modbus.ModbusBitBlock(0, 9)
+        self.assertRaises(IndexError, block.__getitem__, 9)
+        self.assertRaises(IndexError, block.__setitem__, 9, 1)
+        self.assertRaises(ValueError, block.__setitem__, slice(0, 2), [1])
+        block[-1] = 1
+        self.assertEqual(block[8], 1)
+
+
+class TestSlaveCoils(unittest.TestCase):
+    """the coils read and written by requests"""
+
+    def check_coils(self, slave, address, size):
+        """write and read every range of coils of a block of size items at address"""
+        draw = random.Random(7)
+        values = [0] * size
+        for offset in range(size):
+            for count in range(1, size - offset + 1):
+                new_values = [draw.randint(0, 1) for _ in range(count)]
+                data = utils.pack_bits(new_values)
+                request = struct.pack(
+                    ">BHHB", defines.WRITE_MULTIPLE_COILS, address + offset, count, len(data)
+                ) + data
+                self.assertEqual(
+                    slave.handle_request(request),
+                    struct.pack(">BHH", defines.WRITE_MULTIPLE_COILS, address + offset, count)
+                )
+                values[offset:offset + count] = new_values
+                response = slave.handle_request(read_pdu(defines.READ_COILS, address + offset, count))
+                expected = utils.pack_bits(values[offset:offset + count])
+                self.assertEqual(response, struct.pack(">BB", defines.READ_COILS, len(expected)) + expected)
+        self.assertEqual(
+            slave.handle_request(read_pdu(defines.READ_COILS, address, size + 1)),
+            exception_pdu(defines.READ_COILS, defines.ILLEGAL_DATA_ADDRESS)
+        )
+
+    def test_bit_block(self):
+        """a block of coils which doesn't start on a multiple of 8"""
+        slave = modbus.Slave(1)
+        slave.add_block("coils", defines.COILS, 5, 13)
+        self.check_coils(slave, 5, 13)
+
+    def test_plain_block(self):
+        """a block of registers given for coils in the memory map"""
+        slave = modbus.Slave(1, memory={defines.COILS: [modbus.ModbusBlock(3, 11)]})
+        self.check_coils(slave, 3, 11)
+
+
+class TestApplyUpdates(unittest.TestCase):
+    """a batch of writes is applied completely or not at all"""
+
+    def setUp(self):
+        """2 slaves with 2 blocks each"""
+        self.databank = modbus.Databank()
+        self.slaves = [self.databank.add_slave(slave_id) for slave_id in (1, 2)]
+        for slave in self.slaves:
+            slave.add_block("a", defines.HOLDING_REGISTERS, 0, 10)
+            slave.add_block("b", defines.COILS, 0, 10)
+
+    def get_state(self):
+        """returns the values and the generations of all the blocks"""
+        return [
+            (slave.get_values(name, 0, 10), slave.get_generation(name)) for slave in self.slaves for name in ("a", "b")
+        ]
+
+    def test_apply(self):
+        """the values are written and the generation of the blocks written only is changed"""
+        generations = [generation for (_, generation) in self.get_state()]
+        self.databank.apply_updates([(1, "a", 2, [7, 8]), (2, "b", 9, 1), (1, "a", 0, (5, ))])
+        state = self.get_state()
+        self.assertEqual(state[0][0], (5, 0, 7, 8, 0, 0, 0, 0, 0, 0))
+        self.assertEqual(state[3][0], (0, ) * 9 + (1, ))
+        self.assertEqual([generation != state[i][1] for (i, generation) in enumerate(generations)],
+                         [True, False, False, True])
+
+    def test_invalid_entries(self):
+        """nothing is written when an entry is invalid, even the last one"""
+        self.slaves[0].set_values("a", 0, list(range(10)))
+        state = self.get_state()
+        valid = [(1, "a", 0, [10, 11]), (2, "b", 0, [1, 1, 1])]
+        for (invalid, error) in (
+            ((3, "a", 0, 1), MissingKeyError),
+            ((2, "c", 0, 1), MissingKeyError),
+            ((2, "a", 9, [1, 2]), OutOfModbusBlockError),
+            ((1, "a", 5, [1, 65536]), OverflowError),
+            ((1, "a", 0, -1), OverflowError),
+        ):
+            self.assertRaises(error, self.databank.apply_updates, valid + [invalid])
+            self.assertEqual([values for (values, _) in self.get_state()], [values for (values, _) in state])
+
+    def test_readers_see_whole_batches(self):
+        """a reader never sees the first entry of a batch without the last one"""
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                values = self.slaves[0].get_values("a", 0, 10)
+                if values[0] != values[9]:
+                    errors.append(values)
+        thread = threading.Thread(target=read)
+        thread.start()
+        try:
+            for value in range(2000):
+                self.databank.apply_updates([(1, "a", 0, value), (2, "a", 0, value), (1, "a", 9, value)])
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
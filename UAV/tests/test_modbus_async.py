@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the asyncio masters against a slave giving scripted answers
+"""
+
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+from modbus_tk import capture
+from modbus_tk import defines
+from modbus_tk.exceptions import ModbusInvalidResponseError
+
+try:
+    import asyncio
+    from modbus_tk import modbus_async
+    from modbus_tk.loadgen import find_free_port
+except (ImportError, SyntaxError):
+    # python 2
+    modbus_async = None
+
+
+def read_response(request, value):
+    """returns the response to a read of 1 holding register with the transaction id of the request"""
+    return request[:2] + struct.pack(">HHBBBH", 0, 5, 1, defines.READ_HOLDING_REGISTERS, 2, value)
+
+
+class ScriptedSlave(threading.Thread):
+    """
+    A tcp slave serving 1 connection at a time: every request is answered by the next function
+    of answers which returns the bytes to send
+    """
+
+    def __init__(self, answers):
+        """Constructor: listen on a free port of the loopback interface"""
+        super(ScriptedSlave, self).__init__()
+        self.daemon = True
+        self.answers = list(answers)
+        self.nb_connections = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+
+    def _recv_request(self, conn):
+        """returns a request or b"" when the master is disconnected"""
+        request = b""
+        while len(request) < 7 or len(request) < 6 + struct.unpack(">H", request[4:6])[0]:
+            data = conn.recv(1024)
+            if not data:
+                return b""
+            request += data
+        return request
+
+    def run(self):
+        """serve the connections until the answers are exhausted"""
+        while self.answers:
+            (conn, _) = self._sock.accept()
+            self.nb_connections += 1
+            while self.answers:
+                request = self._recv_request(conn)
+                if not request:
+                    break
+                conn.sendall(self.answers.pop(0)(request))
+            conn.close()
+        self._sock.close()
+
+
+@unittest.skipIf(modbus_async is None, "modbus_async needs python 3")
+class TestAsyncTcpMaster(unittest.TestCase):
+    """the connection is closed when the stream can't be trusted anymore"""
+
+    def setUp(self):
+        """an event loop"""
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        """close the event loop"""
+        self.loop.close()
+
+    def run_slave(self, answers):
+        """start a slave and returns a master connected to it and the slave"""
+        slave = ScriptedSlave(answers)
+        slave.start()
+        return (modbus_async.AsyncTcpMaster(port=slave.port, timeout_in_sec=2.0), slave)
+
+    def read(self, master):
+        """read 1 holding register"""
+        return self.loop.run_until_complete(master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 1))
+
+    def test_read(self):
+        """the requests are sent on the same connection"""
+        (master, slave) = self.run_slave([lambda request: read_response(request, 12)] * 2)
+        self.assertEqual(self.read(master), (12, ))
+        self.assertEqual(self.read(master), (12, ))
+        self.loop.run_until_complete(master.close())
+        slave.join(2.0)
+        self.assertEqual(slave.nb_connections, 1)
+
+    def test_invalid_mbap_length(self):
+        """a mbap with a length of 0 followed by garbage: the next request is sent on a new connection"""
+        (master, slave) = self.run_slave([
+            lambda request: request[:4] + b"\x00\x00\x01\xff\xff\xff\xff",
+            lambda request: read_response(request, 34),
+        ])
+        self.assertRaises(ModbusInvalidResponseError, self.read, master)
+        self.assertFalse(master._is_opened)
+        self.assertEqual(self.read(master), (34, ))
+        self.loop.run_until_complete(master.close())
+        slave.join(2.0)
+        self.assertEqual(slave.nb_connections, 2)
+
+    def test_invalid_transaction_id(self):
+        """a response to another request: the next request is sent on a new connection"""
+        (master, slave) = self.run_slave([
+            lambda request: read_response(b"\xff\xff", 1),
+            lambda request: read_response(request, 56),
+        ])
+        self.assertRaises(Exception, self.read, master)
+        self.assertFalse(master._is_opened)
+        self.assertEqual(self.read(master), (56, ))
+        self.loop.run_until_complete(master.close())
+        slave.join(2.0)
+        self.assertEqual(slave.nb_connections, 2)
+
+
+@unittest.skipIf(modbus_async is None, "modbus_async needs python 3")
+class TestAsyncTcpServer(unittest.TestCase):
+    """the requests of the clients are handled in the event loop"""
+
+    def setUp(self):
+        """a server on a free port"""
+        self.loop = asyncio.new_event_loop()
+        self.port = find_free_port()
+        self.server = modbus_async.AsyncTcpServer(port=self.port, address="127.0.0.1")
+        self.server.add_slave(1).add_block("a", defines.HOLDING_REGISTERS, 0, 10)
+        self.loop.run_until_complete(self.server.start())
+
+    def tearDown(self):
+        """stop the server and close the event loop"""
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def test_capture_per_connection(self):
+        """the frames of each client are recorded with the id of its connection"""
+        wire_capture = capture.WireCapture()
+        self.server.set_capture(wire_capture)
+        masters = [modbus_async.AsyncTcpMaster(port=self.port, timeout_in_sec=2.0) for _ in range(2)]
+        for master in masters * 2:
+            self.assertEqual(
+                self.loop.run_until_complete(master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 1)), (0, )
+            )
+        for master in masters:
+            self.loop.run_until_complete(master.close())
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "server.cap")
+            wire_capture.save(path)
+            connections = {}
+            for (_, direction, connection_id, _) in capture.read_capture(path):
+                connections.setdefault(connection_id, []).append(direction)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(connections), 2)
+        for directions in connections.values():
+            self.assertEqual(directions, [capture.RECEIVED, capture.SENT] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
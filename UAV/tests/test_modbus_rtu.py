@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the RtuMaster reader which works out the length of the response from its first bytes.
+ Run them with python -m pytest UAV/tests, or python -m unittest discover -s tests from the UAV directory
+"""
+
+import struct
+import unittest
+
+from modbus_tk import defines
+from modbus_tk import modbus_rtu
+from modbus_tk import utils
+from modbus_tk.exceptions import ModbusError, ModbusInvalidResponseError
+
+
+def make_frame(body):
+    """returns the body followed by its crc"""
+    return body + struct.pack(">H", utils.calculate_crc(body))
+
+
+class FakeSerial(object):
+    """
+    In-memory replacement of a pyserial object: every write makes the given answer available
+    for reading. A read returns what is buffered when the requested bytes are not all there, like
+    a port which times out. The size of every read is recorded
+    """
+
+    def __init__(self, answer=b""):
+        """Constructor"""
+        self.name = "fake"
+        self.is_open = True
+        self.baudrate = 19200
+        self.timeout = 0.5
+        self.inter_byte_timeout = None
+        self.answer = answer
+        self.requests = []
+        self.read_sizes = []
+        self._in_buffer = bytearray()
+
+    def open(self):
+        """open the fake port"""
+        self.is_open = True
+
+    def close(self):
+        """close the fake port"""
+        self.is_open = False
+
+    def reset_input_buffer(self):
+        """discard what has not been read"""
+        del self._in_buffer[:]
+
+    def reset_output_buffer(self):
+        """nothing is buffered on output"""
+        pass
+
+    def flush(self):
+        """nothing is buffered on output"""
+        pass
+
+    def write(self, data):
+        """record the request and buffer the answer"""
+        self.requests.append(bytes(data))
+        self._in_buffer.extend(self.answer)
+        return len(data)
+
+    def read(self, size=1):
+        """returns up to size buffered bytes"""
+        self.read_sizes.append(size)
+        data = bytes(self._in_buffer[:size])
+        del self._in_buffer[:size]
+        return data
+
+    def pending(self):
+        """returns the bytes which have not been read"""
+        return bytes(self._in_buffer)
+
+
+class TestRtuMasterRecv(unittest.TestCase):
+    """the response is read with as few reads as possible and the read stops at the end of the frame"""
+
+    def setUp(self):
+        """a master on a fake port"""
+        self.serial = FakeSerial()
+        self.master = modbus_rtu.RtuMaster(self.serial)
+
+    def tearDown(self):
+        """close the master"""
+        self.master.close()
+
+    def test_fixed_length(self):
+        """the response of a write single register has 8 bytes: the function code is enough"""
+        response = make_frame(b"\x01\x06\x00\x05\x04\xd2")
+        self.serial.answer = response + b"\xff\xff"
+        result = self.master.execute(1, defines.WRITE_SINGLE_REGISTER, 5, output_value=1234)
+        self.assertEqual(result, (5, 1234))
+        self.assertEqual(self.serial.read_sizes, [2, 6])
+        # the bytes following the frame are not read
+        self.assertEqual(self.serial.pending(), b"\xff\xff")
+
+    def test_fixed_length_write_multiple(self):
+        """the response of a write multiple registers has 8 bytes whatever the quantity"""
+        self.serial.answer = make_frame(b"\x01\x10\x00\x00\x00\x03")
+        result = self.master.execute(1, defines.WRITE_MULTIPLE_REGISTERS, 0, output_value=[1, 2, 3])
+        self.assertEqual(result, (0, 3))
+        self.assertEqual(self.serial.read_sizes, [2, 6])
+
+    def test_byte_count(self):
+        """the length of the response of a read is given by its byte count"""
+        self.serial.answer = make_frame(b"\x01\x03\x04\x00\x01\x00\x02") + b"\xff"
+        result = self.master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 2)
+        self.assertEqual(result, (1, 2))
+        self.assertEqual(self.serial.read_sizes, [2, 1, 6])
+        self.assertEqual(self.serial.pending(), b"\xff")
+
+    def test_byte_count_coils(self):
+        """the byte count of a read coils is the number of bytes of the packed bits"""
+        self.serial.answer = make_frame(b"\x01\x01\x02\x05\x01")
+        result = self.master.execute(1, defines.READ_COILS, 0, 9)
+        self.assertEqual(result, (1, 0, 1, 0, 0, 0, 0, 0, 1))
+        self.assertEqual(self.serial.read_sizes, [2, 1, 4])
+
+    def test_exception_response(self):
+        """an exception response has 5 bytes: it is detected from the function code"""
+        self.serial.answer = make_frame(b"\x01\x83\x02") + b"\xff\xff\xff"
+        with self.assertRaises(ModbusError) as context:
+            self.master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 100)
+        self.assertEqual(context.exception.get_exception_code(), defines.ILLEGAL_DATA_ADDRESS)
+        self.assertEqual(self.serial.read_sizes, [2, 3])
+        self.assertEqual(self.serial.pending(), b"\xff\xff\xff")
+
+    def test_unknown_function_code(self):
+        """the response of an unknown function code is read until it ends with its crc"""
+        response = make_frame(b"\x01\x41\x00\x01\x02")
+        self.serial.answer = response + b"\xff\xff"
+        self.master.open()
+        self.master._send(b"")
+        self.assertEqual(self.master._recv(), response)
+        self.assertEqual(self.serial.read_sizes, [2] + [1] * (len(response) - 2))
+        self.assertEqual(self.serial.pending(), b"\xff\xff")
+
+    def test_unknown_function_code_expected_length(self):
+        """the expected length is used for a function code which doesn't tell the length"""
+        response = make_frame(b"\x01\x41\x00\x01\x02")
+        self.serial.answer = response
+        self.master.open()
+        self.master._send(b"")
+        self.assertEqual(self.master._recv(len(response)), response)
+        self.assertEqual(self.serial.read_sizes, [2, len(response) - 2])
+
+    def test_truncated_by_timeout(self):
+        """a frame cut short by the timeout is returned as received and rejected by the query"""
+        response = make_frame(b"\x01\x03\x04\x00\x01\x00\x02")
+        self.serial.answer = response[:5]
+        self.master.open()
+        self.master._send(b"")
+        self.assertEqual(self.master._recv(), response[:5])
+        # the missing bytes are read again until the port times out
+        self.assertEqual(self.serial.read_sizes, [2, 1, 6, 4])
+
+        with self.assertRaises(ModbusInvalidResponseError):
+            self.master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 2)
+
+    def test_nothing_received(self):
+        """nothing received before the timeout gives an empty response"""
+        self.master.open()
+        self.master._send(b"")
+        self.assertEqual(self.master._recv(), b"")
+        self.assertEqual(self.serial.read_sizes, [2])
+
+        with self.assertRaises(ModbusInvalidResponseError):
+            self.master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 2)
+
+    def test_system_time_set(self):
+        """the software timeout doesn't expire when the system time is set forward during the read"""
+        class JumpingTime(object):
+            """the time module of a system whose time is set an hour forward at every call"""
+            def __init__(self):
+                self.now = 0.0
+
+            def time(self):
+                self.now += 3600.0
+                return self.now
+
+            def sleep(self, duration):
+                pass
+
+        self.master.set_timeout(0.5, use_sw_timeout=True)
+        self.serial.answer = make_frame(b"\x01\x03\x04\x00\x01\x00\x02")
+        (time_module, modbus_rtu.time) = (modbus_rtu.time, JumpingTime())
+        try:
+            result = self.master.execute(1, defines.READ_HOLDING_REGISTERS, 0, 2)
+        finally:
+            modbus_rtu.time = time_module
+        self.assertEqual(result, (1, 2))
+
+
+class TestGetResponseLength(unittest.TestCase):
+    """the length of a response worked out from its first bytes"""
+
+    def test_more_bytes_needed(self):
+        """0 until the function code and the byte count are received"""
+        self.assertEqual(modbus_rtu.get_response_length(b""), 0)
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01"), 0)
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01\x03"), 0)
+
+    def test_lengths(self):
+        """fixed length, byte count, exception and unknown function code"""
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01\x06"), 8)
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01\x03\x04"), 9)
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01\x83"), 5)
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01\x41"), -1)
+        self.assertEqual(modbus_rtu.get_response_length(b"\x01\x41", 7), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
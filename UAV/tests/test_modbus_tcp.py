@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the modbus tcp masters and servers
+"""
+
+import socket
+import unittest
+
+from modbus_tk import modbus_tcp
+from modbus_tk.exceptions import InvalidArgumentError
+
+
+class TestTcpMasterPool(unittest.TestCase):
+    """the masters are borrowed and given back: they connect on their first query only"""
+
+    def setUp(self):
+        """a pool of 2 masters per slave"""
+        self.pool = modbus_tcp.TcpMasterPool(max_connections_per_host=2)
+
+    def tearDown(self):
+        """close the pool"""
+        self.pool.close()
+
+    def test_reuse(self):
+        """a master given back is borrowed again for the same slave only"""
+        master = self.pool.acquire("127.0.0.1", 1502)
+        self.pool.release(master)
+        self.assertIs(self.pool.acquire("127.0.0.1", 1502), master)
+        self.assertIsNot(self.pool.acquire("127.0.0.1", 1503), master)
+
+    def test_max_connections(self):
+        """no more than max_connections_per_host masters are borrowed for a slave"""
+        masters = [self.pool.acquire("127.0.0.1", 1502) for _ in range(2)]
+        self.assertRaises(socket.timeout, self.pool.acquire, "127.0.0.1", 1502, 0.05)
+        self.pool.release(masters[0])
+        self.assertIs(self.pool.acquire("127.0.0.1", 1502, 0.05), masters[0])
+
+    def test_double_release(self):
+        """a master given back twice would be borrowed by 2 threads"""
+        master = self.pool.acquire("127.0.0.1", 1502)
+        self.pool.release(master)
+        self.assertRaises(InvalidArgumentError, self.pool.release, master)
+        self.assertIs(self.pool.acquire("127.0.0.1", 1502), master)
+        self.assertIsNot(self.pool.acquire("127.0.0.1", 1502), master)
+
+    def test_unknown_master(self):
+        """a master which doesn't come from the pool can't be given to it"""
+        master = modbus_tcp.TcpMaster("127.0.0.1", 1502)
+        self.assertRaises(InvalidArgumentError, self.pool.release, master)
+        other_pool = modbus_tcp.TcpMasterPool()
+        master = other_pool.acquire("127.0.0.1", 1502)
+        self.assertRaises(InvalidArgumentError, self.pool.release, master)
+        other_pool.release(master)
+
+    def test_borrow(self):
+        """the master is given back when the block exits, even on error"""
+        with self.pool.borrow("127.0.0.1", 1502) as master:
+            pass
+        self.assertIs(self.pool.acquire("127.0.0.1", 1502), master)
+
+        with self.assertRaises(socket.error):
+            with self.pool.borrow("127.0.0.1", 1503) as master:
+                raise socket.error("broken link")
+        self.assertIs(self.pool.acquire("127.0.0.1", 1503), master)
+
+    def test_master_class_error(self):
+        """a master which can't be created doesn't use a connection of the slave"""
+        def failing_master_class(host, port, timeout):
+            raise socket.error("no more file descriptors")
+        pool = modbus_tcp.TcpMasterPool(max_connections_per_host=1, master_class=failing_master_class)
+        for _ in range(2):
+            self.assertRaises(socket.error, pool.acquire, "127.0.0.1", 1502, 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
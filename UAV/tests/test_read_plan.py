@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of ReadPlan and Master.read_many which read several register ranges with few requests
+"""
+
+import random
+import unittest
+
+from modbus_tk import defines
+from modbus_tk import modbus
+from modbus_tk import modbus_rtu
+from modbus_tk.exceptions import InvalidArgumentError, ModbusError
+
+
+class DatabankSerial(object):
+    """In-memory replacement of a pyserial object: the requests are answered by a databank"""
+
+    def __init__(self, databank):
+        """Constructor"""
+        self.name = "databank"
+        self.is_open = True
+        self.baudrate = 19200
+        self.timeout = 0.5
+        self.inter_byte_timeout = None
+        self.nb_requests = 0
+        self._databank = databank
+        self._in_buffer = bytearray()
+
+    def open(self):
+        """open the fake port"""
+        self.is_open = True
+
+    def close(self):
+        """close the fake port"""
+        self.is_open = False
+
+    def reset_input_buffer(self):
+        """discard what has not been read"""
+        del self._in_buffer[:]
+
+    def reset_output_buffer(self):
+        """nothing is buffered on output"""
+        pass
+
+    def flush(self):
+        """nothing is buffered on output"""
+        pass
+
+    def write(self, data):
+        """buffer the answer of the databank"""
+        self.nb_requests += 1
+        self._in_buffer.extend(self._databank.handle_request(modbus_rtu.RtuQuery(), bytes(data)))
+        return len(data)
+
+    def read(self, size=1):
+        """returns up to size buffered bytes"""
+        data = bytes(self._in_buffer[:size])
+        del self._in_buffer[:size]
+        return data
+
+
+def execute_plan(plan, memory):
+    """returns the values of the ranges of the plan read from the memory (a list of registers)"""
+    results = [
+        tuple(memory[starting_address:starting_address + quantity])
+        for (starting_address, quantity) in plan.requests
+    ]
+    return plan.map_results(results)
+
+
+class TestReadPlan(unittest.TestCase):
+    """requests worked out from the ranges"""
+
+    def test_separate_ranges(self):
+        """ranges separated by more than max_gap are read separately"""
+        plan = modbus.ReadPlan([(20, 2), (0, 4)], max_gap=3)
+        self.assertEqual(plan.requests, [(0, 4), (20, 2)])
+        self.assertEqual(plan.round_trips, 2)
+        self.assertEqual(plan.saved_round_trips, 0)
+
+    def test_gap(self):
+        """ranges separated by max_gap registers or less are merged"""
+        plan = modbus.ReadPlan([(0, 4), (6, 2), (11, 1)], max_gap=3)
+        self.assertEqual(plan.requests, [(0, 12)])
+        self.assertEqual(plan.saved_round_trips, 2)
+        plan = modbus.ReadPlan([(0, 4), (6, 2), (11, 1)], max_gap=2)
+        self.assertEqual(plan.requests, [(0, 8), (11, 1)])
+
+    def test_touching_ranges(self):
+        """touching ranges are merged only if max_gap is given"""
+        self.assertEqual(modbus.ReadPlan([(0, 4), (4, 4)]).requests, [(0, 4), (4, 4)])
+        self.assertEqual(modbus.ReadPlan([(0, 4), (4, 4)], max_gap=0).requests, [(0, 8)])
+
+    def test_overlapping_ranges(self):
+        """overlapping or included ranges are always merged"""
+        self.assertEqual(modbus.ReadPlan([(0, 4), (2, 4)]).requests, [(0, 6)])
+        self.assertEqual(modbus.ReadPlan([(0, 10), (2, 4), (0, 10)]).requests, [(0, 10)])
+
+    def test_max_quantity(self):
+        """long ranges are split and merged requests are not longer than max_quantity"""
+        plan = modbus.ReadPlan([(0, 300)])
+        self.assertEqual(plan.requests, [(0, 125), (125, 125), (250, 50)])
+        self.assertEqual(plan.saved_round_trips, 0)
+        plan = modbus.ReadPlan([(0, 6), (6, 6)], max_gap=0, max_quantity=10)
+        self.assertEqual(plan.requests, [(0, 6), (6, 6)])
+        plan = modbus.ReadPlan([(0, 6), (3, 6)], max_quantity=5)
+        self.assertEqual(plan.requests, [(0, 5), (5, 4)])
+
+    def test_invalid_arguments(self):
+        """negative gap, quantity out of range"""
+        self.assertRaises(InvalidArgumentError, modbus.ReadPlan, [(0, 1)], -1)
+        self.assertRaises(InvalidArgumentError, modbus.ReadPlan, [(0, 1)], 0, 0)
+        self.assertRaises(InvalidArgumentError, modbus.ReadPlan, [(0, 1)], 0, 126)
+        self.assertRaises(InvalidArgumentError, modbus.ReadPlan, [(0, 0)])
+
+    def test_map_results(self):
+        """the values of every range in the order of the ranges"""
+        memory = list(range(1000, 1300))
+        ranges = [(250, 10), (0, 3), (2, 260), (100, 1)]
+        plan = modbus.ReadPlan(ranges, max_gap=5)
+        self.assertEqual(
+            execute_plan(plan, memory),
+            [tuple(memory[address:address + quantity]) for (address, quantity) in ranges]
+        )
+
+    def test_random_layouts(self):
+        """random ranges, gaps and quantities: the values are right and the requests are valid"""
+        draw = random.Random(3)
+        memory = list(range(2000))
+        for _ in range(2000):
+            ranges = [(draw.randrange(1500), draw.randint(1, 200)) for _ in range(draw.randint(1, 12))]
+            max_gap = draw.choice((None, 0, 1, 5, 50))
+            max_quantity = draw.randint(1, 125)
+            plan = modbus.ReadPlan(ranges, max_gap, max_quantity)
+
+            self.assertEqual(
+                execute_plan(plan, memory),
+                [tuple(memory[address:address + quantity]) for (address, quantity) in ranges]
+            )
+            read = set()
+            for (address, quantity) in plan.requests:
+                self.assertTrue(0 < quantity <= max_quantity)
+                # no register is read twice
+                self.assertFalse(read.intersection(range(address, address + quantity)))
+                read.update(range(address, address + quantity))
+            self.assertEqual(plan.requests, sorted(plan.requests))
+            wanted = set(
+                register for (address, quantity) in ranges for register in range(address, address + quantity)
+            )
+            if max_gap is None:
+                # only the registers of the ranges are read
+                self.assertEqual(read, wanted)
+            else:
+                self.assertTrue(wanted.issubset(read))
+
+
+class TestReadMany(unittest.TestCase):
+    """read_many against a slave"""
+
+    def setUp(self):
+        """a slave with 2 contiguous blocks"""
+        databank = modbus.Databank()
+        slave = databank.add_slave(1)
+        slave.add_block("a", defines.HOLDING_REGISTERS, 0, 10)
+        slave.add_block("b", defines.HOLDING_REGISTERS, 10, 10)
+        slave.set_values("a", 0, list(range(10)))
+        slave.set_values("b", 10, list(range(100, 110)))
+        self.serial = DatabankSerial(databank)
+        self.master = modbus_rtu.RtuMaster(self.serial)
+
+    def tearDown(self):
+        """close the master"""
+        self.master.close()
+
+    def test_read_many(self):
+        """the values of every range"""
+        values = self.master.read_many(1, [(8, 2), (0, 2), (1, 3)])
+        self.assertEqual(values, [(8, 9), (0, 1), (1, 2, 3)])
+        self.assertEqual(self.serial.nb_requests, 2)
+
+    def test_touching_ranges_of_2_blocks(self):
+        """touching ranges are not merged by default: a read across 2 blocks is refused by the slave"""
+        self.assertEqual(self.master.read_many(1, [(8, 2), (10, 2)]), [(8, 9), (100, 101)])
+        self.assertEqual(self.serial.nb_requests, 2)
+        with self.assertRaises(ModbusError) as context:
+            self.master.read_many(1, [(8, 2), (10, 2)], max_gap=0)
+        self.assertEqual(context.exception.get_exception_code(), defines.ILLEGAL_DATA_ADDRESS)
+
+    def test_plan_reused(self):
+        """a plan is computed once and read several times"""
+        plan = modbus.ReadPlan([(12, 2), (15, 1)], max_gap=1)
+        self.assertEqual(self.master.read_many(1, plan), [(102, 103), (105, )])
+        self.assertEqual(self.master.read_many(1, plan), [(102, 103), (105, )])
+        self.assertEqual(self.serial.nb_requests, 2)
+
+    def test_function_code(self):
+        """only the registers can be read"""
+        self.assertRaises(InvalidArgumentError, self.master.read_many, 1, [(0, 1)], defines.READ_COILS)
+
+
+if __name__ == "__main__":
+    unittest.main()
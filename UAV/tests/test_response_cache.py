@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the response cache of the servers: a response is never sent again after its block is written
+"""
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+from modbus_tk import defines
+from modbus_tk import hooks
+from modbus_tk import modbus
+from modbus_tk import modbus_rtu
+from modbus_tk import utils
+
+
+def rtu_frame(slave_id, pdu):
+    """returns the rtu frame of the pdu"""
+    frame = struct.pack(">B", slave_id) + pdu
+    return frame + struct.pack(">H", utils.calculate_crc(frame))
+
+
+def read_frame(address, quantity, slave_id=1):
+    """returns the frame of a read of holding registers"""
+    return rtu_frame(slave_id, struct.pack(">BHH", defines.READ_HOLDING_REGISTERS, address, quantity))
+
+
+class RtuHandler(modbus.Server):
+    """a server handling the rtu frames given to it"""
+
+    def _make_query(self):
+        """the rtu frames"""
+        return modbus_rtu.RtuQuery()
+
+    def handle(self, request):
+        """returns the response to the request"""
+        return self._handle(request)
+
+
+class TestResponseCache(unittest.TestCase):
+    """the responses are read again from the blocks after every write"""
+
+    def setUp(self):
+        """a server with a cache and a slave counting the requests it handles"""
+        self.server = RtuHandler()
+        self.server.set_response_cache()
+        self.slave = self.add_slave(1)
+
+    def add_slave(self, slave_id):
+        """returns a new slave with 2 blocks of registers"""
+        slave = self.server.add_slave(slave_id)
+        slave.add_block("a", defines.HOLDING_REGISTERS, 0, 10)
+        slave.add_block("b", defines.HOLDING_REGISTERS, 100, 10)
+        slave.nb_requests = 0
+
+        def count(args):
+            args[0].nb_requests += 1
+        hooks.install_hook("modbus.Slave.handle_request", count, slave)
+        return slave
+
+    def read(self, address, quantity, slave_id=1):
+        """returns the values read by the server"""
+        response = self.server.handle(read_frame(address, quantity, slave_id))
+        self.assertEqual(response[:3], struct.pack(">BBB", slave_id, defines.READ_HOLDING_REGISTERS, 2 * quantity))
+        return struct.unpack(">{0}H".format(quantity), response[3:-2])
+
+    def assert_cached(self, address, quantity, values, slave_id=1):
+        """the read returns the values without calling the slave"""
+        slave = self.server.get_slave(slave_id)
+        nb_requests = slave.nb_requests
+        self.assertEqual(self.read(address, quantity, slave_id), values)
+        self.assertEqual(slave.nb_requests, nb_requests)
+
+    def assert_fresh(self, address, quantity, values, slave_id=1):
+        """the read returns the values read by the slave"""
+        slave = self.server.get_slave(slave_id)
+        nb_requests = slave.nb_requests
+        self.assertEqual(self.read(address, quantity, slave_id), values)
+        self.assertEqual(slave.nb_requests, nb_requests + 1)
+
+    def test_reuse(self):
+        """the response is reused while the block is not written"""
+        self.assert_fresh(0, 2, (0, 0))
+        self.assert_cached(0, 2, (0, 0))
+        # another request has its own entry
+        self.assert_fresh(0, 3, (0, 0, 0))
+        self.assert_cached(0, 2, (0, 0))
+
+    def test_set_values(self):
+        """a write of the slave invalidates the responses of its block only"""
+        self.assert_fresh(0, 2, (0, 0))
+        self.assert_fresh(100, 2, (0, 0))
+        self.slave.set_values("a", 1, 5)
+        self.assert_fresh(0, 2, (0, 5))
+        self.assert_cached(0, 2, (0, 5))
+        self.assert_cached(100, 2, (0, 0))
+
+    def test_apply_updates(self):
+        """a batch written through the server invalidates the responses of every block written"""
+        self.assert_fresh(0, 2, (0, 0))
+        self.assert_fresh(100, 2, (0, 0))
+        self.server.apply_updates([(1, "a", 0, [1, 2]), (1, "b", 101, 3)])
+        self.assert_fresh(0, 2, (1, 2))
+        self.assert_fresh(100, 2, (0, 3))
+
+    def test_write_request(self):
+        """a write request handled by the server invalidates the responses of the block"""
+        self.assert_fresh(0, 2, (0, 0))
+        request = rtu_frame(1, struct.pack(">BHH", defines.WRITE_SINGLE_REGISTER, 0, 7))
+        self.assertEqual(self.server.handle(request), request)
+        self.assert_fresh(0, 2, (7, 0))
+
+    def test_replaced_slave(self):
+        """the responses of a removed slave are not sent for the new slave with the same id"""
+        self.assert_fresh(0, 2, (0, 0))
+        self.server.remove_slave(1)
+        self.add_slave(1).set_values("a", 0, [4, 5])
+        self.assert_fresh(0, 2, (4, 5))
+
+    def test_errors_not_cached(self):
+        """the exception responses are built again"""
+        nb_requests = self.slave.nb_requests
+        for _ in range(2):
+            response = self.server.handle(read_frame(5, 10))
+            self.assertEqual(response[1:3], struct.pack(">BB", 0x83, defines.ILLEGAL_DATA_ADDRESS))
+        self.assertEqual(self.slave.nb_requests, nb_requests + 2)
+
+    def test_max_entries(self):
+        """the least recently used response is evicted"""
+        self.server.set_response_cache(2)
+        self.assert_fresh(0, 1, (0, ))
+        self.assert_fresh(0, 2, (0, 0))
+        self.assert_cached(0, 1, (0, ))
+        self.assert_fresh(0, 3, (0, 0, 0))
+        self.assert_cached(0, 1, (0, ))
+        self.assert_fresh(0, 2, (0, 0))
+        self.server.set_response_cache(0)
+        self.assert_fresh(0, 1, (0, ))
+        self.assert_fresh(0, 1, (0, ))
+
+
+@unittest.skipIf(sys.version_info[0] < 3, "shared_bank needs python 3")
+class TestSharedBlockNotCached(unittest.TestCase):
+    """the registers written by another process are never served from the cache"""
+
+    def setUp(self):
+        """a server with a cache reading the registers of a shared bank"""
+        from modbus_tk import shared_bank
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "bank")
+        self.bank = shared_bank.SharedRegisterBank(path, 10)
+        # the producer maps the same file
+        self.producer = shared_bank.SharedRegisterBank(path)
+        self.server = RtuHandler()
+        self.server.set_response_cache()
+        self.slave = self.server.add_slave(1)
+        self.slave.add_block("shared", defines.HOLDING_REGISTERS, 0, 10, buffer=self.bank.registers(0, 10))
+
+    def tearDown(self):
+        """remove the block before closing the banks"""
+        self.slave.remove_block("shared")
+        self.bank.close()
+        self.producer.close()
+        shutil.rmtree(self.directory)
+
+    def test_written_by_producer(self):
+        """every read sees the last values of the producer"""
+        for value in range(5):
+            self.producer.write(2, (value, value + 1))
+            response = self.server.handle(read_frame(2, 2))
+            self.assertEqual(struct.unpack(">HH", response[3:-2]), (value, value + 1))
+        self.assertEqual(len(self.server._response_cache), 0)
+
+    def test_written_by_server(self):
+        """the writes of the server are read back too"""
+        self.server.handle(read_frame(0, 1))
+        self.slave.set_values("shared", 0, 9)
+        self.assertEqual(struct.unpack(">H", self.server.handle(read_frame(0, 1))[3:-2]), (9, ))
+        self.assertEqual(self.bank.read(0, 1), (9, ))
+
+
+if __name__ == "__main__":
+    unittest.main()
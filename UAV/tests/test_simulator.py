@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the batch rpc port of the simulator
+"""
+
+import socket
+import threading
+import unittest
+
+from modbus_tk import simulator
+
+
+class RecordingSimulator(object):
+    """answers every command with its name and records the batches"""
+
+    def __init__(self):
+        """Constructor"""
+        self.batches = []
+        self.executed = threading.Event()
+
+    def execute_batch(self, cmds):
+        """record the commands and returns their answers"""
+        self.batches.append(cmds)
+        self.executed.set()
+        return ["%s done\r\n" % cmd.strip("\r\n") for cmd in cmds]
+
+
+class TestBatchRpcHandler(unittest.TestCase):
+    """the commands of a batch are all executed at once or not at all"""
+
+    def setUp(self):
+        """a batch rpc interface on a free port"""
+        self.simulator = RecordingSimulator()
+        self.rpc = simulator.RpcInterface(0, simulator.BatchRpcHandler, self.simulator)
+        self.rpc.start()
+        self.sock = socket.create_connection(("127.0.0.1", self.rpc.rpc_server.server_address[1]), 2.0)
+        self.answers = self.sock.makefile("rb")
+
+    def tearDown(self):
+        """close the client and the interface"""
+        self.answers.close()
+        self.sock.close()
+        self.rpc.close()
+
+    def send(self, lines):
+        """send the lines to the interface"""
+        self.sock.sendall(lines.encode("ascii"))
+
+    def read_answers(self):
+        """returns the answers until the interface closes the connection"""
+        return [line.decode("ascii") for line in self.answers]
+
+    def test_batches(self):
+        """a command alone or a batch of commands: the connection stays open"""
+        self.send("a\r\nbatch 2\r\nb\r\nc\r\nbatch 0\r\nd\r\n")
+        self.assertEqual([self.answers.readline() for _ in range(4)],
+                         [b"a done\r\n", b"b done\r\n", b"c done\r\n", b"d done\r\n"])
+        self.assertEqual(self.simulator.batches, [["a\r\n"], ["b\r\n", "c\r\n"], [], ["d\r\n"]])
+
+    def test_invalid_count(self):
+        """the connection is closed after a batch without a valid count: the next lines are not executed"""
+        for header in ("batch x", "batch -1", "batch", "batch 1 2"):
+            self.send(header + "\r\na\r\n")
+            answers = self.read_answers()
+            self.assertEqual(len(answers), 1, header)
+            self.assertTrue(answers[0].startswith("batch error: "), header)
+            self.assertEqual(self.simulator.batches, [], header)
+            self.tearDown()
+            self.setUp()
+
+    def test_disconnected_in_batch(self):
+        """nothing is executed when the client disconnects before the end of the batch"""
+        for lines in ("batch 3\r\na\r\nb\r\n", "batch 2\r\na\r\nb"):
+            self.send(lines)
+            self.sock.shutdown(socket.SHUT_WR)
+            self.assertEqual(self.read_answers(), [], lines)
+            self.assertEqual(self.simulator.batches, [], lines)
+            self.tearDown()
+            self.setUp()
+
+        # the interface still handles the other clients
+        self.send("batch 1\r\na\r\n")
+        self.assertEqual(self.answers.readline(), b"a done\r\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
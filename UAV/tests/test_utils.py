@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ Modbus TestKit: Implementation of Modbus protocol in python
+
+ (C)2009 - Luc Jean - luc.jean@gmail.com
+ (C)2009 - Apidev - http://www.apidev.fr
+
+ This is distributed under GNU LGPL license, see license.txt
+
+ Tests of the helpers of modbus_tk.utils
+"""
+
+import random
+import struct
+import threading
+import unittest
+
+from modbus_tk import defines
+from modbus_tk import modbus_rtu
+from modbus_tk import utils
+
+
+def reference_crc(data):
+    """the crc16 of modbus computed bit by bit, as it is specified"""
+    crc = 0xFFFF
+    for byte in bytearray(data):
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    # calculate_crc returns the crc with its low byte first, as it is sent
+    return ((crc & 0xFF) << 8) | (crc >> 8)
+
+
+# frames with their crc as sent on the line
+KNOWN_FRAMES = (
+    b"\x01\x03\x00\x00\x00\x0a\xc5\xcd",
+    b"\x01\x04\x00\x00\x00\x01\x31\xca",
+    b"\x11\x03\x00\x6b\x00\x03\x76\x87",
+    b"123456789\x37\x4b",
+)
+
+
+class TestCrc(unittest.TestCase):
+    """calculate_crc and Crc16 against known frames and the bit by bit crc"""
+
+    def test_known_frames(self):
+        """the crc of the frames as bytes, bytearray and memoryview"""
+        for frame in KNOWN_FRAMES:
+            (expected, ) = struct.unpack(">H", frame[-2:])
+            for data in (frame[:-2], bytearray(frame[:-2]), memoryview(frame[:-2]), memoryview(frame)[:-2]):
+                self.assertEqual(utils.calculate_crc(data), expected, repr(frame))
+                self.assertEqual(utils.Crc16(data).value(), expected, repr(frame))
+            self.assertTrue(utils.Crc16(frame).is_valid())
+            self.assertFalse(utils.Crc16(frame[:-1]).is_valid())
+
+    def test_lengths(self):
+        """short frames use the byte table and long frames the word table: odd and even lengths"""
+        draw = random.Random(1)
+        for length in list(range(40)) + [255, 256]:
+            data = bytes(bytearray(draw.randrange(256) for _ in range(length)))
+            expected = reference_crc(data)
+            for value in (data, bytearray(data), memoryview(data)):
+                self.assertEqual(utils.calculate_crc(value), expected, length)
+                self.assertEqual(utils.Crc16(value).value(), expected, length)
+
+    def test_incremental(self):
+        """Crc16 fed byte by byte or by chunks gives the crc of the whole frame"""
+        draw = random.Random(2)
+        data = bytes(bytearray(draw.randrange(256) for _ in range(100)))
+        crc = utils.Crc16()
+        for i in range(len(data)):
+            crc.update(data[i:i + 1])
+        self.assertEqual(crc.value(), reference_crc(data))
+
+        crc = utils.Crc16()
+        start = 0
+        while start < len(data):
+            end = start + draw.randint(1, 20)
+            crc.update(bytearray(data[start:end]) if start % 2 else memoryview(data)[start:end])
+            start = end
+        self.assertEqual(crc.value(), reference_crc(data))
+
+        frame = data + struct.pack(">H", crc.value())
+        self.assertTrue(crc.update(frame[-2:]).is_valid())
+
+
+# 1.5 and -2.25 as big-endian floats
+ABCD_FLOATS = b"\x3f\xc0\x00\x00\xc0\x10\x00\x00"
+
+
+class StubSerial(object):
+    """a closed port: enough for preparing the requests of a RtuMaster"""
+    name = "stub"
+    is_open = False
+    baudrate = 19200
+    timeout = 0.5
+    inter_byte_timeout = None
+
+
+class TestReorderBytes(unittest.TestCase):
+    """conversion of the registers data between big-endian and the word orders"""
+
+    def test_word_orders(self):
+        """the 4 word orders of 2 floats"""
+        expected = {
+            defines.WORD_ORDER_ABCD: b"\x3f\xc0\x00\x00\xc0\x10\x00\x00",
+            defines.WORD_ORDER_BADC: b"\xc0\x3f\x00\x00\x10\xc0\x00\x00",
+            defines.WORD_ORDER_CDAB: b"\x00\x00\x3f\xc0\x00\x00\xc0\x10",
+            defines.WORD_ORDER_DCBA: b"\x00\x00\xc0\x3f\x00\x00\x10\xc0",
+        }
+        for (word_order, data) in expected.items():
+            self.assertEqual(bytes(utils.reorder_bytes(ABCD_FLOATS, word_order)), data, word_order)
+            # every reordering is its own inverse
+            self.assertEqual(bytes(utils.reorder_bytes(data, word_order)), ABCD_FLOATS, word_order)
+
+    def test_input_types(self):
+        """bytes, bytearray and memoryview give the same result"""
+        for data in (ABCD_FLOATS, bytearray(ABCD_FLOATS), memoryview(ABCD_FLOATS)):
+            self.assertEqual(
+                bytes(utils.reorder_bytes(data, defines.WORD_ORDER_CDAB)), b"\x00\x00\x3f\xc0\x00\x00\xc0\x10"
+            )
+
+    def test_invalid_length(self):
+        """the data must be made of whole groups"""
+        self.assertRaises(ValueError, utils.reorder_bytes, b"\x00" * 6, defines.WORD_ORDER_CDAB)
+        self.assertRaises(ValueError, utils.reorder_bytes, b"\x00" * 3, defines.WORD_ORDER_BADC)
+        self.assertEqual(bytes(utils.reorder_bytes(b"\x00" * 3, defines.WORD_ORDER_ABCD)), b"\x00" * 3)
+
+    def test_prepared_requests(self):
+        """the word order of the registers written and read by a master"""
+        master = modbus_rtu.RtuMaster(StubSerial())
+        for word_order in utils.WORD_ORDER_PERMUTATIONS:
+            line_data = bytes(utils.reorder_bytes(ABCD_FLOATS, word_order))
+
+            prepared = master.prepare(
+                1, defines.WRITE_MULTIPLE_REGISTERS, 0, output_value=[1.5, -2.25], data_format=">ff",
+                word_order=word_order
+            )
+            # the data is followed by the crc
+            self.assertEqual(prepared.request[-10:-2], line_data, word_order)
+
+            prepared = master.prepare(
+                1, defines.READ_HOLDING_REGISTERS, 0, 4, data_format=">ff", word_order=word_order
+            )
+            response_pdu = struct.pack(">BB", defines.READ_HOLDING_REGISTERS, 8) + line_data
+            self.assertEqual(prepared.decode(response_pdu), (1.5, -2.25), word_order)
+
+
+def reference_pack(values):
+    """the values packed bit by bit: the first value is the least significant bit of the first byte"""
+    data = bytearray((len(values) + 7) // 8)
+    for (i, value) in enumerate(values):
+        if value:
+            data[i // 8] |= 1 << (i % 8)
+    return bytes(data)
+
+
+class TestPackBits(unittest.TestCase):
+    """bits packed 8 per byte like the modbus coils"""
+
+    def test_known_values(self):
+        """the coils 20 to 29 of the example of the modbus specification"""
+        values = [1, 0, 1, 1, 0, 0, 1, 1, 1, 0]
+        self.assertEqual(utils.pack_bits(values), b"\xcd\x01")
+        self.assertEqual(utils.unpack_bits(b"\xcd\x01", 10), tuple(values))
+        self.assertEqual(utils.pack_bits([]), b"")
+        self.assertEqual(utils.unpack_bits(b"", 0), ())
+
+    def test_lengths(self):
+        """every length up to 5 bytes: the unused bits of the last byte are 0 and ignored"""
+        draw = random.Random(5)
+        for length in range(41):
+            values = [draw.randint(0, 1) for _ in range(length)]
+            data = utils.pack_bits(values)
+            self.assertEqual(data, reference_pack(values), length)
+            self.assertEqual(utils.unpack_bits(data, length), tuple(values), length)
+            # the unused bits set by another device are ignored
+            if length % 8:
+                padded = data[:-1] + struct.pack(">B", bytearray(data)[-1] | (0xff << (length % 8)) & 0xff)
+                self.assertEqual(utils.unpack_bits(padded, length), tuple(values), length)
+            for view in (bytearray(data), memoryview(data)):
+                self.assertEqual(utils.unpack_bits(view, length), tuple(values), length)
+
+    def test_true_values(self):
+        """any true value is 1"""
+        values = [True, False, 2, 0, -1, 300, None, 0.5, 1]
+        self.assertEqual(utils.pack_bits(values), reference_pack(values))
+        self.assertEqual(utils.unpack_bits(utils.pack_bits(values), len(values)), (1, 0, 1, 0, 1, 1, 0, 1, 1))
+
+    def test_int_bytes(self):
+        """the little-endian conversions used for shifting the packed bits"""
+        for (value, length) in ((0, 0), (0, 1), (1, 1), (0x1234, 2), (0x1234, 3), (2 ** 64 - 1, 8)):
+            data = utils.int_to_bytes(value, length)
+            self.assertEqual(len(data), length)
+            self.assertEqual(utils.bytes_to_int(data), value)
+            self.assertEqual(utils.bytes_to_int(bytearray(data)), value)
+        self.assertEqual(utils.int_to_bytes(0x1234, 2), b"\x34\x12")
+
+
+# how long a thread is given for taking a lock which is free
+WAIT_TIME = 2.0
+# how long a thread is watched for not taking a lock which isn't free
+BLOCKED_TIME = 0.1
+
+
+def start_thread(target):
+    """call target in a thread and returns an event set when it returns"""
+    done = threading.Event()
+
+    def run():
+        target()
+        done.set()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return done
+
+
+class TestReadWriteLock(unittest.TestCase):
+    """many readers or one writer"""
+
+    def setUp(self):
+        """a lock"""
+        self.lock = utils.ReadWriteLock()
+
+    def read(self):
+        """take and release the read lock"""
+        with self.lock.read_lock:
+            pass
+
+    def write(self):
+        """take and release the write lock"""
+        with self.lock.write_lock:
+            pass
+
+    def assert_blocked(self, done):
+        """the thread waits for the lock held by the test"""
+        self.assertFalse(done.wait(BLOCKED_TIME))
+
+    def test_concurrent_readers(self):
+        """a reader doesn't wait for the others"""
+        with self.lock.read_lock:
+            self.assertTrue(start_thread(self.read).wait(WAIT_TIME))
+
+    def test_writer_excludes_readers(self):
+        """the readers wait for the writer"""
+        self.lock.acquire_write()
+        done = start_thread(self.read)
+        self.assert_blocked(done)
+        self.lock.release_write()
+        self.assertTrue(done.wait(WAIT_TIME))
+
+    def test_readers_exclude_writer(self):
+        """the writer waits for the readers"""
+        self.lock.acquire_read()
+        done = start_thread(self.write)
+        self.assert_blocked(done)
+        self.lock.release_read()
+        self.assertTrue(done.wait(WAIT_TIME))
+
+    def test_writer_excludes_writer(self):
+        """the writers wait for each other"""
+        with self.lock:
+            done = start_thread(self.write)
+            self.assert_blocked(done)
+        self.assertTrue(done.wait(WAIT_TIME))
+
+    def test_waiting_writer_first(self):
+        """a new reader waits for the writer waiting for the current readers"""
+        self.lock.acquire_read()
+        written = start_thread(self.write)
+        self.assert_blocked(written)
+        read = start_thread(self.read)
+        self.assert_blocked(read)
+        # the reentrant read of a thread reading already doesn't wait for the writer
+        self.read()
+        self.lock.release_read()
+        self.assertTrue(written.wait(WAIT_TIME))
+        self.assertTrue(read.wait(WAIT_TIME))
+
+    def test_reentrant(self):
+        """the writer can read and write again"""
+        with self.lock.write_lock:
+            with self.lock.write_lock:
+                with self.lock.read_lock:
+                    pass
+            done = start_thread(self.read)
+            self.assert_blocked(done)
+        self.assertTrue(done.wait(WAIT_TIME))
+        self.assertTrue(start_thread(self.write).wait(WAIT_TIME))
+
+    def test_upgrade(self):
+        """a reader can't become a writer and only the writer releases the write lock"""
+        with self.lock.read_lock:
+            self.assertRaises(RuntimeError, self.lock.acquire_write)
+        self.assertRaises(RuntimeError, self.lock.release_write)
+        self.lock.acquire_write()
+        errors = []
+
+        def release():
+            try:
+                self.lock.release_write()
+            except RuntimeError as msg:
+                errors.append(msg)
+        self.assertTrue(start_thread(release).wait(WAIT_TIME))
+        self.assertEqual(len(errors), 1)
+        self.lock.release_write()
+        self.assertTrue(start_thread(self.write).wait(WAIT_TIME))
+
+
+class TestExclusiveLock(unittest.TestCase):
+    """the readers wait for each other"""
+
+    def test_readers_exclude_each_other(self):
+        """the lock is reentrant and held by one thread"""
+        lock = utils.ExclusiveLock()
+
+        def read():
+            with lock.read_lock:
+                pass
+        with lock.read_lock:
+            with lock.write_lock:
+                pass
+            done = start_thread(read)
+            self.assertFalse(done.wait(BLOCKED_TIME))
+        self.assertTrue(done.wait(WAIT_TIME))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,6 +9,7 @@ import modbus_tk.defines as cst
 import modbus_tk.modbus_rtu as modbus_rtu
 import modbus_tk.exceptions
 import modbus_tk.modbus
+from modbus_tk.capture import WireCapture
 import numpy as np
 import serial
 import serial.tools.list_ports
@@ -33,22 +34,27 @@ class Modbus:
 
         self.master = modbus_rtu.RtuMaster(con)
         self.master.set_timeout(timeout)
-        self.master.set_verbose(True)
+        # the last frames are recorded without slowing the poll: python -m modbus_tk.capture uav.cap
+        self.capture = WireCapture(max_records=10000)
+        self.master.set_capture(self.capture)
+
+        n = 5
+        f = ">" + "f" * n
+        self.request = self.master.prepare(
+            slave=1,
+            function_code=cst.READ_INPUT_REGISTERS,
+            starting_address=1006,
+            quantity_of_x=2 * n,
+            data_format=f,
+            word_order=cst.WORD_ORDER_CDAB
+        )
 
         self.x = 0
         self.y = 0
 
     def get_data(self):
         try:
-            n = 5
-            f = ">" + "f" * n
-            data = self.master.execute(
-                slave=1,
-                function_code=cst.READ_INPUT_REGISTERS,
-                starting_address=1006,
-                quantity_of_x=2 * n,
-                data_format=f
-            )
+            data = self.master.execute_prepared(self.request)
 
             self.x = data[3]
             self.y = data[4]
@@ -68,7 +74,7 @@ class Modbus:
         return self
 
     def __exit__(self, *argv):
-        pass
+        self.capture.save("uav.cap")
 
     def flushInput(self):
         pass
@@ -61,7 +61,7 @@ def main():
         while True:
             t = time.time() - 0
             new_signal = signal.get_signal(t)
-            slave1.set_values("b", 0x00, new_signal)
+            server.apply_updates([(1, "b", 0x00, new_signal)])
             print(new_signal)
 
             time.sleep(0.1)